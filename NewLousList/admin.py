@@ -1,16 +1,15 @@
 from django.contrib import admin
 
-from NewLousList.models import FriendRequest, FriendList, ShoppingCart, Comments, UserInfo
+from NewLousList.models import FriendRequest, Friendship, ShoppingCart, Comments, UserInfo
 
-class FriendListAdmin(admin.ModelAdmin):
-    list_filter = ['user']
-    list_display = ['user']
-    search_fields = ['user']
+class FriendshipAdmin(admin.ModelAdmin):
+    list_display = ['user_a', 'user_b', 'created_at']
+    search_fields = ['user_a__username', 'user_b__username']
 
     class Meta:
-        model = FriendList
+        model = Friendship
 
-admin.site.register(FriendList, FriendListAdmin)
+admin.site.register(Friendship, FriendshipAdmin)
 
 class FriendRequestAdmin(admin.ModelAdmin):
     list_filter = ['sender', 'receiver']
@@ -0,0 +1,262 @@
+import hashlib, json
+import time as clock
+from datetime import time
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Subject, Course, Meeting, EnrollmentSnapshot, ShoppingCart
+from . import upstream
+from .scheduling import bits_to_bytes
+from .notifications import notify_seat_openings
+from .jobs import queue_department_sync, queue_subject_sync
+from .names import get_names, college_arts_sci, engr_school, edu_hum_dev_school, other_schools
+
+LUTHERS_LIST_API = 'http://luthers-list.herokuapp.com/api/'
+
+# fields that get overwritten when a course we already have comes back from the api
+COURSE_UPDATE_FIELDS = [
+    'instructor_name', 'instructor_email', 'course_section', 'subject', 'catalog_number',
+    'description', 'units', 'component', 'class_capacity', 'wait_list', 'wait_cap',
+    'enrollment_total', 'enrollment_available', 'topic', 'meetings', 'static_hash', 'occupancy',
+]
+
+# seat counts change all through registration; everything else about a section rarely does
+VOLATILE_FIELDS = ['enrollment_total', 'enrollment_available', 'wait_list']
+# static_hash and occupancy are worked out from the other fields
+STATIC_FIELDS = [field for field in COURSE_UPDATE_FIELDS if field not in VOLATILE_FIELDS + ['static_hash', 'occupancy']]
+
+
+# Department payloads come from upstream's stale-while-revalidate cache. Pages take whatever
+# is cached and a stale payload queues a sync job for run_worker, which also brings the
+# database up to date; the jobs and sync_catalog pass max_age=0 so they always revalidate.
+def fetch_department_list(max_age=upstream.FRESH_SECONDS):
+    return upstream.cached_json('deptlist', LUTHERS_LIST_API + 'deptlist?format=json', max_age,
+                                on_stale=queue_subject_sync)
+
+
+def fetch_department(subject, max_age=upstream.FRESH_SECONDS):
+    return upstream.cached_json('dept:' + subject, LUTHERS_LIST_API + 'dept/' + subject + '?format=json', max_age,
+                                on_stale=lambda: queue_department_sync(subject))
+
+
+# converts the api's "HH.MM.SS.ffffff-05:00" times to "HH:MM XM"
+# times that are already converted or empty are left alone
+def normalize_time(value):
+    if not value or value[-2:] in ('AM', 'PM'):
+        return value
+    return time(int(value[0:2]), int(value[3:5])).strftime('%I:%M %p')
+
+
+def normalize_meetings(meetings):
+    for meeting in meetings:
+        # only convert if both start and end times have actual values to them
+        if meeting['start_time'] != '' and meeting['end_time'] != '':
+            meeting['start_time'] = normalize_time(meeting['start_time'])
+            meeting['end_time'] = normalize_time(meeting['end_time'])
+    return meetings
+
+
+# builds an unsaved Course from one entry of /api/dept/<subject>
+def course_from_api(course):
+    c = Course(
+        instructor_name=course['instructor']['name'],
+        instructor_email=course['instructor']['email'],
+        course_number=course['course_number'],
+        semester_code=course['semester_code'],
+        course_section=course['course_section'],
+        subject=course['subject'],
+        catalog_number=course['catalog_number'],
+        description=course['description'],
+        units=course['units'],
+        component=course['component'],
+        class_capacity=course['class_capacity'],
+        wait_list=course['wait_list'],
+        wait_cap=course['wait_cap'],
+        enrollment_total=course['enrollment_total'],
+        enrollment_available=course['enrollment_available'],
+        topic=course['topic'],
+        meetings=normalize_meetings(course['meetings']),
+    )
+    c.static_hash = static_hash(c)
+    c.occupancy = bits_to_bytes(c.meeting_bits())
+    return c
+
+
+# the synced Course back in the shape of an /api/dept/<subject> entry, for pages that render
+# api payloads; its meetings were normalized when it was saved
+def course_to_api(c):
+    return {
+        'instructor': {'name': c.instructor_name, 'email': c.instructor_email},
+        'course_number': c.course_number,
+        'semester_code': c.semester_code,
+        'course_section': c.course_section,
+        'subject': c.subject,
+        'catalog_number': c.catalog_number,
+        'description': c.description,
+        'units': c.units,
+        'component': c.component,
+        'class_capacity': c.class_capacity,
+        'wait_list': c.wait_list,
+        'wait_cap': c.wait_cap,
+        'enrollment_total': c.enrollment_total,
+        'enrollment_available': c.enrollment_available,
+        'topic': c.topic,
+        'meetings': c.meetings,
+    }
+
+
+# fingerprint of a course's static fields, so a sync can tell a seat count change from a real edit
+def static_hash(course):
+    values = [getattr(course, field) for field in STATIC_FIELDS]
+    return hashlib.md5(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# api courses as unsaved Course objects; the api occasionally repeats a section and the last copy wins
+def courses_from_api(courses):
+    by_key = {}
+    for course in courses:
+        c = course_from_api(course)
+        by_key[(c.course_number, c.semester_code)] = c
+    return list(by_key.values())
+
+
+# inserts new courses and updates existing ones (matched on course_number + semester_code)
+# in batches, so a department costs a handful of queries instead of one per section
+def upsert_courses(courses, batch_size=500):
+    objs = courses_from_api(courses)
+    save_courses(objs, batch_size)
+    return len(objs)
+
+
+def save_courses(objs, batch_size=500):
+    for i in range(0, len(objs), batch_size):
+        batch = objs[i:i + batch_size]
+        Course.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['course_number', 'semester_code'],
+            update_fields=COURSE_UPDATE_FIELDS,
+        )
+        sync_meetings(batch)
+        # carts holding a section whose meetings moved need their bitmaps rebuilt
+        ShoppingCart.refresh_occupancy([c.id for c in batch])
+
+
+# Enrollment-only sync: sections whose static fields hash the same as the stored row only get
+# their seat counts written, with one bulk_update per batch, and only if they changed.
+# New sections and ones with any other change go through the full upsert (full=True sends
+# every section that way). Sections whose open seats or wait list moved get an
+# EnrollmentSnapshot, and watchers of sections that went from full to open get an email.
+# returns (sections upserted, sections with new seat counts, sections left alone)
+def sync_enrollment(courses, batch_size=500, full=False):
+    objs = courses_from_api(courses)
+    stored = {}
+    for i in range(0, len(objs), batch_size):
+        batch = objs[i:i + batch_size]
+        rows = Course.objects.filter(course_number__in=[c.course_number for c in batch]).values(
+            'id', 'course_number', 'semester_code', 'static_hash', *VOLATILE_FIELDS)
+        for row in rows:
+            stored[(row['course_number'], row['semester_code'])] = row
+    changed = []
+    seat_updates = []
+    moved = []
+    opened = []
+    for c in objs:
+        row = stored.get((c.course_number, c.semester_code))
+        if row is None or c.enrollment_available != row['enrollment_available'] or c.wait_list != row['wait_list']:
+            moved.append(c)
+        if row is not None and row['enrollment_available'] <= 0 < c.enrollment_available:
+            opened.append(c)
+        if full or row is None or row['static_hash'] != c.static_hash:
+            changed.append(c)
+        elif any(getattr(c, field) != row[field] for field in VOLATILE_FIELDS):
+            c.id = row['id']
+            seat_updates.append(c)
+    save_courses(changed, batch_size)
+    Course.objects.bulk_update(seat_updates, VOLATILE_FIELDS, batch_size=batch_size)
+    # save_courses and the loop above have set every id by now
+    now = timezone.now()
+    EnrollmentSnapshot.objects.bulk_create(
+        [EnrollmentSnapshot(course_id=c.id, taken_at=now, available=c.enrollment_available, wait_list=c.wait_list) for c in moved],
+        batch_size=batch_size,
+    )
+    notify_seat_openings([c.id for c in opened])
+    return len(changed), len(seat_updates), len(objs) - len(changed) - len(seat_updates)
+
+
+# rebuilds the Meeting rows for a batch of just-upserted courses
+def sync_meetings(batch):
+    # upserted objects don't get their primary keys back, so look them all up in one query
+    ids = {}
+    rows = Course.objects.filter(course_number__in=[c.course_number for c in batch]).values_list('id', 'course_number', 'semester_code')
+    for course_id, course_number, semester_code in rows:
+        ids[(course_number, semester_code)] = course_id
+    meeting_rows = []
+    for c in batch:
+        c.id = ids[(c.course_number, c.semester_code)]
+        meeting_rows.extend(c.build_meetings())
+    Meeting.objects.filter(course_id__in=[c.id for c in batch]).delete()
+    Meeting.objects.bulk_create(meeting_rows)
+
+
+# creates any subjects from /api/deptlist that are not in the database yet
+def sync_subjects(subjects):
+    existing = set(Subject.objects.values_list('subject', flat=True))
+    new_subjects = []
+    for sub in subjects:
+        if sub['subject'] not in existing:
+            new_subjects.append(Subject(subject=sub['subject'], name=get_names.get(sub['subject'], sub['subject'])))
+            existing.add(sub['subject'])
+    Subject.objects.bulk_create(new_subjects)
+    if new_subjects:
+        bump_subject_index()
+    return len(new_subjects)
+
+
+# The home page's subjects grouped by school, cached until the subject list changes.
+# Cached copies are stored under the current version number, so invalidating is just moving
+# to a new version; entries for old versions are never read again and expire on their own.
+SUBJECT_INDEX_KEY = 'subject_index'
+SUBJECT_INDEX_VERSION_KEY = 'subject_index_version'
+SUBJECT_INDEX_TIMEOUT = 24 * 60 * 60
+
+SCHOOLS = [
+    ('college_list', college_arts_sci),
+    ('engr_list', engr_school),
+    ('edu_list', edu_hum_dev_school),
+    ('other_list', other_schools),
+]
+
+
+def subject_index_version():
+    # start from the clock rather than 1 so a version lost from the cache can't come back
+    # around to a number that still has an old index stored under it
+    return cache.get_or_set(SUBJECT_INDEX_VERSION_KEY, clock.time_ns, timeout=None)
+
+
+def bump_subject_index():
+    try:
+        cache.incr(SUBJECT_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(SUBJECT_INDEX_VERSION_KEY, clock.time_ns(), timeout=None)
+
+
+# {'subjects': [...], 'college_list': [...], ...} from a single Subject query
+def group_subjects():
+    subjects = list(Subject.objects.order_by('id'))
+    # the same mnemonic can show up twice in older databases; the first row wins
+    by_mnemonic = {}
+    for sub in subjects:
+        by_mnemonic.setdefault(sub.subject, sub)
+    groups = {'subjects': subjects}
+    for name, school in SCHOOLS:
+        groups[name] = [by_mnemonic[sub] for sub in school if sub in by_mnemonic]
+    return groups
+
+
+def subject_index():
+    version = subject_index_version()
+    groups = cache.get(SUBJECT_INDEX_KEY, version=version)
+    if groups is None:
+        groups = group_subjects()
+        cache.set(SUBJECT_INDEX_KEY, groups, SUBJECT_INDEX_TIMEOUT, version=version)
+    return groups
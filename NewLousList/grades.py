@@ -0,0 +1,99 @@
+import requests
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.utils import timezone
+from .models import CourseGrade
+from . import upstream
+from .jobs import queue_grade_refresh
+
+VAGRADES_API = 'https://vagrades.com/api/uva/course/'
+
+# how long a looked up average is trusted before vagrades is asked again
+GRADE_TTL = timedelta(days=7)
+# courses vagrades doesn't know about are asked about again sooner, in case they show up
+NOT_FOUND_TTL = timedelta(days=1)
+
+# (lowest average above which the letter is given, letter), best first
+LETTER_GRADES = [
+    (3.7, 'A'), (3.3, 'A-'), (3.0, 'B+'), (2.7, 'B'), (2.3, 'B-'), (2.0, 'C+'),
+    (1.7, 'C'), (1.3, 'C-'), (1.0, 'D+'), (0.7, 'D'), (0.3, 'D-'),
+]
+
+
+def letter_grade(gpa):
+    for cutoff, letter in LETTER_GRADES:
+        if gpa > cutoff:
+            return letter
+    return 'F'
+
+
+# average gpa of a course from vagrades, or None if vagrades has no average for it
+# raises requests.RequestException if vagrades is down or errors
+def fetch_gpa(subject, catalog_number):
+    response = upstream.get(VAGRADES_API + subject + str(catalog_number))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    gpa = response.json()['course']['avg']
+    return round(gpa, 2) if gpa else None
+
+
+def is_fresh(grade, now=None):
+    now = now or timezone.now()
+    ttl = GRADE_TTL if grade.gpa is not None else NOT_FOUND_TTL
+    return grade.fetched_at > now - ttl
+
+
+# asks vagrades for a course's average and stores it; raises requests.RequestException
+# if vagrades can't be reached, so the refresh_grade job gets retried
+def refresh_grade(subject, catalog_number):
+    catalog_number = str(catalog_number)
+    gpa = fetch_gpa(subject, catalog_number)
+    grade, created = CourseGrade.objects.update_or_create(
+        subject=subject, catalog_number=catalog_number,
+        defaults={'gpa': gpa, 'fetched_at': timezone.now()},
+    )
+    return grade
+
+
+# For views: the stored CourseGrade (or None), read through the async ORM. Never waits on
+# vagrades; a missing or stale row queues a refresh_grade job for run_worker instead.
+async def acached_grade(subject, catalog_number):
+    catalog_number = str(catalog_number)
+    grade = await CourseGrade.objects.filter(subject=subject, catalog_number=catalog_number).afirst()
+    if grade is None or not is_fresh(grade):
+        await sync_to_async(queue_grade_refresh)(subject, catalog_number)
+    return grade
+
+
+# "3.45 (A-)" or "0 (GPA NOT FOUND)", as shown on the course page
+def gpa_label(grade):
+    if grade is None or grade.gpa is None:
+        return "0 (GPA NOT FOUND)"
+    return str(grade.gpa) + " (" + letter_grade(grade.gpa) + ")"
+
+
+# Looks up every given course that has no fresh row and stores the results in one query.
+# Courses vagrades can't be reached for are skipped and keep whatever row they had.
+def prefetch_grades(subject, catalog_numbers):
+    now = timezone.now()
+    catalog_numbers = set(str(number) for number in catalog_numbers)
+    for grade in CourseGrade.objects.filter(subject=subject, catalog_number__in=catalog_numbers):
+        if is_fresh(grade, now):
+            catalog_numbers.discard(grade.catalog_number)
+    grades = []
+    failed = 0
+    for catalog_number in sorted(catalog_numbers):
+        try:
+            gpa = fetch_gpa(subject, catalog_number)
+        except requests.RequestException:
+            failed += 1
+            continue
+        grades.append(CourseGrade(subject=subject, catalog_number=catalog_number, gpa=gpa, fetched_at=timezone.now()))
+    CourseGrade.objects.bulk_create(
+        grades,
+        update_conflicts=True,
+        unique_fields=['subject', 'catalog_number'],
+        update_fields=['gpa', 'fetched_at'],
+    )
+    return len(grades), failed
@@ -0,0 +1,31 @@
+from .models import EnrollmentSnapshot
+
+# Enrollment history is only written when a section's seats change (see catalog.sync_enrollment),
+# so the seat count at any moment is the latest snapshot at or before it.
+
+
+# Keeps only the last snapshot of each bucket_minutes window, per section, for snapshots taken
+# before `before`. The value at the end of every window is unchanged, only the moves inside
+# it are lost. Returns how many snapshots were deleted.
+def downsample_snapshots(before, bucket_minutes, batch_size=1000):
+    bucket_seconds = bucket_minutes * 60
+    rows = EnrollmentSnapshot.objects.filter(taken_at__lt=before).order_by('course_id', 'taken_at', 'id') \
+        .values_list('id', 'course_id', 'taken_at')
+    drop = []
+    previous_id = previous_key = None
+    for snapshot_id, course_id, taken_at in rows.iterator(chunk_size=batch_size):
+        key = (course_id, int(taken_at.timestamp()) // bucket_seconds)
+        if key == previous_key:
+            drop.append(previous_id)
+        previous_id, previous_key = snapshot_id, key
+    for i in range(0, len(drop), batch_size):
+        EnrollmentSnapshot.objects.filter(id__in=drop[i:i + batch_size]).delete()
+    return len(drop)
+
+
+# [(taken_at, available, wait_list), ...] for a section, oldest first
+def seat_curve(course, since=None):
+    snapshots = EnrollmentSnapshot.objects.filter(course=course)
+    if since is not None:
+        snapshots = snapshots.filter(taken_at__gte=since)
+    return list(snapshots.order_by('taken_at').values_list('taken_at', 'available', 'wait_list'))
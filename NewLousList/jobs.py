@@ -0,0 +1,180 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from .models import Job, Subject
+from . import upstream
+
+# A small job queue in the database, so slow work (syncing a department, asking vagrades)
+# happens in `manage.py run_worker` instead of in a request. It only needs the database,
+# so it runs the same on sqlite locally and postgres on heroku. The job kinds and the
+# functions that run them are in tasks.py.
+
+logger = logging.getLogger(__name__)
+
+# a failed job is tried again after 30s, 60s, 120s, ... up to max_attempts tries
+RETRY_DELAY = 30
+# a job still marked running after this long belonged to a worker that died
+STALE_AFTER = timedelta(minutes=15)
+# departments are synced again once their last sync is older than the api payload cache's max
+# age when a page shows them, and at least every half hour otherwise (see queue_stale_department_sync)
+DEPARTMENT_MAX_AGE = timedelta(seconds=upstream.FRESH_SECONDS)
+DEPARTMENT_SYNC_EVERY = timedelta(minutes=30)
+
+
+# Queues a job unless one with the same key is already waiting; returns the waiting job.
+def enqueue(kind, key, args=None, delay=0, max_attempts=5):
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, key=key, args=args or {}, max_attempts=max_attempts,
+                                      run_at=timezone.now() + timedelta(seconds=delay))
+    except IntegrityError:
+        return Job.objects.filter(key=key, status=Job.PENDING).first()
+
+
+# Marks the next due job as running and returns it, or None if nothing is due.
+# The status check in the update means two workers can't both claim the same job.
+def claim_next():
+    while True:
+        job = Job.objects.filter(status=Job.PENDING, run_at__lte=timezone.now()).order_by('run_at', 'id').first()
+        if job is None:
+            return None
+        claimed = Job.objects.filter(id=job.id, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+# Puts jobs whose worker died back in the queue. A job whose work was queued again while it was
+# stuck is marked failed instead (the new job will do it, and the unique key allows only one
+# waiting job), and so is one out of attempts, so a job that keeps killing its worker stops.
+def requeue_stale():
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=now - STALE_AFTER)
+    waiting = Job.objects.filter(key=OuterRef('key'), status=Job.PENDING)
+    Job.objects.filter(id__in=stale.filter(Q(Exists(waiting)) | Q(attempts__gte=F('max_attempts'))).values('id')) \
+        .update(status=Job.FAILED, finished_at=now, last_error='worker stopped while running the job')
+    requeued = 0
+    for job in stale.filter(~Exists(waiting), attempts__lt=F('max_attempts')):
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(id=job.id, status=Job.RUNNING).update(status=Job.PENDING, run_at=now)
+        except IntegrityError:
+            # the same work was queued again just now
+            Job.objects.filter(id=job.id).update(status=Job.FAILED, finished_at=now)
+    return requeued
+
+
+# Runs a claimed job with handlers[job.kind](**job.args), recording how long it took.
+# Failures are retried with exponential backoff until max_attempts.
+def run_job(job, handlers):
+    start = time.monotonic()
+    try:
+        handlers[job.kind](**job.args)
+    except Exception:
+        job.duration = time.monotonic() - start
+        job.last_error = traceback.format_exc()
+        logger.warning('job %s failed (attempt %d)', job, job.attempts, exc_info=True)
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+        try:
+            job.save(update_fields=['status', 'run_at', 'finished_at', 'duration', 'last_error'])
+        except IntegrityError:
+            # the same work was queued again while this ran; that job will do it
+            Job.objects.filter(id=job.id).update(status=Job.FAILED, finished_at=timezone.now(),
+                                                 duration=job.duration, last_error=job.last_error)
+        return False
+    job.status = Job.DONE
+    job.finished_at = timezone.now()
+    job.duration = time.monotonic() - start
+    job.save(update_fields=['status', 'finished_at', 'duration'])
+    return True
+
+
+# runs due jobs until the queue is empty (or max_jobs ran); returns how many ran
+def run_pending(handlers, max_jobs=None):
+    ran = 0
+    requeue_stale()
+    while max_jobs is None or ran < max_jobs:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job, handlers)
+        ran += 1
+    return ran
+
+
+# Work run_worker queues for itself, and how often: a kind is queued again once nothing of it
+# is waiting or running and the last one finished (or gave up) longer ago than that.
+PERIODIC = {
+    # a delta sync of every department that wasn't synced lately, see queue_stale_department_syncs
+    'sync_departments': DEPARTMENT_SYNC_EVERY,
+    # "people you may know" for everyone, see suggestions.py
+    'suggest_friends': timedelta(days=1),
+}
+
+
+# queues every periodic job that is due; returns how many were queued
+def queue_periodic():
+    queued = 0
+    for kind, every in PERIODIC.items():
+        recent = Job.objects.filter(kind=kind).filter(
+            Q(status__in=[Job.PENDING, Job.RUNNING]) | Q(finished_at__gte=timezone.now() - every))
+        if not recent.exists():
+            enqueue(kind, kind)
+            queued += 1
+    return queued
+
+
+# the jobs the site queues; tasks.HANDLERS runs them
+def queue_department_sync(subject):
+    return enqueue('sync_department', 'sync_department:' + subject, {'subject': subject})
+
+
+# Seat counts are only as fresh as the department's last sync. Pages showing a department
+# queue a sync once it is older than DEPARTMENT_MAX_AGE, and the periodic sync_departments job
+# queues one for every department nobody looked at within DEPARTMENT_SYNC_EVERY, so seat
+# history and seat opening emails keep up with quiet departments too.
+
+
+def department_is_stale(subject, max_age=DEPARTMENT_MAX_AGE):
+    return subject.synced_at is None or subject.synced_at < timezone.now() - max_age
+
+
+# subject is a Subject; returns the queued job, or None if the department is fresh
+def queue_stale_department_sync(subject):
+    if department_is_stale(subject):
+        return queue_department_sync(subject.subject)
+    return None
+
+
+# returns how many departments were queued
+def queue_stale_department_syncs(max_age=DEPARTMENT_SYNC_EVERY):
+    stale = Subject.objects.filter(Q(synced_at__isnull=True) | Q(synced_at__lt=timezone.now() - max_age))
+    subjects = list(stale.values_list('subject', flat=True).distinct())
+    for subject in subjects:
+        queue_department_sync(subject)
+    return len(subjects)
+
+
+def queue_subject_sync():
+    return enqueue('sync_subjects', 'sync_subjects')
+
+
+def queue_grade_refresh(subject, catalog_number):
+    return enqueue('refresh_grade', f'refresh_grade:{subject}:{catalog_number}',
+                   {'subject': subject, 'catalog_number': str(catalog_number)})
+
+
+# emails that failed to go out, tried again after RETRY_DELAY; since is when the failed run started
+def queue_seat_notifications(course_ids, since):
+    return enqueue('notify_seats', f'notify_seats:{since.isoformat()}',
+                   {'course_ids': course_ids, 'since': since.isoformat()}, delay=RETRY_DELAY)
@@ -0,0 +1,56 @@
+import random
+import time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from NewLousList.models import day_mask
+from NewLousList.scheduling import occupancy_bits, occupancy_stats, schedule_cost, search_schedules, top_schedules
+
+# the two usual UVA meeting patterns: 50 minutes MoWeFr or 75 minutes TuTh
+PATTERNS = [('MoWeFr', 50, [480 + 60 * i for i in range(10)]), ('TuTh', 75, [480 + 90 * i for i in range(7)])]
+
+
+class Command(BaseCommand):
+    help = 'Times ranked schedule generation on synthetic courses (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=6)
+        parser.add_argument('--sections', type=int, default=20)
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--steps', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=2022)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        groups = []
+        for course in range(options['courses']):
+            group = []
+            for section in range(options['sections']):
+                days, length, starts = rng.choice(PATTERNS)
+                start = rng.choice(starts)
+                meeting = SimpleNamespace(days=day_mask(days), start_min=start, end_min=start + length)
+                group.append((occupancy_bits([meeting]), SimpleNamespace(course=course, section=section, meetings=[meeting])))
+            groups.append(group)
+
+        weights = {'late_start': 1, 'gaps': 1, 'days_off': 2, 'compact': 0.5}
+        top = options['top']
+        steps = options['steps']
+
+        def cost(schedule):
+            return schedule_cost(occupancy_stats(occupancy_bits(m for section in schedule for m in section.meetings)), weights)
+
+        # without the heap: score every schedule the search reaches, then sort
+        start = time.perf_counter()
+        scored = sorted(schedule_cost(occupancy_stats(bits), weights) for bits, schedule in search_schedules(groups, float('inf'), steps))
+        sort_all_time = time.perf_counter() - start
+        self.stdout.write(f"{options['courses']} courses x {options['sections']} sections, {steps} step budget")
+        self.stdout.write(f'score and sort everything: {sort_all_time * 1000:.0f} ms, {len(scored)} schedules held, best cost {scored[0]:.2f}')
+
+        start = time.perf_counter()
+        best = top_schedules(groups, top, weights, steps)
+        ranked_time = time.perf_counter() - start
+        self.stdout.write(f'top {top} with heap and pruning: {ranked_time * 1000:.0f} ms, best cost {cost(best[0]):.2f}')
+
+        start = time.perf_counter()
+        best = top_schedules(groups, top, weights, max_steps=10 ** 9)
+        ranked_time = time.perf_counter() - start
+        self.stdout.write(f'top {top} over every combination: {ranked_time * 1000:.0f} ms, best cost {cost(best[0]):.2f}')
@@ -0,0 +1,80 @@
+import random
+import time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from NewLousList.models import day_mask, format_time
+from NewLousList.scheduling import time_grid
+
+# the two usual UVA meeting patterns: 50 minutes MoWeFr or 75 minutes TuTh
+PATTERNS = [('MoWeFr', 50, [480 + 60 * i for i in range(10)]), ('TuTh', 75, [480 + 90 * i for i in range(7)])]
+DAYS = ('Mo', 'Tu', 'We', 'Th', 'Fr')
+
+
+# stands in for a Course with its prefetched meetings
+class Section:
+    def __init__(self, meeting_set, meetings):
+        self.meeting_set = meeting_set
+        self.meetings = meetings
+
+
+# how create_schedule used to bucket a cart: re-sorting the AM and PM lists after every meeting
+# and appending both lists to the result once per course
+def old_buckets(courses):
+    def by_hour(course):
+        return course.meetings[0]['start_time']
+    ordered_list = []
+    ordered_list_AM = []
+    ordered_list_PM = []
+    for course in courses:
+        for meeting in course.meetings:
+            if 'AM' in meeting['start_time']:
+                ordered_list_AM.append(course)
+            else:
+                ordered_list_PM.append(course)
+            ordered_list_AM = sorted(ordered_list_AM, key=by_hour)
+            ordered_list_PM = sorted(ordered_list_PM, key=by_hour)
+        for course in ordered_list_AM:
+            ordered_list.append(course)
+        for course in ordered_list_PM:
+            ordered_list.append(course)
+    buckets = [set() for day in DAYS]
+    for course in ordered_list:
+        for meeting in course.meetings:
+            for i, day in enumerate(DAYS):
+                if day in meeting['days']:
+                    buckets[i].add(course)
+    return buckets
+
+
+class Command(BaseCommand):
+    help = 'Times laying a cart out for the weekly schedule page for growing cart sizes (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='5,10,20,40,80,160')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=2022)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'courses':>8} {'old ms':>10} {'old us/course':>14} {'new ms':>10} {'new us/course':>14}")
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            courses = []
+            for _ in range(size):
+                days, length, starts = rng.choice(PATTERNS)
+                start = rng.choice(starts)
+                meeting = SimpleNamespace(days=day_mask(days), start_min=start, end_min=start + length)
+                courses.append(Section([meeting], [
+                    {'days': days, 'start_time': format_time(start), 'end_time': format_time(start + length)}]))
+
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                old_buckets(courses)
+            old_time = (time.perf_counter() - start) / options['repeat']
+
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                time_grid([(course, course.meeting_set) for course in courses], label=format_time)
+            new_time = (time.perf_counter() - start) / options['repeat']
+
+            self.stdout.write(f'{size:>8} {old_time * 1000:>10.2f} {old_time / size * 1e6:>14.1f} '
+                              f'{new_time * 1000:>10.2f} {new_time / size * 1e6:>14.1f}')
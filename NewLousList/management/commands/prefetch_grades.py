@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from NewLousList.models import Course
+from NewLousList.grades import prefetch_grades
+
+
+class Command(BaseCommand):
+    help = 'Fills the CourseGrade cache from vagrades for every course of the given subjects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('subjects', nargs='*', help='subject mnemonics (default: every subject with courses)')
+
+    def handle(self, *args, **options):
+        subjects = options['subjects'] or Course.objects.order_by('subject').values_list('subject', flat=True).distinct()
+        for subject in subjects:
+            catalog_numbers = Course.objects.filter(subject=subject).values_list('catalog_number', flat=True).distinct()
+            fetched, failed = prefetch_grades(subject, catalog_numbers)
+            self.stdout.write(f'{subject}: {fetched} fetched, {failed} failed')
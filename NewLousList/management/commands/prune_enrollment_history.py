@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from NewLousList.models import EnrollmentSnapshot
+from NewLousList.history import downsample_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Thins out old enrollment snapshots and deletes the ones past the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=365, help='delete snapshots older than this')
+        parser.add_argument('--full-days', type=int, default=14, help='keep every snapshot newer than this')
+        parser.add_argument('--bucket-minutes', type=int, default=60,
+                            help='older snapshots are thinned to one per section per this many minutes')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted, _ = EnrollmentSnapshot.objects.filter(taken_at__lt=now - timedelta(days=options['keep_days'])).delete()
+        thinned = downsample_snapshots(now - timedelta(days=options['full_days']), options['bucket_minutes'])
+        self.stdout.write(self.style.SUCCESS(f'deleted {deleted} expired and {thinned} downsampled snapshots'))
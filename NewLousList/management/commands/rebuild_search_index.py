@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from NewLousList.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreates the course full-text index (and its triggers on SQLite) and refills it'
+
+    def handle(self, *args, **options):
+        with connection.schema_editor() as schema_editor:
+            install_search_index(schema_editor)
+        self.stdout.write(self.style.SUCCESS(f'rebuilt course search index ({connection.vendor})'))
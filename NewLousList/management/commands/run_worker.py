@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from NewLousList.jobs import queue_periodic, run_pending
+from NewLousList.tasks import HANDLERS
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (department syncs, gpa lookups) until stopped, and queues the periodic ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run every due job, then exit')
+        parser.add_argument('--sleep', type=float, default=1.0, help='seconds to wait when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, default=None, help='exit after this many jobs')
+        parser.add_argument('--periodic-every', type=float, default=60.0,
+                            help='seconds between checks for periodic jobs (jobs.PERIODIC) that are due')
+
+    def handle(self, *args, **options):
+        total = 0
+        next_periodic = 0
+        while True:
+            if time.monotonic() >= next_periodic:
+                queue_periodic()
+                next_periodic = time.monotonic() + options['periodic_every']
+            remaining = None if options['max_jobs'] is None else options['max_jobs'] - total
+            ran = run_pending(HANDLERS, max_jobs=remaining)
+            total += ran
+            if options['once'] or (remaining is not None and ran >= remaining):
+                break
+            if not ran:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'ran {total} jobs'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from NewLousList.suggestions import SUGGESTION_LIMIT, compute_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Recomputes every user\'s "people you may know" suggestions (run it periodically, e.g. nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=SUGGESTION_LIMIT, help='suggestions kept per user')
+
+    def handle(self, *args, **options):
+        users, stored = compute_suggestions(options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'stored {stored} suggestions for {users} users'))
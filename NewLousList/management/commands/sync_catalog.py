@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from NewLousList.models import Subject
+from NewLousList.upstream import upstream_stats
+from NewLousList.catalog import fetch_department_list, fetch_department, sync_enrollment, sync_subjects
+
+
+class Command(BaseCommand):
+    help = 'Pulls every department from luthers-list and bulk-upserts the courses into the local database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('subjects', nargs='*', help='only sync these subject mnemonics (default: every department)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--delta', action='store_true',
+                            help='only write seat counts for sections whose other fields are unchanged')
+
+    def handle(self, *args, **options):
+        subjects = fetch_department_list(max_age=0)
+        created = sync_subjects(subjects)
+        self.stdout.write(f'{created} new subjects')
+
+        mnemonics = options['subjects'] or [sub['subject'] for sub in subjects]
+        total = 0
+        for subject in mnemonics:
+            courses = fetch_department(subject, max_age=0)
+            upserted, seats, unchanged = sync_enrollment(courses, batch_size=options['batch_size'], full=not options['delta'])
+            Subject.objects.filter(subject=subject).update(synced_at=timezone.now())
+            count = upserted + seats + unchanged
+            if options['delta']:
+                self.stdout.write(f'{subject}: {upserted} upserted, {seats} seat changes, {unchanged} unchanged')
+            else:
+                self.stdout.write(f'{subject}: {count} courses')
+            total += count
+        self.stdout.write(self.style.SUCCESS(f'synced {total} courses from {len(mnemonics)} departments'))
+        for host, stats in upstream_stats().items():
+            self.stdout.write(f"{host}: {stats['requests']} requests, {stats['errors']} errors, "
+                              f"{stats['avg_seconds']:.3f}s avg, {stats['max_seconds']:.3f}s max")
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+# courses_by_subject used to get_or_create on every field, so any change in seat counts
+# created another row for the same section. Keep the oldest row per section and point
+# shopping carts at it before the unique constraint goes on.
+def dedupe_courses(apps, schema_editor):
+    Course = apps.get_model('NewLousList', 'Course')
+    ShoppingCart = apps.get_model('NewLousList', 'ShoppingCart')
+    Through = ShoppingCart.class_list.through
+    keep = {}
+    duplicates = {}
+    for course_id, course_number, semester_code in Course.objects.order_by('id').values_list('id', 'course_number', 'semester_code'):
+        key = (course_number, semester_code)
+        if key in keep:
+            duplicates[course_id] = keep[key]
+        else:
+            keep[key] = course_id
+    if not duplicates:
+        return
+    for row in Through.objects.filter(course_id__in=duplicates.keys()):
+        Through.objects.get_or_create(shoppingcart_id=row.shoppingcart_id, course_id=duplicates[row.course_id])
+    Course.objects.filter(id__in=duplicates.keys()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0024_userinfo_first_name_userinfo_last_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_courses, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='course',
+            constraint=models.UniqueConstraint(fields=('course_number', 'semester_code'), name='unique_course_section'),
+        ),
+    ]
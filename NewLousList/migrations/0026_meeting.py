@@ -0,0 +1,78 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# frozen copies of models.day_mask and models.parse_time as they were when this ran
+DAY_CODES = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
+
+def day_mask(days):
+    mask = 0
+    for i in range(0, len(days or ''), 2):
+        day = days[i:i+2]
+        if day in DAY_CODES:
+            mask |= 1 << DAY_CODES.index(day)
+    return mask
+
+
+def parse_time(value):
+    if not value:
+        return None
+    value = value.strip()
+    suffix = value[-2:].upper()
+    if suffix in ('AM', 'PM'):
+        value = value[:-2].strip()
+    parts = value.replace('.', ':').split(':')
+    hour = int(parts[0])
+    minute = int(parts[1]) if len(parts) > 1 else 0
+    if suffix == 'AM':
+        hour = hour % 12
+    elif suffix == 'PM':
+        hour = hour % 12 + 12
+    return 60 * hour + minute
+
+
+def backfill_meetings(apps, schema_editor):
+    Course = apps.get_model('NewLousList', 'Course')
+    Meeting = apps.get_model('NewLousList', 'Meeting')
+    rows = []
+    for course in Course.objects.only('id', 'meetings').iterator():
+        for meeting in course.meetings or []:
+            days = day_mask(meeting.get('days'))
+            start = parse_time(meeting.get('start_time'))
+            end = parse_time(meeting.get('end_time'))
+            if days and start is not None and end is not None:
+                rows.append(Meeting(course_id=course.id, days=days, start_min=start, end_min=end,
+                                    facility_description=meeting.get('facility_description', '')))
+    Meeting.objects.bulk_create(rows, batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0025_course_unique_course_section'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Meeting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days', models.PositiveSmallIntegerField(default=0)),
+                ('start_min', models.PositiveSmallIntegerField()),
+                ('end_min', models.PositiveSmallIntegerField()),
+                ('facility_description', models.CharField(blank=True, default='', max_length=200)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='NewLousList.course')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['start_min', 'end_min'], name='meeting_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['days', 'start_min'], name='meeting_days_time_idx'),
+        ),
+        migrations.RunPython(backfill_meetings, migrations.RunPython.noop),
+    ]
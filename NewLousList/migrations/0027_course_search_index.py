@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# The search index as search.py defined it when this ran, frozen here so that later changes to
+# search.py can't change what this migration (or the ones that reinstall the index after
+# rebuilding the course table) does.
+
+COURSE_TABLE = '"NewLousList_course"'
+
+SQLITE_INDEX = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS course_fts USING fts5(
+        description, topic, instructor_name, content={COURSE_TABLE}, content_rowid='id')""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_insert AFTER INSERT ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(rowid, description, topic, instructor_name)
+        VALUES (new.id, new.description, new.topic, new.instructor_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_delete AFTER DELETE ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(course_fts, rowid, description, topic, instructor_name)
+        VALUES ('delete', old.id, old.description, old.topic, old.instructor_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_update AFTER UPDATE OF description, topic, instructor_name ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(course_fts, rowid, description, topic, instructor_name)
+        VALUES ('delete', old.id, old.description, old.topic, old.instructor_name);
+        INSERT INTO course_fts(rowid, description, topic, instructor_name)
+        VALUES (new.id, new.description, new.topic, new.instructor_name);
+    END""",
+    "INSERT INTO course_fts(course_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_DOCUMENT = ("to_tsvector('english', coalesce(description, '') || ' ' || coalesce(topic, '') "
+                     "|| ' ' || coalesce(instructor_name, ''))")
+
+POSTGRES_INDEX = [
+    f"CREATE INDEX IF NOT EXISTS course_search_idx ON {COURSE_TABLE} USING gin (({POSTGRES_DOCUMENT}))",
+]
+
+
+# Creates the index (and on SQLite its triggers) if missing and refills it from the course table.
+def install_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = SQLITE_INDEX if vendor == 'sqlite' else POSTGRES_INDEX if vendor == 'postgresql' else []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def remove_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for trigger in ('course_fts_insert', 'course_fts_delete', 'course_fts_update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute('DROP TABLE IF EXISTS course_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS course_search_idx')
+
+
+def forwards(apps, schema_editor):
+    install_search_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    remove_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0026_meeting'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0027_course_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['subject', 'catalog_number', 'id'], name='course_subject_catalog_idx'),
+        ),
+    ]
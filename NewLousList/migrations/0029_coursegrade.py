@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0028_course_subject_catalog_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseGrade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=10)),
+                ('catalog_number', models.CharField(max_length=10)),
+                ('gpa', models.FloatField(blank=True, null=True)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coursegrade',
+            constraint=models.UniqueConstraint(fields=('subject', 'catalog_number'), name='unique_course_grade'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_summaries(apps, schema_editor):
+    Review = apps.get_model('NewLousList', 'Review')
+    ReviewSummary = apps.get_model('NewLousList', 'ReviewSummary')
+    summaries = {}
+    for review in Review.objects.order_by('id'):
+        key = (review.subject, review.course_number)
+        if key not in summaries:
+            summaries[key] = ReviewSummary(subject=review.subject, course_number=review.course_number)
+        summaries[key].review_count += 1
+        summaries[key].latest_review = review
+    ReviewSummary.objects.bulk_create(summaries.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0029_coursegrade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=10)),
+                ('course_number', models.CharField(max_length=10)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['subject', 'course_number', 'id'], name='review_course_idx'),
+        ),
+        migrations.AddField(
+            model_name='reviewsummary',
+            name='latest_review',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='NewLousList.review'),
+        ),
+        migrations.AddConstraint(
+            model_name='reviewsummary',
+            constraint=models.UniqueConstraint(fields=('subject', 'course_number'), name='unique_review_summary'),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
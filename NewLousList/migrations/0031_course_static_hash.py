@@ -0,0 +1,26 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:22
+
+from importlib import import_module
+from django.db import migrations, models
+
+
+# sqlite rebuilds the course table to add the column, which drops the search triggers;
+# they are put back the way 0027 installed them
+def reinstall_search_index(apps, schema_editor):
+    import_module('NewLousList.migrations.0027_course_search_index').install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0030_review_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='static_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
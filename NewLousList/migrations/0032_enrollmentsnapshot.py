@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0031_course_static_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('available', models.SmallIntegerField()),
+                ('wait_list', models.SmallIntegerField()),
+                ('course', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='NewLousList.course')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='enrollmentsnapshot',
+            index=models.Index(fields=['course', 'taken_at'], name='snapshot_course_time_idx'),
+        ),
+    ]
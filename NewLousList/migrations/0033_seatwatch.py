@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('NewLousList', '0032_enrollmentsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatWatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_notified_at', models.DateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='NewLousList.course')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_watches', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='seatwatch',
+            constraint=models.UniqueConstraint(fields=('course', 'user'), name='unique_seat_watch'),
+        ),
+    ]
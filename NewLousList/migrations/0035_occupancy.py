@@ -0,0 +1,80 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:32
+
+from importlib import import_module
+from django.db import migrations, models
+
+WEEKDAYS = ('Mo', 'Tu', 'We', 'Th', 'Fr')
+
+# frozen copies of the scheduling.py bitmap helpers as they were when this ran
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+def meeting_bits(days, start_min, end_min):
+    first = start_min // SLOT_MINUTES
+    last = end_min // SLOT_MINUTES
+    span = ((1 << (last - first + 1)) - 1) << first
+    bits = 0
+    for day in range(7):
+        if days >> day & 1:
+            bits |= span << (day * SLOTS_PER_DAY)
+    return bits
+
+
+def bits_to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+# same check as Course.valid(), which historical models don't have
+def valid(meetings):
+    return all(len(meeting['days']) >= 2 and meeting['days'][:2] in WEEKDAYS for meeting in meetings or [])
+
+
+# bitmaps for existing courses from their Meeting rows, then for carts from their courses
+def fill_occupancy(apps, schema_editor):
+    Course = apps.get_model('NewLousList', 'Course')
+    Meeting = apps.get_model('NewLousList', 'Meeting')
+    ShoppingCart = apps.get_model('NewLousList', 'ShoppingCart')
+    bits = {}
+    for course_id, days, start_min, end_min in Meeting.objects.values_list('course_id', 'days', 'start_min', 'end_min'):
+        bits[course_id] = bits.get(course_id, 0) | meeting_bits(days, start_min, end_min)
+    courses = []
+    for course_id, meetings in Course.objects.filter(id__in=bits.keys()).values_list('id', 'meetings'):
+        if valid(meetings):
+            courses.append(Course(id=course_id, occupancy=bits_to_bytes(bits[course_id])))
+    Course.objects.bulk_update(courses, ['occupancy'], batch_size=500)
+
+    cart_bits = {}
+    valid_bits = {course.id: bits[course.id] for course in courses}
+    for cart_id, course_id in ShoppingCart.class_list.through.objects.values_list('shoppingcart_id', 'course_id'):
+        cart_bits[cart_id] = cart_bits.get(cart_id, 0) | valid_bits.get(course_id, 0)
+    ShoppingCart.objects.bulk_update([ShoppingCart(id=cart_id, occupancy=bits_to_bytes(b)) for cart_id, b in cart_bits.items()],
+                                     ['occupancy'], batch_size=500)
+
+
+# sqlite rebuilds the course table to add the column, which drops the search triggers;
+# they are put back the way 0027 installed them
+def reinstall_search_index(apps, schema_editor):
+    import_module('NewLousList.migrations.0027_course_search_index').install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0034_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='occupancy',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='occupancy',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+        migrations.RunPython(fill_occupancy, migrations.RunPython.noop),
+    ]
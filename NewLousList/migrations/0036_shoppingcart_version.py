@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0035_occupancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
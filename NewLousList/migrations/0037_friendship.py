@@ -0,0 +1,62 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Each FriendList row listed one side of its user's friendships. Accepting and unfriending
+# updated both sides, but not atomically, so a pair listed on either side becomes a friendship.
+def copy_friend_lists(apps, schema_editor):
+    FriendList = apps.get_model('NewLousList', 'FriendList')
+    Friendship = apps.get_model('NewLousList', 'Friendship')
+    pairs = set()
+    for user_id, friend_id in FriendList.friends.through.objects.values_list('friendlist__user_id', 'user_id'):
+        if user_id != friend_id:
+            pairs.add((min(user_id, friend_id), max(user_id, friend_id)))
+    Friendship.objects.bulk_create([Friendship(user_a_id=a, user_b_id=b) for a, b in sorted(pairs)],
+                                   batch_size=500, ignore_conflicts=True)
+
+
+def copy_friendships(apps, schema_editor):
+    FriendList = apps.get_model('NewLousList', 'FriendList')
+    Friendship = apps.get_model('NewLousList', 'Friendship')
+    for a, b in Friendship.objects.values_list('user_a_id', 'user_b_id'):
+        FriendList.objects.get_or_create(user_id=a)[0].friends.add(b)
+        FriendList.objects.get_or_create(user_id=b)[0].friends.add(a)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('NewLousList', '0036_shoppingcart_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_a', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['user_b', 'user_a'], name='friendship_user_b_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user_a', 'user_b'), name='unique_friendship'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user_a__lt', models.F('user_b'))), name='friendship_ordered'),
+        ),
+        migrations.RunPython(copy_friend_lists, copy_friendships),
+        migrations.DeleteModel(
+            name='FriendList',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('NewLousList', '0037_friendship'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mutual_friends', models.PositiveIntegerField(default=0)),
+                ('shared_courses', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('computed_at', models.DateTimeField()),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='friendsuggestion',
+            index=models.Index(fields=['user', '-score'], name='suggestion_user_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendsuggestion',
+            constraint=models.UniqueConstraint(fields=('user', 'suggested'), name='unique_friend_suggestion'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NewLousList', '0038_friendsuggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,11 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from datetime import datetime
+from .scheduling import IntervalIndex, bits_from_bytes, bits_to_bytes, days_in, occupancy_bits
 
 # Create your models here.
 class Subject(models.Model):
     subject = models.CharField(max_length=200)
     name = models.CharField(max_length=200, default=' ')
+    # when run_worker last synced the department's courses, see jobs.queue_stale_department_sync
+    synced_at = models.DateTimeField(null=True, blank=True)
     def __str__(self):
         return self.name
 
@@ -18,6 +23,42 @@ def convert_time(time):
         val += 12*60
     return val
 
+# converts "HH:MM XM", 24 hour "HH:MM" or the api's "HH.MM.SS.ffffff-05:00" to minutes from 00:00
+# returns None for an empty time
+def parse_time(value):
+    if not value:
+        return None
+    value = value.strip()
+    suffix = value[-2:].upper()
+    if suffix in ('AM', 'PM'):
+        value = value[:-2].strip()
+    parts = value.replace('.', ':').split(':')
+    hour = int(parts[0])
+    minute = int(parts[1]) if len(parts) > 1 else 0
+    if suffix == 'AM':
+        hour = hour % 12
+    elif suffix == 'PM':
+        hour = hour % 12 + 12
+    return 60 * hour + minute
+
+# converts minutes from 00:00 back to "HH:MM XM"; 24:00 (the end of a day) is midnight, 12:00 AM
+def format_time(minutes):
+    hour = minutes // 60 % 24
+    suffix = 'PM' if hour >= 12 else 'AM'
+    return f"{(hour - 1) % 12 + 1:02d}:{minutes % 60:02d} {suffix}"
+
+# one bit per weekday, Mo = 1 ... Su = 64
+DAY_CODES = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
+# converts a days string like "MoWeFr" to its bitmask
+def day_mask(days):
+    mask = 0
+    for i in range(0, len(days or ''), 2):
+        day = days[i:i+2]
+        if day in DAY_CODES:
+            mask |= 1 << DAY_CODES.index(day)
+    return mask
+
 class Course(models.Model):
     instructor_name = models.CharField(max_length=200)
     instructor_email = models.CharField(max_length=200)
@@ -36,9 +77,43 @@ class Course(models.Model):
     enrollment_available = models.IntegerField(default=0)
     topic = models.CharField(max_length=200)
     meetings = models.JSONField(default = dict)
+    # md5 of everything but the seat counts, see catalog.static_hash
+    static_hash = models.CharField(max_length=32, blank=True, default='')
+    # weekly occupancy bitmap of the meetings (see scheduling.py), kept up to date by save and
+    # the catalog sync; courses that fail valid() get an empty one and never conflict
+    occupancy = models.BinaryField(default=b'')
+
+    class Meta:
+        # sync_catalog upserts on this pair
+        constraints = [
+            models.UniqueConstraint(fields=['course_number', 'semester_code'], name='unique_course_section'),
+        ]
+        indexes = [
+            # keyset pages of the global search walk this order
+            models.Index(fields=['subject', 'catalog_number', 'id'], name='course_subject_catalog_idx'),
+        ]
 
     def __str__(self):
         return self.description
+
+    def save(self, *args, **kwargs):
+        # keep the occupancy bitmap and the Meeting rows in step with the meetings json
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'meetings' in update_fields:
+            self.occupancy = bits_to_bytes(self.meeting_bits())
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['occupancy']
+        super().save(*args, **kwargs)
+        if update_fields is None or 'meetings' in update_fields:
+            self.sync_meetings()
+
+    # the occupancy bitmap worked out from the meetings json
+    def meeting_bits(self):
+        return occupancy_bits(self.build_meetings()) if self.valid() else 0
+
+    # the stored occupancy bitmap as an int
+    def bits(self):
+        return bits_from_bytes(self.occupancy)
     
     def repeat(self,other):
         if self.catalog_number==other.catalog_number:
@@ -61,6 +136,24 @@ class Course(models.Model):
                             return True
         return False
     
+    # builds unsaved Meeting rows from the meetings json; meetings without days or times are skipped
+    def build_meetings(self):
+        meeting_rows = []
+        for meeting in self.meetings or []:
+            days = day_mask(meeting.get('days'))
+            start = parse_time(meeting.get('start_time'))
+            end = parse_time(meeting.get('end_time'))
+            if not days or start is None or end is None:
+                continue
+            meeting_rows.append(Meeting(course=self, days=days, start_min=start, end_min=end,
+                                        facility_description=meeting.get('facility_description', '')))
+        return meeting_rows
+
+    # replaces this course's Meeting rows with ones built from the meetings json
+    def sync_meetings(self):
+        self.meeting_set.all().delete()
+        Meeting.objects.bulk_create(self.build_meetings())
+
     def valid(self):
         for meeting in self.meetings:
             if len(meeting['days'])<2:
@@ -70,6 +163,91 @@ class Course(models.Model):
                 return False
         return True
 
+# one row per meeting of a course, so day and time filters run in sql against integer columns
+class Meeting(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    days = models.PositiveSmallIntegerField(default=0)
+    start_min = models.PositiveSmallIntegerField()
+    end_min = models.PositiveSmallIntegerField()
+    facility_description = models.CharField(max_length=200, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_min', 'end_min'], name='meeting_time_idx'),
+            models.Index(fields=['days', 'start_min'], name='meeting_days_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day_string()} {format_time(self.start_min)} - {format_time(self.end_min)}"
+
+    def day_string(self):
+        return ''.join(DAY_CODES[day] for day in days_in(self.days))
+
+# open seats and wait list of a section over time, one row per change seen by the sync
+class EnrollmentSnapshot(models.Model):
+    # the (course, taken_at) index covers lookups by course, so no separate one for the key
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, db_index=False)
+    taken_at = models.DateTimeField()
+    available = models.SmallIntegerField()
+    wait_list = models.SmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'taken_at'], name='snapshot_course_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.course_id} at {self.taken_at}: {self.available} open, {self.wait_list} waiting"
+
+# a student waiting for seats to open up in a section; see notifications.py
+class SeatWatch(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='seat_watches')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, db_index=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # also the index the sync uses to find a section's watchers
+            models.UniqueConstraint(fields=['course', 'user'], name='unique_seat_watch'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} watching {self.course_id}"
+
+# background work for manage.py run_worker; see jobs.py
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)
+    # jobs with the same key do the same work, so only one of them is queued at a time
+    key = models.CharField(max_length=200)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='pending'), name='unique_pending_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.status})"
+
 class UserInfo(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name = 'userinfo_user')
     grad_year = models.IntegerField(null = True,default = datetime.now().year)
@@ -82,24 +260,77 @@ class UserInfo(models.Model):
 class ShoppingCart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name = 'shop_user')
     class_list = models.ManyToManyField(Course, blank=True, related_name = "class_list")
+    # the class_list courses' occupancy bitmaps or-ed together, so checking a course for
+    # conflicts is one AND instead of loading the cart; add_class and remove_class keep it current
+    occupancy = models.BinaryField(default=b'')
+    # goes up whenever the cart or one of its courses' meetings changes; see timetable.cart_grid
+    version = models.PositiveIntegerField(default=0)
     def __str__(self):
         return f"class list for {self.user.username}"
+    def bits(self):
+        return bits_from_bytes(self.occupancy)
+
+    # the cart's meetings indexed by day, for conflict checks
+    def interval_index(self):
+        meetings = Meeting.objects.filter(course__class_list=self).select_related('course')
+        return IntervalIndex(meeting for meeting in meetings if meeting.course.valid())
+
+    # returns the Meeting already in the cart that overlaps course, or None
+    def find_conflict(self, course, index=None):
+        if not course.valid():
+            return None
+        if index is None:
+            index = self.interval_index()
+        for meeting in course.meeting_set.all():
+            conflict = index.conflict(meeting)
+            if conflict:
+                return conflict
+        return None
+
+    # returns (is_repeat, conflict) where conflict is the cart Meeting that overlaps course, or None
+    # The bitmaps rule out almost every conflict without loading the cart. They work in 5 minute
+    # slots, so a hit may be two meetings a few minutes apart; the meetings settle those.
     def add_class(self, course):
-        is_overlap = False
-        is_repeat = False
-        for curr_class in self.class_list.all():
-            if curr_class.repeat(course):
-                is_repeat = True
-                break
-            if curr_class.overlap(course):
-                is_overlap = True
-                break
-        if not is_repeat and not is_overlap:
-            self.class_list.add(course)
-        return is_repeat,is_overlap
+        with transaction.atomic():
+            # lock the cart row so two adds at once can't both pass the check
+            occupancy = ShoppingCart.objects.select_for_update().values_list('occupancy', flat=True).get(pk=self.pk)
+            occupied = bits_from_bytes(occupancy)
+            is_repeat = self.class_list.filter(catalog_number=course.catalog_number).exists()
+            conflict = None
+            if not is_repeat:
+                bits = course.bits()
+                if bits & occupied:
+                    conflict = self.find_conflict(course)
+                if not conflict:
+                    self.class_list.add(course)
+                    self.occupancy = bits_to_bytes(occupied | bits)
+                    ShoppingCart.objects.filter(pk=self.pk).update(occupancy=self.occupancy, version=F('version') + 1)
+        return is_repeat,conflict
     def remove_class(self, course):
-        if course in self.class_list.all():
-            self.class_list.remove(course)
+        with transaction.atomic():
+            ShoppingCart.objects.select_for_update().get(pk=self.pk)
+            if self.class_list.filter(pk=course.pk).exists():
+                self.class_list.remove(course)
+                # other courses may share slots with the removed one, so rebuild from the rest
+                bits = 0
+                for occupancy in self.class_list.values_list('occupancy', flat=True):
+                    bits |= bits_from_bytes(occupancy)
+                self.occupancy = bits_to_bytes(bits)
+                ShoppingCart.objects.filter(pk=self.pk).update(occupancy=self.occupancy, version=F('version') + 1)
+
+    # rebuilds the bitmaps of every cart holding one of course_ids, after the sync changed them
+    @classmethod
+    def refresh_occupancy(cls, course_ids):
+        cart_ids = set(cls.class_list.through.objects.filter(course_id__in=course_ids).values_list('shoppingcart_id', flat=True))
+        if not cart_ids:
+            return 0
+        bits = dict.fromkeys(cart_ids, 0)
+        rows = cls.class_list.through.objects.filter(shoppingcart_id__in=cart_ids).values_list('shoppingcart_id', 'course__occupancy')
+        for cart_id, occupancy in rows:
+            bits[cart_id] |= bits_from_bytes(occupancy)
+        cls.objects.bulk_update([cls(id=cart_id, occupancy=bits_to_bytes(b)) for cart_id, b in bits.items()], ['occupancy'])
+        cls.objects.filter(id__in=cart_ids).update(version=F('version') + 1)
+        return len(cart_ids)
 
 class Comments(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,  related_name="com_sender")
@@ -109,28 +340,83 @@ class Comments(models.Model):
     
 # Friending models based on code from CodingWithMitch: 
 # https://www.youtube.com/watch?v=hyJO4mkdwuM
-class FriendList(models.Model):
-    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='user')
-    friends = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='friends')
+# One row per pair of friends, stored with the lower user id in user_a so each friendship has
+# exactly one row. The unique constraint's index answers lookups by user_a and the (user_b, user_a)
+# index lookups by user_b, so checking, listing and removing friends are each one indexed query.
+class Friendship(models.Model):
+    # both columns lead one of the indexes below, so no separate ones for the keys
+    user_a = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    user_b = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='unique_friendship'),
+            models.CheckConstraint(check=models.Q(user_a__lt=F('user_b')), name='friendship_ordered'),
+        ]
+        indexes = [
+            models.Index(fields=['user_b', 'user_a'], name='friendship_user_b_idx'),
+        ]
+
     def __str__(self):
-        return self.user.username
-    def add_friend(self, account):
-        if not account in self.friends.all():
-            self.friends.add(account)
-    def remove_friend(self,account):
-        if account in self.friends.all():
-            self.friends.remove(account)
-    def unfriend(self, account):
-        #account is the current friend that will be removed in this operation
-        self.remove_friend(account)
-        account_list = FriendList.objects.get(user=account)
-        account_list.remove_friend(self.user)
-
-    def is_mutual_friend(self,friend):
-        if friend in self.friends.all():
-            return True
-        return False
-    
+        return f"{self.user_a} and {self.user_b}"
+
+    # the row for two users, whichever order they come in
+    @classmethod
+    def edge(cls, user, other):
+        a, b = sorted((user.pk, other.pk))
+        return cls.objects.filter(user_a_id=a, user_b_id=b)
+
+    @classmethod
+    def are_friends(cls, user, other):
+        return cls.edge(user, other).exists()
+
+    @classmethod
+    def befriend(cls, user, other):
+        if user.pk != other.pk:
+            a, b = sorted((user.pk, other.pk))
+            cls.objects.get_or_create(user_a_id=a, user_b_id=b)
+
+    @classmethod
+    def unfriend(cls, user, other):
+        cls.edge(user, other).delete()
+
+    # filter for User querysets matching user's friends
+    @classmethod
+    def friend_filter(cls, user):
+        return models.Q(id__in=cls.objects.filter(user_a=user).values('user_b')) | \
+            models.Q(id__in=cls.objects.filter(user_b=user).values('user_a'))
+
+    @classmethod
+    def friends_of(cls, user):
+        return get_user_model().objects.filter(cls.friend_filter(user))
+
+    @classmethod
+    def mutual_friends(cls, user, other):
+        return cls.friends_of(user).filter(cls.friend_filter(other))
+
+
+# "People you may know" for a user, worked out for everyone at once by suggest_friends (see
+# suggestions.py) so the profile page only reads a few rows
+class FriendSuggestion(models.Model):
+    # the (user, -score) index covers lookups by user
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    suggested = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    mutual_friends = models.PositiveIntegerField(default=0)
+    shared_courses = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='unique_friend_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='suggestion_user_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.suggested} for {self.user}"
 
 class FriendRequest(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,  related_name="sender")
@@ -140,10 +426,7 @@ class FriendRequest(models.Model):
     def __str__(self):
         return self.sender.username
     def accept(self):
-        receiver_list = FriendList.objects.get(user=self.receiver)
-        sender_list = FriendList.objects.get(user=self.sender)
-        receiver_list.add_friend(self.sender)
-        sender_list.add_friend(self.receiver)
+        Friendship.befriend(self.sender, self.receiver)
         self.delete()
     def decline(self):
         #receiver declines
@@ -157,3 +440,63 @@ class Review(models.Model):
     course_number = models.CharField(max_length=10)
     review_text = models.CharField(max_length=1000)
 
+    class Meta:
+        # course pages look reviews up by course, newest first
+        indexes = [
+            models.Index(fields=['subject', 'course_number', 'id'], name='review_course_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk:
+            old = Review.objects.filter(pk=self.pk).values_list('subject', 'course_number').first()
+        super().save(*args, **kwargs)
+        # keep the course's ReviewSummary (and the old course's, if the review moved) up to date
+        ReviewSummary.refresh(self.subject, self.course_number)
+        if old and old != (self.subject, self.course_number):
+            ReviewSummary.refresh(*old)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        ReviewSummary.refresh(self.subject, self.course_number)
+        return result
+
+# review count and newest review of a course, so the course page reads one row
+class ReviewSummary(models.Model):
+    subject = models.CharField(max_length=10)
+    course_number = models.CharField(max_length=10)
+    review_count = models.PositiveIntegerField(default=0)
+    latest_review = models.ForeignKey(Review, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'course_number'], name='unique_review_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} {self.course_number}: {self.review_count} reviews"
+
+    # recounts a course's reviews from the (subject, course_number) index
+    @classmethod
+    def refresh(cls, subject, course_number):
+        reviews = Review.objects.filter(subject=subject, course_number=course_number)
+        cls.objects.update_or_create(subject=subject, course_number=course_number, defaults={
+            'review_count': reviews.count(),
+            'latest_review': reviews.order_by('-id').first(),
+        })
+
+# average gpa of a course from vagrades, so course pages don't have to ask it every time
+# gpa is null when vagrades has no average for the course; see grades.py for the ttls
+class CourseGrade(models.Model):
+    subject = models.CharField(max_length=10)
+    catalog_number = models.CharField(max_length=10)
+    gpa = models.FloatField(null=True, blank=True)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'catalog_number'], name='unique_course_grade'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} {self.catalog_number}: {self.gpa}"
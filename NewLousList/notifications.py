@@ -0,0 +1,67 @@
+import logging
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+from .models import SeatWatch
+from .jobs import queue_seat_notifications
+
+logger = logging.getLogger(__name__)
+
+# watchers are looked up this many opened sections at a time
+NOTIFY_BATCH_SIZE = 200
+# at most this many watchers per email, all in bcc
+MAX_RECIPIENTS = 50
+
+
+def seat_opening_email(course, emails):
+    subject = f"Seats open in {course.subject} {course.catalog_number}-{course.course_section}"
+    body = (f"{course.subject} {course.catalog_number} ({course.description}), section {course.course_section}, "
+            f"now has {course.enrollment_available} open seat(s) of {course.class_capacity}.\n\n"
+            f"You are getting this because you are watching this section on New Lou's List.")
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, bcc=emails)
+
+
+# Tells everyone watching the given sections that seats opened up. Each batch of sections
+# costs one query for its watchers (with their users and sections), one email per section
+# (per MAX_RECIPIENTS watchers) over a single mail connection, and one update per email sent.
+# Only watchers whose email went out are stamped; a section whose email failed is logged and
+# queued for run_worker to try again, skipping watchers emailed since this run started.
+# returns the number of emails sent
+def notify_seat_openings(course_ids, batch_size=NOTIFY_BATCH_SIZE, since=None):
+    started = timezone.now()
+    sent = 0
+    failed = set()
+    course_ids = list(course_ids)
+    # one connection for every email; a server that is down shows up as sends that return 0
+    connection = get_connection(fail_silently=True)
+    connection.open()
+    try:
+        for i in range(0, len(course_ids), batch_size):
+            watches = SeatWatch.objects.filter(course_id__in=course_ids[i:i + batch_size])
+            if since is not None:
+                # a retry: only sections still open, and watchers that weren't reached since
+                watches = watches.filter(Q(last_notified_at__isnull=True) | Q(last_notified_at__lt=since),
+                                         course__enrollment_available__gt=0)
+            by_course = {}
+            for watch in watches.select_related('user', 'course').order_by('course_id', 'id'):
+                if watch.user.email:
+                    by_course.setdefault(watch.course, []).append(watch)
+            for course, course_watches in by_course.items():
+                for j in range(0, len(course_watches), MAX_RECIPIENTS):
+                    chunk = course_watches[j:j + MAX_RECIPIENTS]
+                    if not connection.send_messages([seat_opening_email(course, [watch.user.email for watch in chunk])]):
+                        logger.warning('seat opening email for %s %s-%s (%d watchers) failed',
+                                       course.subject, course.catalog_number, course.course_section, len(chunk))
+                        failed.add(course.id)
+                        continue
+                    sent += 1
+                    SeatWatch.objects.filter(id__in=[watch.id for watch in chunk]).update(last_notified_at=timezone.now())
+    finally:
+        connection.close()
+    if failed:
+        if since is not None:
+            # let the job queue back off and give up after max_attempts
+            raise RuntimeError(f'seat opening emails failed for sections {sorted(failed)}')
+        queue_seat_notifications(sorted(failed), started)
+    return sent
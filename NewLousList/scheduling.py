@@ -0,0 +1,282 @@
+import heapq
+from bisect import bisect_right
+
+
+# weekday numbers (Mo = 0 ... Su = 6) set in a day bitmask
+def days_in(mask):
+    return [day for day in range(7) if mask >> day & 1]
+
+
+# Per-day list of meetings sorted by start time, used for cart conflict checks.
+# Entries only need days, start_min and end_min, so Meeting rows work directly.
+# Meetings on the same day in a cart never overlap (the cart refuses conflicts), so sorting
+# by start also sorts by end and only the closest meeting that starts before a new meeting
+# ends has to be checked.
+class IntervalIndex:
+    def __init__(self, meetings=()):
+        self.starts = [[] for day in range(7)]
+        self.entries = [[] for day in range(7)]
+        for meeting in meetings:
+            self.add(meeting)
+
+    def add(self, meeting):
+        for day in days_in(meeting.days):
+            i = bisect_right(self.starts[day], meeting.start_min)
+            self.starts[day].insert(i, meeting.start_min)
+            self.entries[day].insert(i, meeting)
+
+    # returns the indexed meeting that overlaps meeting, or None
+    # touching times count as a conflict, same as Course.overlap
+    def conflict(self, meeting):
+        for day in days_in(meeting.days):
+            i = bisect_right(self.starts[day], meeting.end_min)
+            if i and self.entries[day][i - 1].end_min >= meeting.start_min:
+                return self.entries[day][i - 1]
+        return None
+
+
+# Weekly occupancy bitmaps: one bit per 5 minute slot, 288 slots per day, Mo starts at bit 0.
+# A meeting covers every slot from the one holding its start time to the one holding its end
+# time, so meetings that touch (one ends at 9:50, the next starts at 9:50) share a slot and
+# conflict, same as Course.overlap.
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+# Times come from upstream as is: a meeting that ends before it starts covers nothing (time_grid
+# leaves those out too), and one running to 24:00 or past it stops at the day's last slot rather
+# than spilling into the next day.
+def meeting_bits(days, start_min, end_min):
+    start_min = max(start_min, 0)
+    end_min = min(end_min, 24 * 60 - 1)
+    if end_min < start_min:
+        return 0
+    first = start_min // SLOT_MINUTES
+    last = end_min // SLOT_MINUTES
+    span = ((1 << (last - first + 1)) - 1) << first
+    bits = 0
+    for day in days_in(days):
+        bits |= span << (day * SLOTS_PER_DAY)
+    return bits
+
+
+# bitmap for a list of meetings (anything with days, start_min and end_min)
+def occupancy_bits(meetings):
+    bits = 0
+    for meeting in meetings:
+        bits |= meeting_bits(meeting.days, meeting.start_min, meeting.end_min)
+    return bits
+
+
+# The weekly timetable as a table: one column per day, one row per stretch between consecutive
+# meeting start/end times, so rows line up with every meeting exactly however odd its times.
+# entries is (course, meetings) pairs, meetings being anything with days, start_min and end_min.
+# Returns {'days': [day numbers], 'rows': [{'start': label, 'cells': [...]}]} where each cell
+# is None (free) or {'rowspan': n, 'entries': [...]}; cells hidden under a rowspan above are
+# left out, which is how html tables expect them. Meetings that overlap on a day (only possible
+# in carts from before conflict checks) share one cell. Sa and Su only get columns if used.
+def time_grid(entries, label=str):
+    by_day = [[] for day in range(7)]
+    bounds = set()
+    for course, meetings in entries:
+        for meeting in meetings:
+            if meeting.end_min <= meeting.start_min:
+                continue
+            for day in days_in(meeting.days):
+                by_day[day].append((meeting.start_min, meeting.end_min, course, meeting))
+            bounds.update((meeting.start_min, meeting.end_min))
+    bounds = sorted(bounds)
+    row_of = {minute: row for row, minute in enumerate(bounds)}
+    days = [day for day in range(7) if day < 5 or by_day[day]]
+    rows = [{'start': label(minute), 'cells': []} for minute in bounds[:-1]]
+
+    for day in days:
+        # merge the day's meetings into blocks, then lay the blocks and the free rows out
+        blocks = []
+        for start, end, course, meeting in sorted(by_day[day], key=lambda entry: (entry[0], entry[1])):
+            entry = {'course': course, 'start': label(start), 'end': label(end),
+                     'where': getattr(meeting, 'facility_description', '')}
+            if blocks and start < blocks[-1][1]:
+                blocks[-1][1] = max(blocks[-1][1], end)
+                blocks[-1][2].append(entry)
+            else:
+                blocks.append([start, end, [entry]])
+        row = 0
+        for start, end, block_entries in blocks:
+            while row < row_of[start]:
+                rows[row]['cells'].append(None)
+                row += 1
+            rows[row]['cells'].append({'rowspan': row_of[end] - row, 'entries': block_entries})
+            row = row_of[end]
+        while row < len(rows):
+            rows[row]['cells'].append(None)
+            row += 1
+    return {'days': days, 'rows': rows}
+
+
+# Bitmaps are stored in BinaryFields as little-endian bytes with trailing zero bytes left off,
+# so a weekday-only schedule takes at most 5 days x 288 slots = 180 bytes.
+def bits_to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+# accepts bytes or the memoryview postgres hands back
+def bits_from_bytes(data):
+    return int.from_bytes(data or b'', 'little')
+
+
+# Backtracking search over section combinations.
+# groups is a list of lists of (bits, section); one section is picked from every group.
+# Yields (occupied bits, schedule) for each conflict-free combination, with the sections in
+# group order, and stops after limit results or once max_steps sections have been tried.
+# prune(bits) can reject a partial schedule and everything that would be built on it.
+def search_schedules(groups, limit, max_steps=200000, prune=None):
+    if not groups or limit <= 0:
+        return
+    # fill the most constrained group first so dead ends show up early
+    order = sorted(range(len(groups)), key=lambda i: len(groups[i]))
+    picked = [None] * len(groups)
+    state = {'found': 0, 'steps': 0}
+
+    def search(depth, occupied, remaining):
+        if depth == len(order):
+            state['found'] += 1
+            yield occupied, list(picked)
+            return
+        for bits, section in remaining[0]:
+            state['steps'] += 1
+            if state['steps'] > max_steps or state['found'] >= limit:
+                return
+            if bits & occupied:
+                continue
+            new_occupied = occupied | bits
+            # forward check: every later group still needs at least one section that fits
+            later = []
+            for group in remaining[1:]:
+                fits = [entry for entry in group if not entry[0] & new_occupied]
+                if not fits:
+                    break
+                later.append(fits)
+            else:
+                if prune is not None and prune(new_occupied):
+                    continue
+                picked[order[depth]] = section
+                yield from search(depth + 1, new_occupied, later)
+
+    for result in search(0, 0, [groups[i] for i in order]):
+        yield result
+        if state['found'] >= limit:
+            return
+
+
+# every conflict-free schedule (list of sections) from search_schedules
+def generate_schedules(groups, limit, max_steps=200000):
+    for bits, schedule in search_schedules(groups, limit, max_steps):
+        yield schedule
+
+
+# Things a student can ask the schedule builder to optimize for
+#   late_start: start the week's earliest class as late as possible
+#   gaps: as little free time between classes on the same day as possible
+#   days_off: as many weekdays without class as possible
+#   compact: as little time on grounds (first class to last class) per day as possible
+OBJECTIVES = ('late_start', 'gaps', 'days_off', 'compact')
+
+DAY_SLOTS = (1 << SLOTS_PER_DAY) - 1
+
+
+# summary of a weekly occupancy bitmap, in minutes (to the nearest 5 minute slot)
+def occupancy_stats(bits):
+    earliest_slot = None
+    gap_slots = 0
+    span_slots = 0
+    weekdays_used = 0
+    for day in range(7):
+        day_bits = bits >> (day * SLOTS_PER_DAY) & DAY_SLOTS
+        if not day_bits:
+            continue
+        if day < 5:
+            weekdays_used += 1
+        first = (day_bits & -day_bits).bit_length() - 1
+        last = day_bits.bit_length() - 1
+        if earliest_slot is None or first < earliest_slot:
+            earliest_slot = first
+        span_slots += last - first + 1
+        gap_slots += last - first + 1 - day_bits.bit_count()
+    return {
+        'earliest_start': None if earliest_slot is None else earliest_slot * SLOT_MINUTES,
+        'gap_minutes': gap_slots * SLOT_MINUTES,
+        'span_minutes': span_slots * SLOT_MINUTES,
+        'days_off': 5 - weekdays_used,
+    }
+
+
+# Free stretches of a weekly bitmap, e.g. the or of several people's carts for the times they are
+# all free. Returns one list of (start_min, end_min) per day, only counting time between day_start
+# and day_end and stretches of at least min_minutes. The slot holding a class's end time is
+# taken, so free time after a class starts up to 5 minutes after it ends.
+def free_slots(bits, day_start=8 * 60, day_end=22 * 60, min_minutes=30, days=range(5)):
+    first = day_start // SLOT_MINUTES
+    window = ((1 << (day_end // SLOT_MINUTES - first)) - 1) << first
+    min_slots = -(-min_minutes // SLOT_MINUTES)
+    free = []
+    for day in days:
+        open_bits = ~(bits >> (day * SLOTS_PER_DAY)) & window
+        stretches = []
+        while open_bits:
+            start = (open_bits & -open_bits).bit_length() - 1
+            run = open_bits >> start
+            length = (run ^ (run + 1)).bit_length() - 1
+            if length >= min_slots:
+                stretches.append((start * SLOT_MINUTES, (start + length) * SLOT_MINUTES))
+            open_bits &= ~(((1 << length) - 1) << start)
+        free.append(stretches)
+    return free
+
+
+# weighted cost of a schedule's stats, lower is better
+# times are counted in hours so a weight of 1 means "an hour is worth a day off"
+def schedule_cost(stats, weights):
+    cost = 0
+    if stats['earliest_start'] is not None:
+        cost -= weights.get('late_start', 0) * stats['earliest_start'] / 60
+    cost += weights.get('gaps', 0) * stats['gap_minutes'] / 60
+    cost -= weights.get('days_off', 0) * stats['days_off']
+    cost += weights.get('compact', 0) * stats['span_minutes'] / 60
+    return cost
+
+
+# Cheapest cost any schedule built on top of a partial one can have. Adding sections only
+# moves the earliest start earlier, uses up days off and stretches days, so those terms can
+# only get worse; gaps can be filled in later, so they are left out. With nothing placed yet
+# (say only online sections so far) later sections could start as late as the last slot of the
+# day. All of this needs non-negative weights.
+def cost_lower_bound(bits, weights):
+    stats = occupancy_stats(bits)
+    stats['gap_minutes'] = 0
+    if stats['earliest_start'] is None:
+        stats['earliest_start'] = (SLOTS_PER_DAY - 1) * SLOT_MINUTES
+    return schedule_cost(stats, weights)
+
+
+# The k cheapest conflict-free schedules for the given weights, best first.
+# Only k schedules are kept at any time, in a max-heap on cost whose root is the worst one
+# kept so far; once the heap is full, partial schedules that can't beat the root are pruned.
+def top_schedules(groups, k, weights, max_steps=200000):
+    if k <= 0:
+        return []
+    # try each group's most promising sections first so the heap fills with good schedules
+    # early and the pruning bound gets tight quickly
+    groups = [sorted(group, key=lambda entry: cost_lower_bound(entry[0], weights)) for group in groups]
+    heap = []
+
+    def prune(bits):
+        return len(heap) == k and cost_lower_bound(bits, weights) >= -heap[0][0]
+
+    for n, (bits, schedule) in enumerate(search_schedules(groups, float('inf'), max_steps, prune)):
+        entry = (-schedule_cost(occupancy_stats(bits), weights), -n, schedule)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    return [schedule for neg_cost, neg_n, schedule in sorted(heap, reverse=True)]
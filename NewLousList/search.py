@@ -0,0 +1,169 @@
+import base64, json, math, re
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Full-text course search over description, topic and instructor_name.
+# SQLite (local) uses an FTS5 table kept in sync by triggers on the course table.
+# Postgres (DATABASE_URL on heroku) uses a GIN index on the same tsvector expression the
+# queries use. Either way the index follows every insert, upsert and delete by itself.
+
+COURSE_TABLE = '"NewLousList_course"'
+
+SQLITE_INDEX = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS course_fts USING fts5(
+        description, topic, instructor_name, content={COURSE_TABLE}, content_rowid='id')""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_insert AFTER INSERT ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(rowid, description, topic, instructor_name)
+        VALUES (new.id, new.description, new.topic, new.instructor_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_delete AFTER DELETE ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(course_fts, rowid, description, topic, instructor_name)
+        VALUES ('delete', old.id, old.description, old.topic, old.instructor_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS course_fts_update AFTER UPDATE OF description, topic, instructor_name ON {COURSE_TABLE} BEGIN
+        INSERT INTO course_fts(course_fts, rowid, description, topic, instructor_name)
+        VALUES ('delete', old.id, old.description, old.topic, old.instructor_name);
+        INSERT INTO course_fts(rowid, description, topic, instructor_name)
+        VALUES (new.id, new.description, new.topic, new.instructor_name);
+    END""",
+    "INSERT INTO course_fts(course_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_DOCUMENT = ("to_tsvector('english', coalesce(description, '') || ' ' || coalesce(topic, '') "
+                     "|| ' ' || coalesce(instructor_name, ''))")
+
+POSTGRES_INDEX = [
+    f"CREATE INDEX IF NOT EXISTS course_search_idx ON {COURSE_TABLE} USING gin (({POSTGRES_DOCUMENT}))",
+]
+
+
+# Creates the index (and on SQLite its triggers) if missing and refills it from the course table.
+# Safe to run again: SQLite drops a table's triggers whenever a migration rebuilds the table,
+# so migrations that alter Course run the copy frozen in migration 0027 afterwards. A change to
+# the index here needs a new migration that installs it.
+def install_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = SQLITE_INDEX if vendor == 'sqlite' else POSTGRES_INDEX if vendor == 'postgresql' else []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def remove_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for trigger in ('course_fts_insert', 'course_fts_delete', 'course_fts_update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute('DROP TABLE IF EXISTS course_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS course_search_idx')
+
+
+# words of a user's query, e.g. 'intro "to" C++' -> ['intro', 'to', 'C']
+def query_words(text):
+    return re.findall(r'\w+', text or '')
+
+
+# Filters courses to the ones matching every word of text (as a word prefix) in description,
+# topic or instructor_name, and orders them best match first.
+# Other databases fall back to icontains filters with every rank 0.
+def search(queryset, text):
+    words = query_words(text)
+    if not words:
+        return queryset
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        matches = RawSQL(f'{COURSE_TABLE}."id" IN (SELECT rowid FROM course_fts WHERE course_fts MATCH %s)',
+                         [match], output_field=BooleanField())
+        # bm25 is lower for better matches
+        rank = RawSQL(f'(SELECT -bm25(course_fts) FROM course_fts WHERE course_fts MATCH %s AND rowid = {COURSE_TABLE}."id")',
+                      [match], output_field=FloatField())
+    elif vendor == 'postgresql':
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        matches = RawSQL(f"{POSTGRES_DOCUMENT} @@ to_tsquery('english', %s)", [tsquery], output_field=BooleanField())
+        # ts_rank is a real; as double precision it compares equal to the float8 a cursor sends back
+        rank = RawSQL(f"ts_rank({POSTGRES_DOCUMENT}, to_tsquery('english', %s))::float8", [tsquery], output_field=FloatField())
+    else:
+        for word in words:
+            queryset = queryset.filter(Q(description__icontains=word) | Q(topic__icontains=word) | Q(instructor_name__icontains=word))
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+    return queryset.filter(matches).annotate(rank=rank).order_by('-rank', 'id')
+
+
+# Keyset pagination: rather than OFFSET (which reads and throws away every earlier row), each
+# page starts right after the last row of the previous one. ordering is a list of field names
+# ('-name' for descending) that must end with a unique field; the cursor is the ordering values
+# of the last row shown, encoded for use in a url.
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+# A cursor is user input: its values are converted with the fields they are compared to, and
+# one that doesn't fit (say a string for the id, an id past the column's range or an infinite
+# rank) is ignored, giving the first page.
+def cursor_values(queryset, ordering, values):
+    converted = []
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        model_field = queryset.query.annotations.get(name)
+        model_field = model_field.output_field if model_field is not None else queryset.model._meta.get_field(name)
+        try:
+            value = model_field.to_python(value)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            return None
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        # every integer column here is at most 64 bits (sqlite, bigint ids on postgres)
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            return None
+        converted.append(value)
+    return converted
+
+
+# returns (rows on this page, cursor for the next page or None)
+def keyset_page(queryset, ordering, cursor, size):
+    return finish_page(list(keyset_rows(queryset, ordering, cursor, size)), ordering, size)
+
+
+# same as keyset_page, through the async ORM
+async def akeyset_page(queryset, ordering, cursor, size):
+    return finish_page([row async for row in keyset_rows(queryset, ordering, cursor, size)], ordering, size)
+
+
+# the rows after cursor in ordering, one more than a page so we know if there is a next one
+def keyset_rows(queryset, ordering, cursor, size):
+    values = decode_cursor(cursor, len(ordering)) if cursor else None
+    if values is not None:
+        values = cursor_values(queryset, ordering, values)
+    if values is not None:
+        # rows after the cursor in (a, b, c) order: a > x, or a = x and b > y, or ...
+        after = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            step = Q(**{name + lookup: values[i]})
+            for earlier, value in zip(ordering[:i], values):
+                step &= Q(**{earlier.lstrip('-'): value})
+            after |= step
+        queryset = queryset.filter(after)
+    return queryset.order_by(*ordering)[:size + 1]
+
+
+def finish_page(rows, ordering, size):
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor([getattr(rows[-1], field.lstrip('-')) for field in ordering])
+    return rows, next_cursor
@@ -0,0 +1,85 @@
+import heapq
+from collections import defaultdict
+from itertools import islice
+from django.db import transaction
+from django.utils import timezone
+from .models import Friendship, FriendRequest, FriendSuggestion, ShoppingCart
+
+# "People you may know": friends of friends, ranked by how many friends they share with the user
+# and how many courses (same subject and catalog number, any section) their carts share.
+# The whole friend graph and every cart are read in three queries and walked in memory, then
+# the suggestions are swapped in all at once. run_worker queues it once a day (jobs.PERIODIC);
+# `manage.py suggest_friends` runs it by hand.
+
+SUGGESTION_LIMIT = 10
+# friends (and friends of each friend) looked at per user, so one very popular account can't
+# make the walk quadratic
+MAX_FANOUT = 500
+MUTUAL_WEIGHT = 1.0
+COURSE_WEIGHT = 0.5
+
+
+# user id -> set of friend ids
+def friend_graph():
+    graph = defaultdict(set)
+    for a, b in Friendship.objects.values_list('user_a_id', 'user_b_id'):
+        graph[a].add(b)
+        graph[b].add(a)
+    return graph
+
+
+# user id -> set of (subject, catalog_number) in their cart
+def cart_courses():
+    courses = defaultdict(set)
+    rows = ShoppingCart.class_list.through.objects.values_list('shoppingcart__user_id', 'course__subject', 'course__catalog_number')
+    for user_id, subject, catalog_number in rows:
+        courses[user_id].add((subject, catalog_number))
+    return courses
+
+
+# (user id, candidate id, mutual friends, shared courses, score) for the best limit candidates
+def suggest_for(user_id, graph, courses, requested, limit=SUGGESTION_LIMIT):
+    friends = graph.get(user_id, set())
+    mutual = defaultdict(int)
+    for friend in islice(sorted(friends), MAX_FANOUT):
+        for candidate in islice(sorted(graph[friend]), MAX_FANOUT):
+            if candidate != user_id and candidate not in friends:
+                mutual[candidate] += 1
+    mine = courses.get(user_id, set())
+    scored = []
+    for candidate, count in mutual.items():
+        # someone with a friend request either way already knows about them
+        if (user_id, candidate) in requested:
+            continue
+        shared = len(mine & courses.get(candidate, set()))
+        scored.append((user_id, candidate, count, shared, MUTUAL_WEIGHT * count + COURSE_WEIGHT * shared))
+    # ties go to the older account
+    return heapq.nlargest(limit, scored, key=lambda row: (row[4], row[2], -row[1]))
+
+
+# recomputes everyone's suggestions; returns (users with suggestions, suggestions stored)
+def compute_suggestions(limit=SUGGESTION_LIMIT):
+    graph = friend_graph()
+    courses = cart_courses()
+    requested = set()
+    for sender, receiver in FriendRequest.objects.values_list('sender_id', 'receiver_id'):
+        requested.update(((sender, receiver), (receiver, sender)))
+    now = timezone.now()
+    rows = []
+    users = 0
+    for user_id in graph:
+        suggestions = suggest_for(user_id, graph, courses, requested, limit)
+        users += bool(suggestions)
+        rows.extend(FriendSuggestion(user_id=user, suggested_id=candidate, mutual_friends=count, shared_courses=shared,
+                                     score=score, computed_at=now)
+                    for user, candidate, count, shared, score in suggestions)
+    with transaction.atomic():
+        FriendSuggestion.objects.all().delete()
+        FriendSuggestion.objects.bulk_create(rows, batch_size=1000)
+    return users, len(rows)
+
+
+# a user's stored suggestions, best first, minus anyone they have befriended since
+def suggestions_for(user, limit=SUGGESTION_LIMIT):
+    return FriendSuggestion.objects.filter(user=user).exclude(suggested__in=Friendship.friends_of(user)) \
+        .select_related('suggested').order_by('-score', 'suggested_id')[:limit]
@@ -0,0 +1,33 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .catalog import fetch_department, fetch_department_list, sync_enrollment, sync_subjects
+from .grades import refresh_grade
+from .jobs import queue_stale_department_syncs
+from .models import Subject
+from .notifications import notify_seat_openings
+from .suggestions import compute_suggestions
+
+# what run_worker does for each kind of job (see jobs.py for how they are queued)
+
+
+def sync_department(subject):
+    sync_enrollment(fetch_department(subject, max_age=0))
+    Subject.objects.filter(subject=subject).update(synced_at=timezone.now())
+
+
+def sync_all_subjects():
+    sync_subjects(fetch_department_list(max_age=0))
+
+
+def retry_seat_notifications(course_ids, since):
+    notify_seat_openings(course_ids, since=parse_datetime(since))
+
+
+HANDLERS = {
+    'sync_department': sync_department,
+    'sync_subjects': sync_all_subjects,
+    'sync_departments': queue_stale_department_syncs,
+    'refresh_grade': refresh_grade,
+    'notify_seats': retry_seat_notifications,
+    'suggest_friends': compute_suggestions,
+}
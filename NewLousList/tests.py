@@ -1,12 +1,30 @@
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
-from .models import Subject,Course, UserInfo, ShoppingCart, Comments, FriendList, FriendRequest, Review
+from .models import Subject,Course, UserInfo, ShoppingCart, Comments, Friendship, FriendRequest, FriendSuggestion, Review, ReviewSummary, Meeting, CourseGrade, EnrollmentSnapshot, SeatWatch, Job, day_mask, parse_time
 from .forms import NewReview
+from .grades import acached_grade, gpa_label, letter_grade, refresh_grade
+from .catalog import fetch_department, normalize_meetings, subject_index, sync_enrollment, sync_subjects, upsert_courses
+from django.core.cache import cache
+from django.core import mail
+from .search import akeyset_page, encode_cursor, keyset_page, search
+from .history import seat_curve
+from .jobs import enqueue, queue_periodic, queue_stale_department_syncs, run_pending
+from .tasks import HANDLERS
+from . import upstream
+from .scheduling import IntervalIndex, bits_from_bytes, bits_to_bytes, generate_schedules, meeting_bits, occupancy_stats, schedule_cost, search_schedules, time_grid, top_schedules
+from django.core.management import call_command
+from unittest import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync
+import asyncio, io, json
+from datetime import timedelta
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.test import Client
 from django.contrib.auth.models import User
-import unittest, requests
+import unittest, requests, threading, time
 
 def create_subject(subject, name):
     """
@@ -14,8 +32,39 @@ def create_subject(subject, name):
     """
     return Subject.objects.create(subject=subject, name=name)
 
+def api_course(subject, catalog_number, course_number, description, **fields):
+    """
+    Global function that builds a course the way /api/dept/<subject> returns it
+    """
+    course = {
+        "instructor": {"name": "Testing Teacher", "email": "test@gmail.com"},
+        "course_number": course_number,
+        "semester_code": 1228,
+        "course_section": "001",
+        "subject": subject,
+        "catalog_number": catalog_number,
+        "description": description,
+        "units": "3",
+        "component": "LEC",
+        "class_capacity": 50,
+        "wait_list": 0,
+        "wait_cap": 10,
+        "enrollment_total": 40,
+        "enrollment_available": 10,
+        "topic": "",
+        "meetings": [{"days": "MoWe",
+                      "start_time": "17.00.00.000000-05:00",
+                      "end_time": "18.15.00.000000-05:00",
+                      "facility_description": "Olsson Hall 009"}]
+    }
+    course.update(fields)
+    return course
+
 
 class GoogleLoginTests(TestCase):
+    def setUp(self):
+        # the home page's subject index lives in the cache, which outlasts each test's database
+        cache.clear()
 
     def test_login_page(self):
         """Check that the login page successfully loads"""
@@ -49,6 +98,10 @@ class GoogleLoginTests(TestCase):
 
 
 class HomePageTests(TestCase):
+    def setUp(self):
+        # the home page's subject index lives in the cache, which outlasts each test's database
+        cache.clear()
+
 
     def test_home_page_without_login(self):
         """
@@ -90,6 +143,8 @@ class HomePageTests(TestCase):
         """
         sub1 = create_subject('XXX', 'Test Subject 1')
         sub2 = create_subject('ZZZ', 'Test Subject 2')
+        # the page only lists subjects the catalog sync has stored
+        sync_subjects([{'subject': 'ACCT'}, {'subject': 'BIOL'}, {'subject': 'CS'}, {'subject': 'EURS'}])
         user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
         self.client.login(username=user.username, password='pass')
         url = reverse('NewLousList:index')
@@ -105,6 +160,39 @@ class HomePageTests(TestCase):
         # Subject.objects.get(subject='ZZZ').delete()
 
 
+    def test_subject_index_is_cached_until_subjects_change(self):
+        """
+        The home page groups subjects into schools with one query, then serves the cached
+        grouping until a catalog sync adds subjects
+        """
+        cache.clear()
+        create_subject('CS', 'Computer Science')
+        create_subject('ACCT', 'Accounting')
+        create_subject('CS', 'Computer Science')
+        create_subject('EDHS', 'Human Services')
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('NewLousList:index'))
+        self.assertEqual(len([q for q in queries if 'NewLousList_subject' in q['sql']]), 1)
+        self.assertEqual([sub.subject for sub in response.context['engr_list']], ['CS'])
+        self.assertEqual([sub.subject for sub in response.context['college_list']], ['ACCT', 'CS'])
+        self.assertEqual([sub.subject for sub in response.context['edu_list']], ['EDHS'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('NewLousList:index'))
+        self.assertFalse([q for q in queries if 'NewLousList_subject' in q['sql']])
+        self.assertNotContains(response, 'APMA')
+
+        # a subject created outside the sync stays hidden until the version moves on
+        create_subject('SYS', 'Systems & Information Engr')
+        self.assertEqual(len(subject_index()['engr_list']), 1)
+        sync_subjects([{'subject': 'CS'}, {'subject': 'APMA'}])
+        self.assertEqual([sub.subject for sub in subject_index()['engr_list']], ['APMA', 'CS', 'SYS'])
+        response = self.client.get(reverse('NewLousList:index'))
+        self.assertContains(response, 'APMA - Applied Mathematics')
+
     def test_subject_redirect(self):
         """
         When a subject is selected, the site is redirected to a page that displays all
@@ -133,6 +221,12 @@ class HomePageTests(TestCase):
         self.assertEqual(response3.status_code, 200)
 
 class homePageSubjectSearchTests(TestCase):
+    def setUp(self):
+        # the home page's subject index lives in the cache, which outlasts each test's database
+        cache.clear()
+        # the home page no longer fetches the department list itself; run_worker stores it
+        sync_subjects([{'subject': sub} for sub in ('ACCT', 'ASTR', 'CS', 'ECON', 'IT')])
+
     def test_specific_search(self):
         """
         Search for a valid subject with only one result expected
@@ -181,14 +275,19 @@ class courseBySubjectTests(TestCase):
         user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
         self.client.login(username=user.username, password='pass')
 
+        upsert_courses([api_course('ACCT', '2010', 20762, 'Introductory Accounting I')])
+
         ACCT_subject = Subject.objects.create(subject='ACCT')
         response = self.client.get(reverse('NewLousList:courses_by_subject', args=('ACCT',)))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Introductory Accounting I')
+        self.assertContains(response, 'Testing Teacher')
+        self.assertContains(response, '05:00 PM')
 
         CS_subject = Subject.objects.create(subject='CS')
         response = self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',)))
         self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Introductory Accounting I')
 
         Subject.objects.get(subject='ACCT').delete()
         Subject.objects.get(subject='CS').delete()
@@ -216,6 +315,422 @@ class courseBySubjectTests(TestCase):
         Subject.objects.get(subject='CS').delete()
 
 
+    def test_query_count_does_not_grow_with_department(self):
+        """
+        Check that the number of queries is the same for a department with one section and one with many
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        Subject.objects.create(subject='ACCT')
+        Subject.objects.create(subject='CS')
+        upsert_courses([api_course('ACCT', '2010', 20762, 'Introductory Accounting I')])
+        upsert_courses([api_course('CS', str(1000 + i), 30000 + i, 'Course ' + str(i % 10)) for i in range(40)])
+
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(reverse('NewLousList:courses_by_subject', args=('ACCT',)))
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',)))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Course 9')
+        self.assertEqual(len(small), len(large))
+
+        # every section links to the cart with its own database id
+        for course in Course.objects.filter(subject='CS'):
+            self.assertContains(response, reverse('NewLousList:cart', args=(course.id,)))
+
+
+class syncCatalogTests(TestCase):
+
+    def test_sync_catalog_creates_and_updates_courses(self):
+        """
+        Check that sync_catalog creates subjects and courses, and updates a section instead of duplicating it
+        """
+        dept_list = [{"subject": "ACCT"}, {"subject": "CS"}]
+        acct = [api_course('ACCT', '2010', 20762, 'Introductory Accounting I'),
+                api_course('ACCT', '2020', 20763, 'Introductory Accounting II')]
+        with mock.patch('NewLousList.management.commands.sync_catalog.fetch_department_list', return_value=dept_list), \
+                mock.patch('NewLousList.management.commands.sync_catalog.fetch_department', return_value=acct):
+            call_command('sync_catalog', 'ACCT', stdout=io.StringIO())
+        self.assertEqual(Subject.objects.filter(subject__in=['ACCT', 'CS']).count(), 2)
+        self.assertEqual(Subject.objects.get(subject='ACCT').name, 'Accounting')
+        self.assertEqual(Course.objects.filter(subject='ACCT').count(), 2)
+        self.assertEqual(Course.objects.get(course_number=20762).meetings[0]['start_time'], '05:00 PM')
+
+        acct[0]['enrollment_available'] = 0
+        with mock.patch('NewLousList.management.commands.sync_catalog.fetch_department_list', return_value=dept_list), \
+                mock.patch('NewLousList.management.commands.sync_catalog.fetch_department', return_value=acct):
+            call_command('sync_catalog', 'ACCT', stdout=io.StringIO())
+        self.assertEqual(Subject.objects.filter(subject='ACCT').count(), 1)
+        self.assertEqual(Course.objects.filter(subject='ACCT').count(), 2)
+        self.assertEqual(Course.objects.get(course_number=20762).enrollment_available, 0)
+
+    def test_delta_sync_only_writes_seat_counts(self):
+        """
+        Check that the enrollment sync skips unchanged sections, bulk updates seat counts and
+        falls back to the full upsert when anything else changes
+        """
+        cs = [api_course('CS', '2150', 1, 'Program and Data Representation'),
+              api_course('CS', '3240', 2, 'Advanced Software Development'),
+              api_course('CS', '4774', 3, 'Machine Learning')]
+        self.assertEqual(sync_enrollment(cs), (3, 0, 0))
+        self.assertEqual(Meeting.objects.count(), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sync_enrollment(cs), (0, 0, 3))
+        self.assertEqual(len(queries), 1)
+
+        cs[0]['enrollment_available'] = 0
+        cs[1]['wait_list'] = 4
+        meeting_ids = set(Meeting.objects.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sync_enrollment(cs), (0, 2, 1))
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(Course.objects.get(course_number=1).enrollment_available, 0)
+        self.assertEqual(Course.objects.get(course_number=2).wait_list, 4)
+        self.assertEqual(set(Meeting.objects.values_list('id', flat=True)), meeting_ids)
+
+        cs[2]['meetings'] = [{"days": "TuTh", "start_time": "09.30.00.000000-05:00",
+                              "end_time": "10.45.00.000000-05:00", "facility_description": "Rice 130"}]
+        self.assertEqual(sync_enrollment(cs), (1, 0, 2))
+        self.assertEqual(Meeting.objects.get(course__course_number=3).day_string(), 'TuTh')
+
+        out = io.StringIO()
+        with mock.patch('NewLousList.management.commands.sync_catalog.fetch_department_list', return_value=[{"subject": "CS"}]), \
+                mock.patch('NewLousList.management.commands.sync_catalog.fetch_department', return_value=cs):
+            call_command('sync_catalog', 'CS', '--delta', stdout=out)
+        self.assertIn('CS: 0 upserted, 0 seat changes, 3 unchanged', out.getvalue())
+
+    def test_normalize_meetings_is_idempotent(self):
+        """
+        Check that meeting times already in "HH:MM XM" form are not converted again
+        """
+        meetings = [{"days": "TuTh", "start_time": "14.00.00.000000-05:00", "end_time": "15.15.00.000000-05:00"}]
+        normalize_meetings(meetings)
+        self.assertEqual(meetings[0]['start_time'], '02:00 PM')
+        normalize_meetings(meetings)
+        self.assertEqual(meetings[0]['start_time'], '02:00 PM')
+        self.assertEqual(meetings[0]['end_time'], '03:15 PM')
+
+
+class EnrollmentHistoryTests(TestCase):
+    def test_snapshots_are_taken_on_change(self):
+        """
+        Check that syncs record a snapshot per section only when its open seats or wait list move
+        """
+        cs = [api_course('CS', '2150', 1, 'Program and Data Representation'),
+              api_course('CS', '3240', 2, 'Advanced Software Development')]
+        sync_enrollment(cs)
+        sync_enrollment(cs)
+        self.assertEqual(EnrollmentSnapshot.objects.count(), 2)
+
+        cs[0]['enrollment_available'] = 3
+        cs[1]['enrollment_total'] = 41
+        sync_enrollment(cs)
+        cs[0]['enrollment_available'] = 0
+        cs[0]['wait_list'] = 2
+        sync_enrollment(cs, full=True)
+        course = Course.objects.get(course_number=1)
+        self.assertEqual([(available, wait_list) for taken_at, available, wait_list in seat_curve(course)],
+                         [(10, 0), (3, 0), (0, 2)])
+        self.assertEqual(EnrollmentSnapshot.objects.filter(course__course_number=2).count(), 1)
+
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        response = self.client.get(reverse('NewLousList:seat_history', args=(course.id,)))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['class_capacity'], 50)
+        self.assertEqual([point['available'] for point in data['points']], [10, 3, 0])
+
+        EnrollmentSnapshot.objects.filter(course=course, available=10).update(taken_at=timezone.now() - timedelta(days=3))
+        response = self.client.get(reverse('NewLousList:seat_history', args=(course.id,)) + '?days=1')
+        self.assertEqual([point['available'] for point in response.json()['points']], [3, 0])
+        self.assertEqual(self.client.get(reverse('NewLousList:seat_history', args=(course.id,)) + '?days=x').status_code, 400)
+        # windows past timedelta's range are cut down to a year
+        for days in ('inf', '1e10'):
+            response = self.client.get(reverse('NewLousList:seat_history', args=(course.id,)) + '?days=' + days)
+            self.assertEqual([point['available'] for point in response.json()['points']], [10, 3, 0])
+        self.assertEqual(self.client.get(reverse('NewLousList:seat_history', args=(course.id,)) + '?days=nan').status_code, 400)
+        self.assertEqual(self.client.get(reverse('NewLousList:seat_history', args=(9999,))).status_code, 404)
+
+    def test_history_is_downsampled_and_expired(self):
+        """
+        Check that the retention command keeps the last snapshot per hour for old history and
+        drops history past the retention window
+        """
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation')])
+        course = Course.objects.get()
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=30)
+        times = [start + timedelta(minutes=m) for m in (0, 10, 50, 70, 130)]
+        times += [timezone.now() - timedelta(days=400), timezone.now() - timedelta(minutes=5), timezone.now() - timedelta(minutes=1)]
+        EnrollmentSnapshot.objects.bulk_create([EnrollmentSnapshot(course=course, taken_at=t, available=i, wait_list=0)
+                                                for i, t in enumerate(times)])
+        out = io.StringIO()
+        call_command('prune_enrollment_history', stdout=out)
+        self.assertIn('deleted 1 expired and 2 downsampled snapshots', out.getvalue())
+        self.assertEqual([available for taken_at, available, wait_list in seat_curve(course)], [2, 3, 4, 6, 7])
+
+
+class SeatWatchTests(TestCase):
+    def test_watchers_are_emailed_when_seats_open(self):
+        """
+        Check that a sync emails each full section's watchers once, grouped by section, when seats open
+        """
+        cs = [api_course('CS', '2150', 1, 'Program and Data Representation', enrollment_available=0),
+              api_course('CS', '3240', 2, 'Advanced Software Development', enrollment_available=0),
+              api_course('CS', '4774', 3, 'Machine Learning', enrollment_available=0)]
+        sync_enrollment(cs)
+        users = [User.objects.create_user(username='user%d' % i, password='pass', email='user%d@virginia.edu' % i) for i in range(3)]
+        users.append(User.objects.create_user(username='noemail', password='pass'))
+        for user in users:
+            SeatWatch.objects.create(user=user, course=Course.objects.get(course_number=1))
+        SeatWatch.objects.create(user=users[0], course=Course.objects.get(course_number=2))
+        SeatWatch.objects.create(user=users[1], course=Course.objects.get(course_number=3))
+
+        cs[0]['enrollment_available'] = 2
+        cs[1]['enrollment_available'] = 1
+        cs[2]['wait_list'] = 3
+        with CaptureQueriesContext(connection) as queries:
+            sync_enrollment(cs)
+        self.assertEqual(len([q for q in queries if 'NewLousList_seatwatch' in q['sql'] and q['sql'].startswith('SELECT')]), 1)
+        self.assertEqual(len(mail.outbox), 2)
+        by_subject = {message.subject: message for message in mail.outbox}
+        self.assertEqual(sorted(by_subject['Seats open in CS 2150-001'].bcc), ['user0@virginia.edu', 'user1@virginia.edu', 'user2@virginia.edu'])
+        self.assertEqual(by_subject['Seats open in CS 3240-001'].bcc, ['user0@virginia.edu'])
+        self.assertIn('2 open seat(s)', by_subject['Seats open in CS 2150-001'].body)
+        # only watchers who were actually emailed are stamped, not the one without an address
+        self.assertEqual(SeatWatch.objects.filter(last_notified_at__isnull=False).count(), 4)
+
+        # seats staying open is not another opening
+        cs[0]['enrollment_available'] = 1
+        sync_enrollment(cs)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_emails_are_retried(self):
+        """
+        Check that watchers whose email didn't go out aren't stamped and get it when run_worker retries
+        """
+        cs = [api_course('CS', '2150', 1, 'Program and Data Representation', enrollment_available=0),
+              api_course('CS', '3240', 2, 'Advanced Software Development', enrollment_available=0)]
+        sync_enrollment(cs)
+        user = User.objects.create_user(username='testUser', password='pass', email='test@virginia.edu')
+        for course in Course.objects.all():
+            SeatWatch.objects.create(user=user, course=course)
+
+        locmem_send = mail.backends.locmem.EmailBackend.send_messages
+
+        def send_but_not_2150(backend, messages):
+            if '2150' in messages[0].subject:
+                return 0
+            return locmem_send(backend, messages)
+
+        cs[0]['enrollment_available'] = 2
+        cs[1]['enrollment_available'] = 1
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_but_not_2150), \
+                self.assertLogs('NewLousList.notifications', 'WARNING'):
+            sync_enrollment(cs)
+        self.assertEqual([message.subject for message in mail.outbox], ['Seats open in CS 3240-001'])
+        self.assertEqual(list(SeatWatch.objects.filter(last_notified_at__isnull=False).values_list('course__course_number', flat=True)), [2])
+        job = Job.objects.get(kind='notify_seats')
+
+        # the retry only emails the watcher that was missed
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        call_command('run_worker', '--once', stdout=io.StringIO())
+        self.assertEqual([message.subject for message in mail.outbox], ['Seats open in CS 3240-001', 'Seats open in CS 2150-001'])
+        self.assertEqual(SeatWatch.objects.filter(last_notified_at__isnull=True).count(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_watch_button_toggles(self):
+        """
+        Check that a student can start and stop watching a full section from the subject page
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        Subject.objects.create(subject='CS')
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation', enrollment_available=0)])
+        course = Course.objects.get()
+        response = self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',)))
+        self.assertContains(response, 'Email me when seats open')
+
+        response = self.client.post(reverse('NewLousList:watch_course', args=(course.id,)))
+        self.assertRedirects(response, reverse('NewLousList:courses_by_subject', args=('CS',)))
+        self.assertTrue(SeatWatch.objects.filter(user=user, course=course).exists())
+        self.assertContains(self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',))), 'Stop watching seats')
+
+        self.client.post(reverse('NewLousList:watch_course', args=(course.id,)))
+        self.assertFalse(SeatWatch.objects.exists())
+
+
+def upstream_response(data, status_code=200, headers=None):
+    """
+    Global function that fakes a luthers-list or vagrades response
+    """
+    response = mock.Mock(status_code=status_code, headers=headers or {})
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+class UpstreamTests(TestCase):
+    def setUp(self):
+        upstream.reset_stats()
+
+    def test_session_is_pooled_with_retries(self):
+        """
+        Check that the shared session retries gateway errors with backoff
+        """
+        adapter = upstream.session.get_adapter('https://vagrades.com/')
+        self.assertIs(adapter, upstream.session.get_adapter('http://luthers-list.herokuapp.com/'))
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertGreater(adapter.max_retries.backoff_factor, 0)
+
+    def test_get_sets_timeout_and_counts_calls(self):
+        """
+        Check that every call gets a timeout and is counted per host, errors included
+        """
+        ok = mock.Mock(status_code=200)
+        down = mock.Mock(status_code=503)
+        with mock.patch.object(upstream.session, 'get', side_effect=[ok, down, requests.ConnectTimeout]) as get:
+            upstream.get('http://luthers-list.herokuapp.com/api/deptlist?format=json')
+            upstream.get('https://vagrades.com/api/uva/course/CS2150')
+            with self.assertRaises(requests.ConnectTimeout):
+                upstream.get('https://vagrades.com/api/uva/course/CS3240')
+        self.assertEqual(get.call_args.kwargs['timeout'], upstream.TIMEOUT)
+        stats = upstream.upstream_stats()
+        self.assertEqual(stats['luthers-list.herokuapp.com']['requests'], 1)
+        self.assertEqual(stats['luthers-list.herokuapp.com']['errors'], 0)
+        self.assertEqual(stats['vagrades.com']['requests'], 2)
+        self.assertEqual(stats['vagrades.com']['errors'], 2)
+
+        # only staff can see the counters
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        self.assertEqual(self.client.get(reverse('NewLousList:upstream_status')).status_code, 302)
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('NewLousList:upstream_status'))
+        self.assertEqual(response.json()['vagrades.com']['errors'], 2)
+
+    def test_concurrent_department_fetches_are_coalesced(self):
+        """
+        Check that threads asking for the same department at once share one upstream call
+        """
+        cache.clear()
+        release = threading.Event()
+
+        def slow_get(url, **kwargs):
+            release.wait(5)
+            return upstream_response([api_course('CS', '2150', 1, 'Program and Data Representation')])
+
+        results = []
+        with mock.patch('NewLousList.upstream.get', side_effect=slow_get) as get:
+            threads = [threading.Thread(target=lambda: results.append(fetch_department('CS'))) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual([len(result) for result in results], [1] * 8)
+
+    def test_workers_wait_on_the_cache_lock(self):
+        """
+        Check that a fetch waits for another worker holding the department's lock and uses its result
+        """
+        cache.clear()
+        cache.add('upstream-lock:dept:CS', 1, 20)
+
+        def other_worker():
+            time.sleep(0.2)
+            cache.set('upstream-result:dept:CS', {'data': ['from the other worker']}, 5)
+            cache.delete('upstream-lock:dept:CS')
+
+        thread = threading.Thread(target=other_worker)
+        with mock.patch('NewLousList.upstream.get') as get:
+            thread.start()
+            self.assertEqual(fetch_department('CS'), ['from the other worker'])
+            thread.join()
+        get.assert_not_called()
+
+        # if the lock holder gives up without a result, the waiter fetches for itself
+        cache.clear()
+        cache.add('upstream-lock:dept:CS', 1, 20)
+        thread = threading.Thread(target=lambda: (time.sleep(0.2), cache.delete('upstream-lock:dept:CS')))
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response(['fetched'])) as get:
+            thread.start()
+            self.assertEqual(fetch_department('CS'), ['fetched'])
+            thread.join()
+        self.assertEqual(get.call_count, 1)
+
+    def test_slow_fetch_keeps_the_next_holders_lock(self):
+        """
+        Check that a fetch that outlives its lock doesn't release the lock another worker took after it expired
+        """
+        cache.clear()
+
+        def slow_fetch():
+            # our lock times out mid-fetch and another worker takes it
+            cache.delete('upstream-lock:dept:CS')
+            cache.add('upstream-lock:dept:CS', 'other worker', 20)
+            return 'result'
+
+        self.assertEqual(upstream.shared_fetch('dept:CS', slow_fetch), 'result')
+        self.assertEqual(cache.get('upstream-lock:dept:CS'), 'other worker')
+        # an ordinary fetch releases its own lock
+        cache.clear()
+        upstream.shared_fetch('dept:CS', lambda: 'result')
+        self.assertIsNone(cache.get('upstream-lock:dept:CS'))
+
+    def test_department_payloads_are_served_stale_while_revalidating(self):
+        """
+        Check that a cached department is served at once, refreshed once in the background with
+        its ETag, and kept through upstream errors
+        """
+        cache.clear()
+        first = [api_course('CS', '2150', 1, 'Program and Data Representation')]
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response(first, headers={'ETag': '"v1"'})) as get:
+            self.assertEqual(fetch_department('CS'), first)
+            self.assertEqual(fetch_department('CS'), first)
+        self.assertEqual(get.call_count, 1)
+
+        # once stale, the cached copy is still returned and one sync job is queued, which
+        # revalidates with the ETag
+        entry = cache.get('upstream-payload:dept:CS')
+        entry['fetched_at'] -= upstream.FRESH_SECONDS + 1
+        cache.set('upstream-payload:dept:CS', entry)
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response(None, status_code=304)) as get:
+            self.assertEqual(fetch_department('CS'), first)
+            self.assertEqual(fetch_department('CS'), first)
+            self.assertEqual(Job.objects.filter(kind='sync_department', args={'subject': 'CS'}).count(), 1)
+            get.assert_not_called()
+            self.assertEqual(run_pending(HANDLERS), 1)
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertLess(time.time() - cache.get('upstream-payload:dept:CS')['fetched_at'], 5)
+        self.assertTrue(Course.objects.filter(course_number=1).exists())
+
+        # without a job to queue, the refresh runs in a thread
+        refreshes = []
+        cache.clear()
+        cache.set('upstream-payload:deptlist', dict(entry, data=[]))
+        with mock.patch('NewLousList.upstream.refresh_in_background', side_effect=refreshes.append):
+            self.assertEqual(upstream.cached_json('deptlist', 'http://luthers-list.herokuapp.com/api/deptlist'), [])
+        self.assertEqual(len(refreshes), 1)
+
+        # callers that need it current revalidate now, and fall back to the cache if upstream is down
+        second = first + [api_course('CS', '3240', 2, 'Advanced Software Development')]
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response(second, headers={'ETag': '"v2"'})):
+            self.assertEqual(fetch_department('CS', max_age=0), second)
+        with mock.patch('NewLousList.upstream.get', side_effect=requests.ConnectionError):
+            self.assertEqual(fetch_department('CS', max_age=0), second)
+            with self.assertRaises(requests.ConnectionError):
+                fetch_department('MATH')
+
+
 class singleCourseViewTests(TestCase):
 
     def test_single_course_subject(self):
@@ -243,6 +758,361 @@ class singleCourseViewTests(TestCase):
         self.assertTemplateUsed(response, 'NewLousList/single_course.html')
 
 
+class CourseGradeTests(TestCase):
+    def vagrades(self, avg=None, status_code=200):
+        """
+        A fake vagrades response
+        """
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = {"course": {"avg": avg}}
+        if status_code >= 500:
+            response.raise_for_status.side_effect = requests.HTTPError('vagrades is down')
+        return response
+
+    def test_letter_grades(self):
+        """
+        Check the table driven letter conversion against the old cutoffs
+        """
+        self.assertEqual(letter_grade(4.0), 'A')
+        self.assertEqual(letter_grade(3.7), 'A-')
+        self.assertEqual(letter_grade(3.31), 'A-')
+        self.assertEqual(letter_grade(2.5), 'B-')
+        self.assertEqual(letter_grade(0.31), 'D-')
+        self.assertEqual(letter_grade(0.3), 'F')
+
+    def test_grades_are_cached(self):
+        """
+        Check that averages and misses are stored by refresh_grade, served by acached_grade until
+        they expire (queueing a refresh instead of calling vagrades), and kept through outages
+        """
+        cached_grade = async_to_sync(acached_grade)
+        refreshes = Job.objects.filter(kind='refresh_grade')
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(3.456)) as get:
+            self.assertIsNone(cached_grade('CS', '2150'))
+            self.assertEqual(list(refreshes.values_list('key', flat=True)), ['refresh_grade:CS:2150'])
+            refresh_grade('CS', '2150')
+            refreshes.delete()
+            self.assertEqual(gpa_label(cached_grade('CS', '2150')), '3.46 (A-)')
+            self.assertEqual(gpa_label(cached_grade('CS', '2150')), '3.46 (A-)')
+        self.assertEqual(get.call_count, 1)
+        self.assertFalse(refreshes.exists())
+
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(status_code=404)) as get:
+            refresh_grade('CS', '9999')
+            self.assertEqual(gpa_label(cached_grade('CS', '9999')), '0 (GPA NOT FOUND)')
+        self.assertEqual(get.call_count, 1)
+        self.assertIsNone(CourseGrade.objects.get(catalog_number='9999').gpa)
+        self.assertFalse(refreshes.exists())
+
+        # once stale, the old value is still served while a refresh is queued, and kept if vagrades is down
+        CourseGrade.objects.update(fetched_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(gpa_label(cached_grade('CS', '2150')), '3.46 (A-)')
+        self.assertEqual(list(refreshes.values_list('key', flat=True)), ['refresh_grade:CS:2150'])
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(status_code=503)):
+            self.assertRaises(requests.HTTPError, refresh_grade, 'CS', '2150')
+        with mock.patch('NewLousList.upstream.get', side_effect=requests.ConnectionError):
+            self.assertRaises(requests.ConnectionError, refresh_grade, 'CS', '2150')
+        self.assertEqual(gpa_label(cached_grade('CS', '2150')), '3.46 (A-)')
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(2.9)):
+            refresh_grade('CS', '2150')
+        self.assertEqual(gpa_label(cached_grade('CS', '2150')), '2.9 (B)')
+
+    def test_prefetch_command(self):
+        """
+        Check that prefetch_grades fills the cache for a subject and skips fresh rows
+        """
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation'),
+                        api_course('CS', '2150', 2, 'Program and Data Representation', course_section='002'),
+                        api_course('CS', '3240', 3, 'Advanced Software Development'),
+                        api_course('MATH', '1310', 4, 'Calculus I')])
+        CourseGrade.objects.create(subject='CS', catalog_number='3240', gpa=3.5, fetched_at=timezone.now())
+        out = io.StringIO()
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(3.1)) as get:
+            call_command('prefetch_grades', 'CS', stdout=out)
+        get.assert_called_once_with('https://vagrades.com/api/uva/course/CS2150')
+        self.assertIn('CS: 1 fetched, 0 failed', out.getvalue())
+        self.assertEqual(CourseGrade.objects.get(catalog_number='2150').gpa, 3.1)
+        self.assertEqual(CourseGrade.objects.get(catalog_number='3240').gpa, 3.5)
+
+        with mock.patch('NewLousList.upstream.get', return_value=self.vagrades(status_code=500)) as get:
+            call_command('prefetch_grades', stdout=out)
+        self.assertIn('MATH: 0 fetched, 1 failed', out.getvalue())
+        self.assertFalse(CourseGrade.objects.filter(subject='MATH').exists())
+
+
+
+class asyncSingleCourseTests(TestCase):
+    def test_course_page_lookups_run_concurrently(self):
+        """
+        Check that the course page reads the gpa and the reviews at the same time, renders the
+        synced section without asking luthers-list, and queues the gpa lookup for the worker
+        instead of waiting on vagrades
+        """
+        cache.clear()
+        Subject.objects.create(subject='CS', synced_at=timezone.now())
+        cs = [api_course('CS', '2150', 1, 'Program and Data Representation')]
+        upsert_courses(cs)
+        Review.objects.create(subject='CS', course_number='2150', review_text='Great Course!')
+
+        # each lookup waits until the other has started, which only happens if they overlap
+        started = []
+        both_started = asyncio.Event()
+
+        def overlapping(lookup):
+            async def wrapper(*args):
+                started.append(lookup.__name__)
+                if len(started) == 2:
+                    both_started.set()
+                await asyncio.wait_for(both_started.wait(), 5)
+                return await lookup(*args)
+            return wrapper
+
+        with mock.patch('NewLousList.upstream.get') as get, \
+                mock.patch('NewLousList.views.acached_grade', overlapping(acached_grade)), \
+                mock.patch('NewLousList.views.akeyset_page', overlapping(akeyset_page)):
+            response = self.client.get('/NewLousList/subject/CS/1/')
+        self.assertCountEqual(started, ['acached_grade', 'akeyset_page'])
+        self.assertEqual(get.call_count, 0)
+        self.assertContains(response, 'Program and Data Representation')
+        self.assertContains(response, 'GPA NOT FOUND')
+        self.assertContains(response, 'Great Course!')
+        self.assertContains(response, 'Reviews (1)')
+
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response({"course": {"avg": 3.2}})) as get:
+            call_command('run_worker', '--once', stdout=io.StringIO())
+            self.assertEqual(get.call_count, 1)
+            response = self.client.get('/NewLousList/subject/CS/1/')
+            self.assertEqual(get.call_count, 1)
+        self.assertContains(response, '3.2 (B+)')
+
+    def test_course_page_queues_a_sync_for_old_seat_counts(self):
+        """
+        Check that the course page renders the stored section either way, and queues a department
+        sync when its last sync is older than the api cache's max age
+        """
+        cache.clear()
+        cs = Subject.objects.create(subject='CS', synced_at=timezone.now())
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation')])
+        syncs = Job.objects.filter(kind='sync_department')
+        with mock.patch('NewLousList.upstream.get') as get:
+            self.assertContains(self.client.get('/NewLousList/subject/CS/1/'), '10 Open Seats')
+            self.assertFalse(syncs.exists())
+            Subject.objects.filter(id=cs.id).update(synced_at=timezone.now() - timedelta(minutes=10))
+            self.assertContains(self.client.get('/NewLousList/subject/CS/1/'), '10 Open Seats')
+        get.assert_not_called()
+        self.assertEqual(list(syncs.values_list('key', flat=True)), ['sync_department:CS'])
+
+    def test_course_page_during_an_outage(self):
+        """
+        Check that a synced course still renders with luthers-list down and nothing cached,
+        and that an unsynced one is looked up in the api
+        """
+        cache.clear()
+        Subject.objects.create(subject='CS')
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation')])
+        with mock.patch('NewLousList.upstream.get', side_effect=requests.ConnectionError('down')):
+            response = self.client.get('/NewLousList/subject/CS/1/')
+        self.assertContains(response, 'Program and Data Representation')
+        self.assertContains(response, '05:00 PM')
+
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response([api_course('CS', '2100', 2, 'Data Structures')])):
+            self.assertContains(self.client.get('/NewLousList/subject/CS/2/'), 'Data Structures')
+
+    def test_course_number_is_looked_up_within_the_subject(self):
+        """
+        Check that the page picks the subject's section, from the latest semester, when other
+        subjects or semesters reuse the course number
+        """
+        cache.clear()
+        Subject.objects.create(subject='CS')
+        Subject.objects.create(subject='MATH')
+        upsert_courses([
+            api_course('MATH', '1310', 1, 'Calculus I'),
+            api_course('CS', '2150', 1, 'Old Program and Data Representation', semester_code=1222),
+            api_course('CS', '2150', 1, 'Program and Data Representation', semester_code=1232),
+        ])
+        with mock.patch('NewLousList.upstream.get') as get:
+            self.assertContains(self.client.get('/NewLousList/subject/MATH/1/'), 'Calculus I')
+            response = self.client.get('/NewLousList/subject/CS/1/')
+        self.assertEqual(get.call_count, 0)
+        self.assertContains(response, 'Program and Data Representation')
+        self.assertNotContains(response, 'Old Program')
+        self.assertNotContains(response, 'Calculus')
+
+    def test_unknown_course(self):
+        """
+        Check that a course that is in neither the database nor the api is a 404
+        """
+        cache.clear()
+        Subject.objects.create(subject='CS')
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response([])):
+            self.assertEqual(self.client.get('/NewLousList/subject/CS/1/').status_code, 404)
+        self.assertEqual(self.client.get('/NewLousList/subject/XX/1/').status_code, 404)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_enqueue_dedupes_pending_jobs(self):
+        """
+        Check that queueing the same work twice leaves one waiting job, and that it can be
+        queued again once that job has run
+        """
+        first = enqueue('sync_department', 'sync_department:CS', {'subject': 'CS'})
+        self.assertEqual(enqueue('sync_department', 'sync_department:CS', {'subject': 'CS'}), first)
+        self.assertEqual(Job.objects.count(), 1)
+        Job.objects.filter(id=first.id).update(status=Job.DONE)
+        self.assertNotEqual(enqueue('sync_department', 'sync_department:CS', {'subject': 'CS'}), first)
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+
+    def test_run_pending_records_status_and_duration(self):
+        """
+        Check that due jobs run with their args and are marked done with a duration, and jobs
+        queued for later are left alone
+        """
+        calls = []
+        enqueue('echo', 'echo:1', {'value': 1})
+        later = enqueue('echo', 'echo:2', {'value': 2}, delay=60)
+        self.assertEqual(run_pending({'echo': lambda value: calls.append(value)}), 1)
+        self.assertEqual(calls, [1])
+        job = Job.objects.get(key='echo:1')
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.duration)
+        self.assertIsNotNone(job.finished_at)
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.PENDING)
+
+    def test_worker_queues_periodic_jobs(self):
+        """
+        Check that run_worker queues the friend suggestions when they are due, and not again until a day later
+        """
+        user = User.objects.create_user(username='testUser', password='pass')
+        friend = User.objects.create_user(username='friend', password='pass')
+        other = User.objects.create_user(username='other', password='pass')
+        Friendship.befriend(user, friend)
+        Friendship.befriend(friend, other)
+        call_command('run_worker', '--once', stdout=io.StringIO())
+        job = Job.objects.get(kind='suggest_friends')
+        self.assertEqual(job.status, Job.DONE)
+        self.assertTrue(FriendSuggestion.objects.filter(user=user, suggested=other).exists())
+
+        self.assertEqual(queue_periodic(), 0)
+        Job.objects.filter(id=job.id).update(finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(queue_periodic(), 1)
+        self.assertEqual(Job.objects.filter(kind='suggest_friends', status=Job.PENDING).count(), 1)
+
+    def test_stale_departments_are_queued_for_a_sync(self):
+        """
+        Check that the subject page queues a sync once the department's last sync is old, that the
+        periodic sweep queues the ones nobody looked at, and that a sync marks the department fresh
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        cs = Subject.objects.create(subject='CS', synced_at=timezone.now())
+        Subject.objects.create(subject='MATH', synced_at=timezone.now() - timedelta(hours=1))
+        Subject.objects.create(subject='APMA')
+        upsert_courses([api_course('CS', '2150', 1, 'Program and Data Representation')])
+
+        self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',)))
+        syncs = Job.objects.filter(kind='sync_department')
+        self.assertFalse(syncs.exists())
+
+        Subject.objects.filter(id=cs.id).update(synced_at=timezone.now() - timedelta(minutes=10))
+        self.client.get(reverse('NewLousList:courses_by_subject', args=('CS',)))
+        self.assertEqual(list(syncs.values_list('key', flat=True)), ['sync_department:CS'])
+
+        # the sweep leaves CS to the page's sync, it was synced within the half hour
+        syncs.delete()
+        self.assertEqual(queue_stale_department_syncs(), 2)
+        self.assertEqual(sorted(syncs.values_list('key', flat=True)), ['sync_department:APMA', 'sync_department:MATH'])
+
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response([])):
+            HANDLERS['sync_department']('MATH')
+        self.assertGreater(Subject.objects.get(subject='MATH').synced_at, timezone.now() - timedelta(minutes=1))
+
+    def test_failed_jobs_back_off_then_fail(self):
+        """
+        Check that a failing job is retried later with a growing delay and marked failed
+        after max_attempts
+        """
+        def fail():
+            raise requests.ConnectionError('down')
+
+        job = enqueue('fail', 'fail', max_attempts=2)
+        before = timezone.now()
+        self.assertEqual(run_pending({'fail': fail}), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=30))
+        self.assertIn('ConnectionError', job.last_error)
+        # not due yet
+        self.assertEqual(run_pending({'fail': fail}), 0)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        self.assertEqual(run_pending({'fail': fail}), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_running_jobs_are_requeued(self):
+        """
+        Check that a job left running by a worker that died is picked up again
+        """
+        calls = []
+        job = enqueue('echo', 'echo', {'value': 1})
+        Job.objects.filter(id=job.id).update(status=Job.RUNNING, started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(run_pending({'echo': lambda value: calls.append(value)}), 1)
+        self.assertEqual(calls, [1])
+
+    def test_stale_job_with_the_same_work_queued_again(self):
+        """
+        Check that a stuck job whose key was queued again is retired instead of breaking the
+        one-waiting-job constraint, and that a job out of attempts is not requeued
+        """
+        calls = []
+        job = enqueue('echo', 'echo', {'value': 1})
+        Job.objects.filter(id=job.id).update(status=Job.RUNNING, attempts=1, started_at=timezone.now() - timedelta(hours=1))
+        again = enqueue('echo', 'echo', {'value': 2})
+        self.assertEqual(run_pending({'echo': lambda value: calls.append(value)}), 1)
+        self.assertEqual(calls, [2])
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.FAILED)
+        self.assertEqual(Job.objects.get(id=again.id).status, Job.DONE)
+
+        worn_out = enqueue('echo', 'echo:3', {'value': 3}, max_attempts=2)
+        Job.objects.filter(id=worn_out.id).update(status=Job.RUNNING, attempts=2, started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(run_pending({'echo': lambda value: calls.append(value)}), 0)
+        self.assertEqual(Job.objects.get(id=worn_out.id).status, Job.FAILED)
+
+    def test_run_worker_command(self):
+        """
+        Check that run_worker --once runs the queued syncs
+        """
+        enqueue('sync_subjects', 'sync_subjects')
+        out = io.StringIO()
+        # only the queued sync, not the periodic jobs (see test_worker_queues_periodic_jobs)
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response([{"subject": "CS"}])), \
+                mock.patch.dict('NewLousList.jobs.PERIODIC', clear=True):
+            call_command('run_worker', '--once', stdout=out)
+        self.assertIn('ran 1 jobs', out.getvalue())
+        self.assertTrue(Subject.objects.filter(subject='CS').exists())
+
+    def test_pages_queue_syncs_for_missing_data(self):
+        """
+        Check that the home page and a subject page with nothing to show queue syncs instead
+        of waiting on the api
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        with mock.patch('NewLousList.upstream.get', return_value=upstream_response([])):
+            self.client.get('/NewLousList/')
+            Subject.objects.create(subject='CS')
+            self.client.get('/NewLousList/subject/CS/')
+        self.assertTrue(Job.objects.filter(key='sync_subjects', status=Job.PENDING).exists())
+        self.assertTrue(Job.objects.filter(key='sync_department:CS', status=Job.PENDING).exists())
+
 
 class courseSearchPageTests(TestCase):
     def test_class_search_page(self):
@@ -348,6 +1218,148 @@ class courseSearchPageTests(TestCase):
 
 
 
+    def test_class_search_by_day_and_time(self):
+        """
+        Check that the day and time filters use each course's meetings
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        CS_subject = Subject.objects.create(subject='CS')
+        upsert_courses([
+            api_course('CS', '1010', 1, 'Morning Class', meetings=[
+                {"days": "TuTh", "start_time": "09.30.00.000000-05:00", "end_time": "10.45.00.000000-05:00", "facility_description": "Rice 130"}]),
+            api_course('CS', '2020', 2, 'Afternoon Class', meetings=[
+                {"days": "TuTh", "start_time": "14.00.00.000000-05:00", "end_time": "15.15.00.000000-05:00", "facility_description": "Rice 130"}]),
+            api_course('CS', '3030', 3, 'Monday Class', meetings=[
+                {"days": "MoWe", "start_time": "15.30.00.000000-05:00", "end_time": "16.45.00.000000-05:00", "facility_description": "Rice 130"}]),
+        ])
+        self.assertEqual(Meeting.objects.count(), 3)
+
+        response = self.client.get('/NewLousList/search/CS/?day=Tu&start_time=14:00&submit=Search')
+        self.assertContains(response, 'CS 2020')
+        self.assertNotContains(response, 'CS 1010')
+        self.assertNotContains(response, 'CS 3030')
+
+        response = self.client.get('/NewLousList/search/CS/?end_time=11:00&submit=Search')
+        self.assertContains(response, 'CS 1010')
+        self.assertNotContains(response, 'CS 2020')
+
+        response = self.client.get('/NewLousList/search/CS/?day=MoWe&submit=Search')
+        self.assertContains(response, 'CS 3030')
+        self.assertNotContains(response, 'CS 2020')
+
+    def test_keyword_search_is_ranked_and_kept_in_sync(self):
+        """
+        Check that keyword search uses the full-text index, ranks results and follows course updates
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        CS_subject = Subject.objects.create(subject='CS')
+        upsert_courses([
+            api_course('CS', '4710', 1, 'Artificial Intelligence', topic='Machine Learning'),
+            api_course('CS', '4774', 2, 'Machine Learning', topic='Machine Learning Theory'),
+            api_course('CS', '2100', 3, 'Data Structures'),
+        ])
+        results = list(search(Course.objects.all(), 'machine learn'))
+        self.assertEqual([c.catalog_number for c in results], ['4774', '4710'])
+
+        response = self.client.get('/NewLousList/search/CS/?q=machine&submit=Search')
+        self.assertContains(response, 'CS 4774')
+        self.assertNotContains(response, 'CS 2100')
+
+        # updates and deletes reach the index without a rebuild
+        upsert_courses([api_course('CS', '2100', 3, 'Data Structures and Machine Learning')])
+        self.assertEqual(search(Course.objects.all(), 'machine').count(), 3)
+        Course.objects.filter(course_number=1).delete()
+        self.assertEqual(search(Course.objects.all(), 'machine').count(), 2)
+        self.assertEqual(search(Course.objects.all(), 'Testing Teach').count(), 2)
+
+    def test_meeting_parsing(self):
+        """
+        Check that meeting times and days are converted to minutes and a day bitmask
+        """
+        self.assertEqual(parse_time('09:30 AM'), 570)
+        self.assertEqual(parse_time('12:15 PM'), 735)
+        self.assertEqual(parse_time('17.00.00.000000-05:00'), 1020)
+        self.assertEqual(parse_time('14:00'), 840)
+        self.assertEqual(parse_time(''), None)
+        self.assertEqual(day_mask('MoWeFr'), 1 | 4 | 16)
+        self.assertEqual(day_mask('TuTh'), 2 | 8)
+        self.assertEqual(day_mask('TBA'), 0)
+
+    def global_search_pages(self, url):
+        """
+        Follows the next page links of the global search from url and returns the pages
+        """
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([c.course_number for c in response.context['results']])
+            next_query = response.context['next_query']
+            url = '/NewLousList/search/?' + next_query if next_query else None
+        return pages
+
+    def test_global_search_pages_across_departments(self):
+        """
+        Check that the global search walks every department in order with keyset pages
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([api_course(subject, str(1000 + i), n, 'Course %d' % n)
+                        for n, (subject, i) in enumerate([(s, i) for s in ('APMA', 'CS', 'MATH') for i in range(4)], 1)])
+
+        pages = self.global_search_pages('/NewLousList/search/?size=5')
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), list(range(1, 13)))
+
+        response = self.client.get('/NewLousList/search/?size=5')
+        self.assertContains(response, 'Next page')
+        self.assertContains(response, 'APMA 1000')
+        self.assertNotContains(response, 'CS 1001')
+
+        # the page size is capped and bad values fall back to the default
+        response = self.client.get('/NewLousList/search/?size=100000')
+        self.assertEqual(len(response.context['results']), 12)
+        response = self.client.get('/NewLousList/search/?size=lots')
+        self.assertEqual(len(response.context['results']), 12)
+
+        # a cursor with the right shape but the wrong values is treated as the first page
+        for values in (['x', 'y'], ['x', 'y', 'z'], [[1], {}, 'z'], None, ['A', '1', float('inf')], ['A', '1', 10 ** 30],
+                       [float('inf'), 1], [float('nan'), 10 ** 30]):
+            response = self.client.get('/NewLousList/search/?q=course&size=5&after=' + encode_cursor(values))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['results'][0].course_number, 1)
+            response = self.client.get('/NewLousList/search/?size=5&after=' + encode_cursor(values))
+            self.assertEqual([c.course_number for c in response.context['results']], [1, 2, 3, 4, 5])
+
+    def test_global_search_filters_and_keywords(self):
+        """
+        Check the global search filters and that keyword results page in rank order
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([
+            api_course('CS', '4774', 1, 'Machine Learning', topic='Machine Learning Theory'),
+            api_course('CS', '4710', 2, 'Artificial Intelligence', topic='Machine Learning'),
+            api_course('STAT', '4630', 3, 'Statistical Machine Learning', enrollment_available=0),
+            api_course('CS', '2100', 4, 'Data Structures', component='LAB', units='1', meetings=[
+                {"days": "TuTh", "start_time": "09.30.00.000000-05:00", "end_time": "10.45.00.000000-05:00", "facility_description": "Rice 130"}]),
+        ])
+
+        self.assertEqual(self.global_search_pages('/NewLousList/search/?component=lab'), [[4]])
+        self.assertEqual(self.global_search_pages('/NewLousList/search/?units=1'), [[4]])
+        self.assertEqual(self.global_search_pages('/NewLousList/search/?day=Tu&end_time=11:00'), [[4]])
+        self.assertEqual(self.global_search_pages('/NewLousList/search/?subject=stat'), [[3]])
+        self.assertEqual(self.global_search_pages('/NewLousList/search/?q=machine&open=1'), [[1, 2]])
+
+        ranked = [c.course_number for c in search(Course.objects.all(), 'machine learning')]
+        self.assertEqual(sum(self.global_search_pages('/NewLousList/search/?q=machine+learning&size=1'), []), ranked)
+
+        response = self.client.get('/NewLousList/search/?q=nothing+like+this')
+        self.assertContains(response, 'No search results for this query')
+
+
 class ShoppingCartTests(TestCase):
 
     def test_shopping_cart_url(self):
@@ -650,6 +1662,113 @@ class ShoppingCartTests(TestCase):
         class_list = cart.class_list.all()
         self.assertEqual(class_list.count(), 0)
 
+    def test_conflict_names_existing_meeting(self):
+        """
+        Check that a time conflict reports which course and meeting in the cart it overlaps
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([
+            api_course('CS', '2100', 1, 'Data Structures', meetings=[
+                {"days": "MoWe", "start_time": "09.00.00.000000-05:00", "end_time": "09.50.00.000000-05:00", "facility_description": ""},
+                {"days": "Fr", "start_time": "13.00.00.000000-05:00", "end_time": "14.50.00.000000-05:00", "facility_description": ""}]),
+            api_course('CS', '2150', 2, 'Program and Data Representation', meetings=[
+                {"days": "TuFr", "start_time": "14.00.00.000000-05:00", "end_time": "15.15.00.000000-05:00", "facility_description": ""}]),
+        ])
+        first = Course.objects.get(course_number=1)
+        second = Course.objects.get(course_number=2)
+
+        response = self.client.get(reverse('NewLousList:cart', args=(first.id,)))
+        self.assertContains(response, 'Class added to schedule')
+        response = self.client.get(reverse('NewLousList:cart', args=(second.id,)))
+        self.assertContains(response, 'The class you added has a time conflict with CS 2100 (Fr 01:00 PM - 02:50 PM)')
+
+        cart = ShoppingCart.objects.get(user=user)
+        is_repeat, conflict = cart.add_class(second)
+        self.assertFalse(is_repeat)
+        self.assertEqual(conflict.course, first)
+        self.assertEqual(cart.class_list.count(), 1)
+
+    def test_interval_index(self):
+        """
+        Check the per-day interval index against a 15 section cart
+        """
+        class Slot:
+            def __init__(self, days, start, end):
+                self.days, self.start_min, self.end_min = days, start, end
+        index = IntervalIndex(Slot(day_mask('MoWeFr'), 480 + 60 * i, 530 + 60 * i) for i in range(15))
+        self.assertIsNone(index.conflict(Slot(day_mask('TuTh'), 480, 600)))
+        self.assertIsNone(index.conflict(Slot(day_mask('Mo'), 535, 535)))
+        self.assertEqual(index.conflict(Slot(day_mask('We'), 520, 535)).start_min, 480)
+        self.assertEqual(index.conflict(Slot(day_mask('Fr'), 700, 705)).start_min, 660)
+
+    def test_cart_occupancy_bitmap(self):
+        """
+        Check that the cart's bitmap follows adds, removes and a sync that moves a section, and
+        that a course clear of the cart is added without loading the cart's meetings
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        def meetings(days, start, end):
+            return [{"days": days, "start_time": start + ".00.000000-05:00", "end_time": end + ".00.000000-05:00", "facility_description": ""}]
+        cs = [
+            api_course('CS', '2100', 1, 'Data Structures', meetings=meetings('MoWe', '09.00', '09.50')),
+            api_course('CS', '2150', 2, 'Program and Data Representation', meetings=meetings('TuTh', '09.30', '10.45')),
+            # starts 2 minutes after CS 2100 ends: same 5 minute slot, but no conflict
+            api_course('CS', '3100', 3, 'Algorithms', meetings=meetings('Mo', '09.52', '10.40')),
+            api_course('CS', '3240', 4, 'Software Engineering', meetings=meetings('TuTh', '10.00', '11.15')),
+        ]
+        upsert_courses(cs)
+        first, second, third, fourth = Course.objects.order_by('course_number')
+        self.assertEqual(first.bits(), meeting_bits(day_mask('MoWe'), 540, 590))
+        cart = ShoppingCart.objects.create(user=user)
+
+        self.assertEqual(cart.add_class(first), (False, None))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(cart.add_class(second), (False, None))
+        self.assertFalse(any('meeting' in query['sql'].lower() for query in queries.captured_queries))
+        self.assertEqual(cart.add_class(third), (False, None))
+        self.assertEqual(cart.add_class(fourth)[1].course, second)
+        self.assertEqual(cart.bits(), first.bits() | second.bits() | third.bits())
+        self.assertEqual(ShoppingCart.objects.get(id=cart.id).bits(), cart.bits())
+
+        cart.remove_class(first)
+        self.assertEqual(ShoppingCart.objects.get(id=cart.id).bits(), second.bits() | third.bits())
+
+        # CS 2150 moves to the afternoon; the sync rebuilds the carts holding it
+        cs[1]['meetings'] = meetings('TuTh', '14.00', '15.15')
+        sync_enrollment(cs)
+        cart = ShoppingCart.objects.get(id=cart.id)
+        self.assertEqual(cart.bits(), Course.objects.get(course_number=2).bits() | third.bits())
+        self.assertEqual(cart.add_class(fourth), (False, None))
+
+    def test_invalid_courses_have_empty_bitmaps(self):
+        """
+        Check that courses without weekday meetings store an empty bitmap, as they never conflict
+        """
+        upsert_courses([api_course('CS', '4993', 1, 'Independent Study', meetings=[
+            {"days": "-", "start_time": "", "end_time": "", "facility_description": ""}])])
+        self.assertEqual(Course.objects.get(course_number=1).bits(), 0)
+        self.assertEqual(bits_from_bytes(bits_to_bytes(meeting_bits(day_mask('Fr'), 0, 1435))), meeting_bits(day_mask('Fr'), 0, 1435))
+
+    def test_bad_upstream_times_dont_break_the_bitmap(self):
+        """
+        Check that a meeting ending before it starts covers nothing and one ending at midnight
+        stays in its own day, so one bad meeting can't fail a department sync
+        """
+        self.assertEqual(meeting_bits(day_mask('Mo'), 600, 500), 0)
+        self.assertEqual(meeting_bits(day_mask('Mo'), 1430, 1440), meeting_bits(day_mask('Mo'), 1430, 1435))
+        sunday = meeting_bits(day_mask('Su'), 1430, 1440)
+        self.assertLess(sunday.bit_length(), 7 * 288 + 1)
+        self.assertEqual(meeting_bits(day_mask('Tu'), 1300, 1440) >> 2 * 288, 0)
+
+        sync_enrollment([
+            api_course('CS', '2150', 1, 'Program and Data Representation', meetings=[
+                {"days": "MoWe", "start_time": "10.00.00.000000-05:00", "end_time": "08.20.00.000000-05:00", "facility_description": ""}]),
+            api_course('CS', '3240', 2, 'Advanced Software Development'),
+        ])
+        self.assertEqual(Course.objects.get(course_number=1).bits(), 0)
+        self.assertEqual(Course.objects.get(course_number=2).bits(), meeting_bits(day_mask('MoWe'), 17 * 60, 18 * 60 + 15))
+
 class ScheduleTests(TestCase):
 
     def test_schedule_url(self):
@@ -738,6 +1857,283 @@ class ScheduleTests(TestCase):
         self.assertContains(response, 'CS 1111')
         self.assertContains(response, 'Intro to cs')
 
+    def test_schedule_grid(self):
+        """
+        Check that the schedule page lays the cart out as a time grid, and that the grid is only
+        rebuilt when the cart changes
+        """
+        cache.clear()
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        def meetings(days, start, end):
+            return [{"days": days, "start_time": start + ".00.000000-05:00", "end_time": end + ".00.000000-05:00", "facility_description": "Rice 130"}]
+        upsert_courses([
+            api_course('CS', '2100', 1, 'Data Structures', meetings=meetings('MoWe', '13.00', '13.50')),
+            api_course('CS', '2150', 2, 'Program and Data Representation',
+                       meetings=meetings('TuTh', '09.30', '10.45') + meetings('We', '08.00', '08.50')),
+            api_course('CS', '3100', 3, 'Algorithms', meetings=meetings('Mo', '12.00', '12.50')),
+            api_course('CS', '4993', 4, 'Independent Study', meetings=[{"days": "-", "start_time": "", "end_time": "", "facility_description": ""}]),
+        ])
+        cart = ShoppingCart.objects.create(user=user)
+        for course in Course.objects.order_by('course_number'):
+            cart.add_class(course)
+
+        response = self.client.get('/NewLousList/schedule/')
+        grid = response.context['grid']
+        self.assertEqual(grid['days'], ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'])
+        self.assertEqual([row['start'] for row in grid['rows']],
+                         ['08:00 AM', '08:50 AM', '09:30 AM', '10:45 AM', '12:00 PM', '12:50 PM', '01:00 PM'])
+        # 8:00 row: only Wednesday has class
+        self.assertEqual([cell and cell['entries'][0]['course']['code'] for cell in grid['rows'][0]['cells']],
+                         [None, None, 'CS 2150', None, None])
+        # 9:30 row: Tu and Th run to 10:45, one row
+        tuesday = grid['rows'][2]['cells'][1]
+        self.assertEqual((tuesday['rowspan'], tuesday['entries'][0]['start'], tuesday['entries'][0]['where']), (1, '09:30 AM', 'Rice 130'))
+        # every row has one cell per day once the rowspans above are counted
+        covered = [0] * 5
+        for row in grid['rows']:
+            self.assertEqual(len(row['cells']), covered.count(0))
+            cells = iter(row['cells'])
+            for day in range(5):
+                if covered[day]:
+                    covered[day] -= 1
+                    continue
+                cell = next(cells)
+                covered[day] = (cell['rowspan'] if cell else 1) - 1
+        self.assertEqual([course['code'] for course in grid['other']], ['CS 4993'])
+        self.assertContains(response, 'Algorithms')
+        self.assertContains(response, 'Independent Study')
+
+        # a second view, say by a friend, reuses the grid
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/NewLousList/schedule/')
+        self.assertFalse(any('meeting' in query['sql'].lower() for query in queries.captured_queries))
+
+        cart.remove_class(Course.objects.get(course_number=3))
+        response = self.client.get('/NewLousList/schedule/')
+        self.assertNotContains(response, 'Algorithms')
+
+    def test_time_grid_merges_overlaps(self):
+        """
+        Check that meetings overlapping on a day share a cell and weekend columns only show when used
+        """
+        class Slot:
+            def __init__(self, days, start, end):
+                self.days, self.start_min, self.end_min = days, start, end
+        grid = time_grid([
+            ('a', [Slot(day_mask('Mo'), 540, 600)]),
+            ('b', [Slot(day_mask('Mo'), 570, 630)]),
+            ('c', [Slot(day_mask('Sa'), 600, 630)]),
+        ])
+        self.assertEqual(grid['days'], [0, 1, 2, 3, 4, 5])
+        self.assertEqual([row['start'] for row in grid['rows']], ['540', '570', '600'])
+        monday = grid['rows'][0]['cells'][0]
+        self.assertEqual(monday['rowspan'], 3)
+        self.assertEqual([entry['course'] for entry in monday['entries']], ['a', 'b'])
+        self.assertEqual(grid['rows'][2]['cells'], [None, None, None, None, {'rowspan': 1, 'entries': [{'course': 'c', 'start': '600', 'end': '630', 'where': ''}]}])
+
+class ScheduleBuilderTests(TestCase):
+
+    def meeting(self, days, start, end):
+        return {"days": days, "start_time": start + ".00.000000-05:00", "end_time": end + ".00.000000-05:00", "facility_description": ""}
+
+    def schedules(self, response):
+        # built in the view's thread and sent whole, never iterated on the event loop
+        self.assertFalse(response.streaming)
+        return [json.loads(line) for line in response.content.decode().splitlines()]
+
+    def test_build_schedules(self):
+        """
+        Check that every conflict-free combination of lecture and lab sections is returned
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([
+            api_course('CS', '2100', 1, 'Data Structures', course_section='001', meetings=[self.meeting('MoWe', '09.00', '09.50')]),
+            api_course('CS', '2100', 2, 'Data Structures', course_section='002', meetings=[self.meeting('MoWe', '11.00', '11.50')]),
+            api_course('CS', '2100', 3, 'Data Structures', course_section='101', component='LAB', meetings=[self.meeting('Mo', '11.00', '12.15')]),
+            api_course('CS', '2100', 4, 'Data Structures', course_section='102', component='LAB', meetings=[self.meeting('Tu', '11.00', '12.15')]),
+            api_course('APMA', '3080', 5, 'Linear Algebra', course_section='001', meetings=[self.meeting('MoWe', '09.00', '09.50')]),
+            api_course('APMA', '3080', 6, 'Linear Algebra', course_section='002', meetings=[self.meeting('TuTh', '11.00', '12.15')]),
+        ])
+
+        response = self.client.get(reverse('NewLousList:build_schedules'), {'courses': 'CS 2100, APMA3080'})
+        self.assertEqual(response.status_code, 200)
+        schedules = self.schedules(response)
+        picked = sorted(sorted(section['id'] for section in schedule) for schedule in schedules)
+        ids = dict((c.course_number, c.id) for c in Course.objects.all())
+        expected = [[ids[1], ids[3], ids[6]], [ids[2], ids[4], ids[5]]]
+        self.assertEqual(picked, sorted(sorted(schedule) for schedule in expected))
+
+        response = self.client.get(reverse('NewLousList:build_schedules'), {'courses': 'CS 2100, APMA 3080', 'limit': 1})
+        self.assertEqual(len(self.schedules(response)), 1)
+
+        response = self.client.get(reverse('NewLousList:build_schedules'), {'courses': 'CS 2100, ECON 2010'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['missing'], ['ECON 2010'])
+
+    def test_generate_schedules_with_many_sections(self):
+        """
+        Check that the search stops at the limit when every course has 35 sections
+        """
+        groups = []
+        for course in range(5):
+            groups.append([(meeting_bits(day_mask('MoWe'), 480 + 60 * (i % 10), 530 + 60 * (i % 10)), (course, i)) for i in range(35)])
+        schedules = list(generate_schedules(groups, 50))
+        self.assertEqual(len(schedules), 50)
+        for schedule in schedules:
+            self.assertEqual(len(set(i % 10 for course, i in schedule)), 5)
+
+
+    def test_ranked_schedules(self):
+        """
+        Check that schedules come back best first for the chosen preferences
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([
+            api_course('CS', '2100', 1, 'Data Structures', course_section='001', meetings=[self.meeting('MoWeFr', '08.00', '08.50')]),
+            api_course('CS', '2100', 2, 'Data Structures', course_section='002', meetings=[self.meeting('TuTh', '12.30', '13.45')]),
+            api_course('CS', '2100', 3, 'Data Structures', course_section='003', meetings=[self.meeting('MoWeFr', '13.00', '13.50')]),
+            api_course('APMA', '3080', 4, 'Linear Algebra', course_section='001', meetings=[self.meeting('TuTh', '14.00', '15.15')]),
+        ])
+        url = reverse('NewLousList:build_schedules')
+
+        response = self.client.get(url, {'courses': 'CS 2100, APMA 3080', 'days_off': 1})
+        first = self.schedules(response)[0]
+        self.assertEqual(sorted(section['course_section'] for section in first), ['001', '002'])
+
+        response = self.client.get(url, {'courses': 'CS 2100, APMA 3080', 'late_start': 1, 'limit': 2})
+        schedules = self.schedules(response)
+        self.assertEqual(len(schedules), 2)
+        self.assertEqual([section['course_section'] for section in schedules[0] if section['subject'] == 'CS'], ['003'])
+        self.assertEqual([section['course_section'] for section in schedules[1] if section['subject'] == 'CS'], ['002'])
+
+    def test_top_schedules_keeps_best(self):
+        """
+        Check that the bounded heap returns the same best schedules as scoring everything
+        """
+        weights = {'late_start': 1, 'gaps': 1, 'days_off': 2, 'compact': 0.5}
+        groups = []
+        for course in range(4):
+            groups.append([(meeting_bits(day_mask(['MoWeFr', 'TuTh'][i % 2]), 480 + 55 * i, 530 + 55 * i), (course, i)) for i in range(8)])
+        every = sorted(schedule_cost(occupancy_stats(bits), weights) for bits, schedule in search_schedules(groups, float('inf')))
+        best = [schedule_cost(occupancy_stats(bits), weights) for bits in
+                [sum(groups[course][i][0] for course, i in schedule) for schedule in top_schedules(groups, 5, weights)]]
+        self.assertEqual(best, every[:5])
+
+    def test_top_schedules_with_sections_that_never_meet(self):
+        """
+        Check that a partial schedule of only online sections is not pruned, as anything built on
+        it can still start late
+        """
+        groups = [
+            [(meeting_bits(day_mask('Tu'), 480, 530), 'tu8'), (0, 'online')],
+            [(meeting_bits(day_mask(days), 600, 650), name) for days, name in (('Mo', 'mon10a'), ('We', 'wed10'), ('Th', 'thu10'))],
+        ]
+        self.assertEqual(top_schedules(groups, 1, {'late_start': 1}), [['online', 'mon10a']])
+
+    def test_build_schedules_rejects_bad_weights(self):
+        """
+        Check that weights the ranking can't handle are refused rather than giving a wrong order
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([api_course('CS', '2100', 1, 'Data Structures')])
+        for query in ('late_start=-1', 'gaps=nan', 'days_off=inf', 'compact=lots'):
+            response = self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&' + query)
+            self.assertEqual(response.status_code, 400, query)
+        self.assertEqual(self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&late_start=1').status_code, 200)
+
+    def test_build_schedules_rejects_bad_semester(self):
+        """
+        Check that a semester that isn't a semester code is refused instead of failing the query
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([api_course('CS', '2100', 1, 'Data Structures')])
+        response = self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&semester=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('semester', response.json()['error'])
+        self.assertEqual(self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&semester=1228').status_code, 200)
+        self.assertEqual(self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&semester=1232').status_code, 404)
+
+    def test_build_schedules_rejects_bad_limits(self):
+        """
+        Check that a limit below one is refused instead of quietly returning no schedules, and a large one is capped
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([api_course('CS', '2100', 1, 'Data Structures')])
+        for limit in ('0', '-5', 'lots'):
+            response = self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&limit=' + limit)
+            self.assertEqual(response.status_code, 400, limit)
+        self.assertEqual(len(self.schedules(self.client.get('/NewLousList/schedulebuilder/?courses=CS2100&limit=1000'))), 1)
+
+
+class FreeTimeTests(TestCase):
+    def test_common_free_time(self):
+        """
+        Check that the free time endpoint intersects the student's and friends' carts, and only for friends
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        friend = User.objects.create_user(username='friend', password='pass', email='friend@gmail.com')
+        stranger = User.objects.create_user(username='stranger', password='pass', email='stranger@gmail.com')
+        Friendship.befriend(user, friend)
+        self.client.login(username=user.username, password='pass')
+        def meetings(days, start, end):
+            return [{"days": days, "start_time": start + ".00.000000-05:00", "end_time": end + ".00.000000-05:00", "facility_description": ""}]
+        upsert_courses([
+            api_course('CS', '2100', 1, 'Data Structures', meetings=meetings('MoWe', '09.00', '09.50')),
+            api_course('CS', '2150', 2, 'Program and Data Representation', meetings=meetings('MoTh', '11.00', '12.15')),
+        ])
+        ShoppingCart.objects.create(user=user).add_class(Course.objects.get(course_number=1))
+        ShoppingCart.objects.create(user=friend).add_class(Course.objects.get(course_number=2))
+
+        response = self.client.get('/NewLousList/freetime/?friends=friend&start=8:00 AM&end=5:00 PM&min=60')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['users'], ['testUser', 'friend'])
+        self.assertEqual(data['free']['Mo'], [{'start': '08:00 AM', 'end': '09:00 AM'}, {'start': '09:55 AM', 'end': '11:00 AM'}, {'start': '12:20 PM', 'end': '05:00 PM'}])
+        self.assertEqual(data['free']['Tu'], [{'start': '08:00 AM', 'end': '05:00 PM'}])
+        self.assertEqual(data['free']['We'][1], {'start': '09:55 AM', 'end': '05:00 PM'})
+        self.assertNotIn('Sa', data['free'])
+
+        response = self.client.get('/NewLousList/freetime/?friends=friend,stranger')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['usernames'], ['stranger'])
+        self.assertEqual(self.client.get('/NewLousList/freetime/?start=noon').status_code, 400)
+
+        # free until the end of the day is free until midnight, not noon
+        response = self.client.get('/NewLousList/freetime/?friends=friend&start=8:00 PM&end=24:00')
+        self.assertEqual(response.json()['free']['Tu'], [{'start': '08:00 PM', 'end': '12:00 AM'}])
+
+    def test_free_time_for_a_large_group(self):
+        """
+        Check that a group of 25 friends takes the same handful of queries as one
+        """
+        user = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user.username, password='pass')
+        upsert_courses([api_course('CS', str(1000 + i), i, 'Course', meetings=[
+            {"days": "TuTh", "start_time": f"{8 + i % 12:02d}.00.00.000000-05:00", "end_time": f"{8 + i % 12:02d}.30.00.000000-05:00", "facility_description": ""}])
+            for i in range(1, 26)])
+        names = []
+        for i, course in enumerate(Course.objects.order_by('course_number')):
+            friend = User.objects.create_user(username=f'friend{i}', password='pass', email=f'friend{i}@gmail.com')
+            Friendship.befriend(user, friend)
+            ShoppingCart.objects.create(user=friend).add_class(course)
+            names.append(friend.username)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.monotonic()
+            response = self.client.get('/NewLousList/freetime/?friends=' + ','.join(names))
+            elapsed = time.monotonic() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 8)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(response.json()['free']['Tu'], [{'start': '07:35 PM', 'end': '10:00 PM'}])
+        self.assertEqual(response.json()['free']['Mo'], [{'start': '08:00 AM', 'end': '10:00 PM'}])
+
 class ProfileTests(TestCase):
     def test_profile_page(self):
         """
@@ -829,7 +2225,7 @@ class FriendTests(TestCase):
         friend_request = FriendRequest.objects.filter(receiver=user1)
         response = self.client.post('/NewLousList/friendrequests/', {"friend_accept": friend_request})
         self.assertContains(response, "You have no requests.")
-        friend = FriendList.objects.get(user=user1).friends.all()[:1].get()
+        friend = Friendship.friends_of(user1)[:1].get()
         self.assertEqual(friend, user2 )
 
     def test_cancel_friend_request(self):
@@ -930,10 +2326,54 @@ class FriendTests(TestCase):
         response = self.client.get('/NewLousList/friends/')
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, user2.username)
-        friend = FriendList.objects.get(user=user1).unfriend(user2)
-        friend = FriendList.objects.get(user=user1).friends.all()
+        Friendship.unfriend(user1, user2)
+        friend = Friendship.friends_of(user1)
         self.assertEqual(friend.count(), 0)
 
+    def test_friendship_edges(self):
+        """
+        Check that a friendship is one row whichever way round it is made, and that checks,
+        mutual friends and unfriending are one query each
+        """
+        alice, bob, carol, dave = [User.objects.create_user(username=name, password='pass', email=name + '@gmail.com')
+                                   for name in ('alice', 'bob', 'carol', 'dave')]
+        Friendship.befriend(bob, alice)
+        Friendship.befriend(alice, bob)
+        Friendship.befriend(alice, alice)
+        Friendship.befriend(carol, alice)
+        Friendship.befriend(carol, bob)
+        Friendship.befriend(dave, bob)
+        self.assertEqual(Friendship.objects.count(), 4)
+        edge = Friendship.edge(bob, alice).get()
+        self.assertLess(edge.user_a_id, edge.user_b_id)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(Friendship.are_friends(bob, alice))
+        with self.assertNumQueries(1):
+            self.assertEqual(Friendship.mutual_friends(alice, bob).count(), 1)
+        self.assertEqual(list(Friendship.mutual_friends(alice, bob)), [carol])
+        self.assertEqual(sorted(user.username for user in Friendship.friends_of(bob)), ['alice', 'carol', 'dave'])
+        with self.assertNumQueries(1):
+            Friendship.unfriend(alice, bob)
+        self.assertFalse(Friendship.are_friends(alice, bob))
+        self.assertTrue(Friendship.are_friends(bob, carol))
+
+    def test_mutual_friends_on_profile(self):
+        """
+        Check that a friend's profile lists the friends the two have in common
+        """
+        alice, bob, carol, dave = [User.objects.create_user(username=name, password='pass', email=name + '@gmail.com')
+                                   for name in ('alice', 'bob', 'carol', 'dave')]
+        Friendship.befriend(alice, bob)
+        Friendship.befriend(alice, carol)
+        Friendship.befriend(bob, carol)
+        Friendship.befriend(bob, dave)
+        self.client.login(username='alice', password='pass')
+        response = self.client.get('/NewLousList/profile/bob')
+        self.assertEqual(list(response.context['friend_list']), [carol])
+        self.assertContains(response, 'carol')
+        self.assertNotContains(response, 'dave')
+
     def test_view_friend_profile(self):
         """
         Check that a friends profile can be viewed
@@ -1019,6 +2459,60 @@ class FriendTests(TestCase):
             self.assertContains(response, "Nice Schedule")
 
 
+class FriendSuggestionTests(TestCase):
+    def test_suggest_friends(self):
+        """
+        Check that suggestions are friends of friends ranked by mutual friends and shared courses,
+        leaving out friends and people with a pending request
+        """
+        alice, bob, carol, dave, erin, gina = [User.objects.create_user(username=name, password='pass', email=name + '@gmail.com')
+                                               for name in ('alice', 'bob', 'carol', 'dave', 'erin', 'gina')]
+        for user, friend in [(alice, bob), (alice, carol), (bob, dave), (carol, dave), (bob, erin), (bob, gina), (bob, carol)]:
+            Friendship.befriend(user, friend)
+        FriendRequest.objects.create(sender=alice, receiver=gina)
+        upsert_courses([api_course('CS', '2100', 1, 'Data Structures'), api_course('CS', '2150', 2, 'Program and Data Representation'),
+                        api_course('CS', '2100', 3, 'Data Structures', course_section='002', meetings=[])])
+        first, second, other_section = Course.objects.order_by('course_number')
+        ShoppingCart.objects.create(user=alice).class_list.add(first, second)
+        ShoppingCart.objects.create(user=erin).class_list.add(other_section, second)
+
+        out = io.StringIO()
+        call_command('suggest_friends', stdout=out)
+        self.assertIn('suggestions for', out.getvalue())
+        rows = FriendSuggestion.objects.filter(user=alice).order_by('-score')
+        self.assertEqual([(row.suggested.username, row.mutual_friends, row.shared_courses) for row in rows],
+                         [('dave', 2, 0), ('erin', 1, 2)])
+        self.assertFalse(FriendSuggestion.objects.filter(user=alice, suggested__in=[bob, carol, gina]).exists())
+
+        self.client.login(username='alice', password='pass')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/NewLousList/profile/')
+        self.assertContains(response, 'People You May Know')
+        self.assertContains(response, '2 mutual friends')
+        self.assertContains(response, '1 mutual friend, 2 shared courses')
+        # the page reads the stored rows rather than walking carts and friends
+        self.assertFalse(any('shoppingcart' in query['sql'].lower() for query in queries.captured_queries))
+
+        # someone befriended since the last run drops out straight away
+        Friendship.befriend(alice, dave)
+        response = self.client.get('/NewLousList/profile/')
+        self.assertEqual([row.suggested for row in response.context['suggestions']], [erin])
+        # and only your own profile shows suggestions
+        response = self.client.get('/NewLousList/profile/bob')
+        self.assertNotContains(response, 'People You May Know')
+
+    def test_suggestions_are_capped(self):
+        """
+        Check that each user keeps at most the limit of suggestions
+        """
+        hub = User.objects.create_user(username='hub', password='pass', email='hub@gmail.com')
+        users = [User.objects.create_user(username=f'user{i}', password='pass', email=f'user{i}@gmail.com') for i in range(15)]
+        for user in users:
+            Friendship.befriend(hub, user)
+        call_command('suggest_friends', '--limit', '5', stdout=io.StringIO())
+        self.assertEqual(FriendSuggestion.objects.filter(user=users[0]).count(), 5)
+        self.assertFalse(FriendSuggestion.objects.filter(user=hub).exists())
+
 class CourseReviewTests(TestCase):
 
     def test_course_reviews(self):
@@ -1041,3 +2535,57 @@ class CourseReviewTests(TestCase):
         #check if review is there
         response = self.client.get('/NewLousList/subject/FREN/11935/')
         self.assertContains(response, "Great Course!")
+
+    def test_review_summary_follows_reviews(self):
+        """
+        Check that posting, editing and deleting reviews keeps each course's summary row current
+        """
+        user1 = User.objects.create_user(username='testUser', password='pass', email='test@gmail.com')
+        self.client.login(username=user1.username, password='pass')
+        for text in ('Great Course!', 'Too much homework', 'Loved the labs'):
+            response = self.client.post('/NewLousList/review', {'subject': 'FREN', 'course_number': '1010', 'review_text': text})
+            self.assertEqual(response.status_code, 200)
+        self.client.post('/NewLousList/review', {'subject': 'CS', 'course_number': '3240', 'review_text': 'Fun project'})
+
+        summary = ReviewSummary.objects.get(subject='FREN', course_number='1010')
+        self.assertEqual(summary.review_count, 3)
+        self.assertEqual(summary.latest_review.review_text, 'Loved the labs')
+        self.assertEqual(ReviewSummary.objects.get(subject='CS').review_count, 1)
+
+        latest = summary.latest_review
+        latest.course_number = '1020'
+        latest.save()
+        summary.refresh_from_db()
+        self.assertEqual(summary.review_count, 2)
+        self.assertEqual(summary.latest_review.review_text, 'Too much homework')
+        self.assertEqual(ReviewSummary.objects.get(course_number='1020').review_count, 1)
+
+        Review.objects.get(review_text='Too much homework').delete()
+        summary.refresh_from_db()
+        self.assertEqual(summary.review_count, 1)
+        self.assertEqual(summary.latest_review.review_text, 'Great Course!')
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'checks the sqlite query plan')
+    def test_course_reviews_use_index(self):
+        """
+        Check that a course's reviews are read through the (subject, course_number) index a page at a time
+        """
+        Review.objects.bulk_create([Review(subject='FREN', course_number=str(1000 + i % 5), review_text=str(i)) for i in range(50)])
+        reviews = Review.objects.filter(subject='FREN', course_number='1002').order_by('-id')
+        with connection.cursor() as cursor:
+            sql, params = reviews.query.sql_with_params()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('review_course_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+        page, after = keyset_page(reviews, ['-id'], None, 6)
+        self.assertEqual([r.review_text for r in page], ['47', '42', '37', '32', '27', '22'])
+        page, after = keyset_page(reviews, ['-id'], after, 6)
+        self.assertEqual([r.review_text for r in page], ['17', '12', '7', '2'])
+        self.assertIsNone(after)
+
+        # ?reviews_after= is user input; a cursor that isn't an id starts over at the first page
+        for values in (['x'], [float('inf')], [10 ** 30]):
+            page, after = keyset_page(reviews, ['-id'], encode_cursor(values), 6)
+            self.assertEqual([r.review_text for r in page], ['47', '42', '37', '32', '27', '22'])
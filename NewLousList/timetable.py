@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from .models import format_time
+from .scheduling import time_grid
+
+# The schedule page's timetable, built once per cart version and then served from the cache to
+# the owner and any friend looking at it. Seat counts change all day without bumping the cart's
+# version, so they are left out.
+
+GRID_TIMEOUT = 7 * 24 * 60 * 60
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+# what the timetable shows of a course; plain values so any cache backend can store it
+def course_info(course):
+    return {
+        'id': course.id,
+        'code': f"{course.subject} {course.catalog_number}",
+        'description': course.description,
+        'course_section': course.course_section,
+        'component': course.component,
+        'units': course.units,
+        'instructor_name': course.instructor_name,
+    }
+
+
+# {'days': [day names], 'rows': [...], 'other': [...]}; rows are scheduling.time_grid's and
+# other holds the courses without regular weekday meetings
+def cart_grid(cart):
+    key = f'schedule-grid:{cart.id}:{cart.version}'
+    grid = cache.get(key)
+    if grid is None:
+        weekly = []
+        other = []
+        for course in cart.class_list.order_by('id').prefetch_related('meeting_set'):
+            if course.valid():
+                weekly.append((course_info(course), course.meeting_set.all()))
+            else:
+                other.append(course_info(course))
+        grid = time_grid(weekly, label=format_time)
+        grid['days'] = [DAY_NAMES[day] for day in grid['days']]
+        grid['other'] = other
+        cache.set(key, grid, GRID_TIMEOUT)
+    return grid
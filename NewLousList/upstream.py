@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Every call to luthers-list and vagrades goes through get() below, which shares one pooled
+# session per process (keep-alive connections get reused across requests), always sets a
+# timeout and retries failed GETs a bounded number of times. Per-host counters record how
+# many calls were made, how many failed and how long they took.
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds, for each attempt. The read timeout bounds every wait for data, not
+# the whole body. With the two retries below, one get() that keeps timing out holds its worker
+# for about 3 x (3.05 + 10) + 0.5 = 40s, and a server trickling a body out can hold it longer.
+TIMEOUT = (3.05, 10)
+
+# retry connection errors and gateway errors twice, straight away and then after 0.5s
+# (urllib3 skips the backoff before the first retry)
+RETRIES = Retry(
+    total=2,
+    backoff_factor=0.25,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD']),
+    raise_on_status=False,
+)
+
+POOL_SIZE = 10
+
+
+def make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=RETRIES)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = make_session()
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def record(host, seconds, error):
+    with _stats_lock:
+        host_stats = _stats.setdefault(host, {'requests': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        host_stats['requests'] += 1
+        host_stats['errors'] += error
+        host_stats['total_seconds'] += seconds
+        host_stats['max_seconds'] = max(host_stats['max_seconds'], seconds)
+
+
+# {host: {'requests', 'errors', 'total_seconds', 'max_seconds', 'avg_seconds'}} for this process
+def upstream_stats():
+    with _stats_lock:
+        stats = {host: dict(host_stats) for host, host_stats in _stats.items()}
+    for host_stats in stats.values():
+        host_stats['avg_seconds'] = host_stats['total_seconds'] / host_stats['requests']
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# GET url through the shared session. Raises requests.RequestException when the host can't be
+# reached or times out; server errors come back as responses and count as errors.
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', TIMEOUT)
+    host = urlsplit(url).netloc
+    start = time.monotonic()
+    try:
+        response = session.get(url, **kwargs)
+    except requests.RequestException:
+        record(host, time.monotonic() - start, True)
+        logger.warning('GET %s failed', url, exc_info=True)
+        raise
+    record(host, time.monotonic() - start, response.status_code >= 500)
+    return response
+
+
+# Request coalescing: when many requests want the same upstream payload at once, only one of
+# them fetches it and the rest wait for and share its result.
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    # runs fn() unless a call for key is already in flight in this process, in which case
+    # waits for that call and returns its result (or raises its error)
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+        except Exception as error:
+            call['error'] = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+        return call['result']
+
+
+flights = SingleFlight()
+
+# how long a coalesced result is kept for workers that were waiting on it
+SHARED_RESULT_TTL = 5
+# a worker that dies mid-fetch holds its lock for at most this long
+LOCK_TIMEOUT = 20
+# how long other workers wait for the lock holder before fetching themselves
+LOCK_WAIT = 15
+LOCK_POLL = 0.05
+
+
+# Cross-worker version of the above through the cache: the worker that gets the lock fetches
+# and shares the result for a few seconds with the workers polling for it. Only coalesces across
+# workers when they share a cache (REDIS_URL); with the default per-process cache it behaves
+# like a plain call.
+def shared_fetch(key, fn):
+    result_key = 'upstream-result:' + key
+    lock_key = 'upstream-lock:' + key
+    # a fetch can outlive LOCK_TIMEOUT, after which another worker may hold the lock; the token
+    # makes sure we only ever release our own
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, LOCK_TIMEOUT):
+        try:
+            result = fn()
+            cache.set(result_key, result, SHARED_RESULT_TTL)
+            return result
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        result = cache.get(result_key)
+        if result is not None:
+            return result
+        if cache.get(lock_key) is None:
+            # the holder failed without a result; one more look, then fetch ourselves
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            break
+    return fn()
+
+
+# fn()'s result, fetched at most once at a time per key in this process and (with a shared
+# cache) across workers
+def coalesce(key, fn):
+    return flights.do(key, lambda: shared_fetch(key, fn))
+
+
+# Stale-while-revalidate cache for upstream json. A payload younger than max_age is served
+# as is; an older one is still served straight away while one background refresh runs, and
+# until STALE_SECONDS it is also what gets served if the upstream is down. Refreshes send the
+# ETag / Last-Modified the upstream gave us, so an unchanged payload costs a 304 and no body.
+FRESH_SECONDS = 5 * 60
+STALE_SECONDS = 24 * 60 * 60
+
+
+def payload_key(key):
+    return 'upstream-payload:' + key
+
+
+def refresh_in_background(fn):
+    threading.Thread(target=fn, daemon=True).start()
+
+
+# GETs url (conditionally, if we have validators for it) and stores the payload
+# returns the entry {'data', 'fetched_at', 'etag', 'last_modified'}
+def revalidate(key, url):
+    entry = cache.get(payload_key(key))
+    headers = {}
+    if entry and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    response = get(url, headers=headers)
+    if entry and response.status_code == 304:
+        entry['fetched_at'] = time.time()
+    else:
+        response.raise_for_status()
+        entry = {
+            'data': response.json(),
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+    cache.set(payload_key(key), entry, STALE_SECONDS)
+    return entry
+
+
+# on_stale, if given, is called instead of starting the refresh thread (e.g. to queue a job
+# that does the refresh); it is called at most once per LOCK_TIMEOUT per key
+def cached_json(key, url, max_age=FRESH_SECONDS, on_stale=None):
+    entry = cache.get(payload_key(key))
+    if entry is None or max_age <= 0:
+        # nothing to serve yet (or the caller needs it current): fetch now, once for everyone
+        try:
+            return coalesce(key, lambda: revalidate(key, url))['data']
+        except requests.RequestException:
+            if entry is None:
+                raise
+            logger.warning('serving stale %s', key)
+            return entry['data']
+    if time.time() - entry['fetched_at'] > max_age and cache.add('upstream-refresh:' + key, 1, LOCK_TIMEOUT):
+        if on_stale is not None:
+            on_stale()
+            return entry['data']
+
+        def refresh():
+            try:
+                revalidate(key, url)
+            except requests.RequestException:
+                pass
+            finally:
+                cache.delete('upstream-refresh:' + key)
+        refresh_in_background(refresh)
+    return entry['data']
@@ -16,10 +16,15 @@ urlpatterns = [
     path('editprofile/', views.edit_profile, name="edit_profile"),
     path('profile/<str:owner>', views.view_profile, name="profile"),
     path('friendrequests/', views.view_requests, name="requests"),
-    path("search/", views.search_courses, name="search"),
+    path("search/", views.global_search, name="global_search"),
     path('cart/', views.cart_view, name='view_cart'),
     path('cart/<int:course_id>/', views.cart_add, name='cart'),
     path('cart/remove/<int:course_id>/', views.cart_delete, name='remove_cart'),
+    path('watch/<int:course_id>/', views.watch_course, name='watch_course'),
+    path('course/<int:course_id>/seats/', views.seat_history, name='seat_history'),
+    path('upstream/', views.upstream_status, name='upstream_status'),
+    path('schedulebuilder/', views.build_schedules, name='build_schedules'),
+    path('freetime/', views.common_free_time, name='common_free_time'),
     path('schedule/', views.create_schedule, name='schedule'),
     path('schedule/<str:owner>/', views.create_schedule, name='schedule'),
     path('edit_profile/', views.edit_profile, name='edit_profile'),
@@ -1,14 +1,27 @@
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404,render
-import requests
-from .models import Subject, Course, FriendList, FriendRequest, ShoppingCart, UserInfo, Comments, Review
-from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
+from asgiref.sync import sync_to_async
+import asyncio
+from django.shortcuts import get_object_or_404,render,redirect
+from .models import Subject, Course, Meeting, Friendship, FriendRequest, ShoppingCart, UserInfo, Comments, Review, ReviewSummary, SeatWatch, DAY_CODES, day_mask, format_time, parse_time
+from django.db.models import Q, F, Max
 from django.contrib.auth.models import User
 from .names import get_names
-from datetime import time, datetime
+from datetime import time, datetime, timedelta
+from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from .forms import NewReview, ContactForm
 from django.views import generic
+from .upstream import upstream_stats
+from .jobs import department_is_stale, queue_department_sync, queue_stale_department_sync, queue_subject_sync
+from .history import seat_curve
+from .grades import acached_grade, gpa_label
+from .catalog import course_to_api, fetch_department, normalize_meetings, subject_index
+from .search import akeyset_page, keyset_page, search
+from .scheduling import OBJECTIVES, bits_from_bytes, free_slots, generate_schedules, top_schedules
+from .timetable import cart_grid
+from .suggestions import suggestions_for
+import json, re
 from .names import get_names, college_arts_sci, edu_hum_dev_school, engr_school, other_schools
 
 SHOPPING_CART = set()
@@ -25,221 +38,86 @@ def courses_by_subject(request, subject_name):
     subject = get_object_or_404(Subject, subject=subject_name)
     #subject = Subject.objects.get(subject=subject_name)
 
-    #pull data from api for the specific subject
-    response = requests.get('http://luthers-list.herokuapp.com/api/dept/' + subject.subject + '?format=json')
-
-    #convert reponse data into json
-    courses = response.json()
+    # courses are loaded into the database by `manage.py sync_catalog`, so this page never calls the api
+    courses = Course.objects.filter(subject=subject.subject).order_by('catalog_number', 'course_section')
 
+    # organize courses by their class name in a dictonary; key: course name, value: list of courses that share the course name
+    # each Course row already carries its id, so the whole page is one course query however big the department is
     course_titles = {}
-    course_gpa = {}
-
-    course_id = {}
-
-    i = 1
-    # for each subject, create a python object using model
     for course in courses:
+        course_titles.setdefault(course.description, []).append(course)
 
-        # add course titles to a dictionary to help organize classes that have the same title
-        if course['description'] not in course_titles:
-            course_titles[course['description']] = []
-            course_gpa[course['description']] = 0
-
-         # create course objects for each subject
-
-        meetings = course['meetings']
-
-        # Standardize course meeting times
-        # First check if the list isn't empty
-        if len(meetings) > 0:
-            for meeting in meetings:
-                # Then check if start and end times have actual values to them
-                if (meeting['start_time'] != '') and meeting['end_time'] != '':
-                    # Convert hours to GMT-5 standard time format
-                    start_hour = meeting['start_time'][0:2]
-                    start_hour = int(start_hour)
-                    start_minute = meeting['start_time'][3:5]
-                    start_minute = int(start_minute)
-                    end_hour = meeting['end_time'][0:2]
-                    end_hour = int(end_hour)
-                    end_minute = meeting['end_time'][3:5]
-                    end_minute = int(end_minute)
-
-                    start_time = time(start_hour, start_minute)
-                    meeting['start_time'] = start_time.strftime('%I:%M %p')
-                    end_time = time(end_hour, end_minute)
-                    meeting['end_time'] = end_time.strftime('%I:%M %p')
-            course['meetings'] = meetings
-
-        Course.objects.get_or_create(
-            instructor_name=course['instructor']['name'],
-            instructor_email=course['instructor']['email'],
-            course_number=course['course_number'],
-            semester_code=course['semester_code'],
-            course_section=course['course_section'],
-            subject=course['subject'],
-            catalog_number=course['catalog_number'],
-            description=course['description'],
-            units=course['units'],
-            component=course['component'],
-            class_capacity=course['class_capacity'],
-            wait_list=course['wait_list'],
-            wait_cap=course['wait_cap'],
-            enrollment_total=course['enrollment_total'],
-            enrollment_available=course['enrollment_available'],
-            topic=course['topic'],
-            meetings=course['meetings']
-        )
+    # never synced or not lately: have run_worker fetch the department for the next visit
+    queue_stale_department_sync(subject)
 
-    # organize courses by their class name in a dictonary; key: course name, value: list of courses that share the course name
-    for course in courses:
-        c = Course.objects.get(course_number=course['course_number'])
-        c_id = c.id
-        course_with_id = {c_id:course}
-        course_titles[course['description']].append(course_with_id)
+    # sections this student is waiting on seats for
+    watched = set(SeatWatch.objects.filter(user=request.user, course__subject=subject.subject).values_list('course_id', flat=True))
 
     #display courses for that subject
-    return render(request, 'NewLousList/courses_by_subject.html', {'subject': subject,  'course_titles': course_titles, 'subject_id': subject_name})
+    return render(request, 'NewLousList/courses_by_subject.html', {'subject': subject,  'course_titles': course_titles, 'subject_id': subject_name, 'watched': watched})
 
-def single_course(request, subject_name, course_id):
+# starts or stops watching a section for open seats
+@login_required
+def watch_course(request, course_id):
+    course = get_object_or_404(Course, pk=course_id)
+    if request.method == 'POST':
+        watch, created = SeatWatch.objects.get_or_create(user=request.user, course=course)
+        if not created:
+            watch.delete()
+    return redirect('NewLousList:courses_by_subject', course.subject)
+
+# reviews shown per page on a course page
+REVIEWS_PER_PAGE = 20
+
+# Async so the gpa and the reviews are looked up at the same time and the page takes as long as
+# the slowest of them rather than their sum. Needs an ASGI server (see Procfile) to actually run
+# concurrently.
+async def single_course(request, subject_name, course_id):
     #subject = get_object_or_404(Subject, pk=subject_id)
-    subject = get_object_or_404(Subject, subject=subject_name)
-    response = requests.get('http://luthers-list.herokuapp.com/api/dept/' + subject.subject + '?format=json')
-    courses = response.json()
-    single_course = 0
-    for course in courses:
-        if course['course_number'] == course_id:
-            single_course = course
-
-    meetings = single_course['meetings']
-
-    # Standardize course meeting times
-    # First check if the list isn't empty
-    if len(meetings) > 0:
-        for meeting in meetings:
-            # Then check if start and end times have actual values to them
-            if (meeting['start_time'] != '') and meeting['end_time'] != '':
-                # Convert hours to GMT-5 standard time format
-                start_hour = meeting['start_time'][0:2]
-                start_hour = int(start_hour)
-                start_minute = meeting['start_time'][3:5]
-                start_minute = int(start_minute)
-                end_hour = meeting['end_time'][0:2]
-                end_hour = int(end_hour)
-                end_minute = meeting['end_time'][3:5]
-                end_minute = int(end_minute)
-
-                start_time = time(start_hour, start_minute)
-                meeting['start_time'] = start_time.strftime('%I:%M %p')
-                end_time = time(end_hour, end_minute)
-                meeting['end_time'] = end_time.strftime('%I:%M %p')
-        single_course['meetings'] = meetings
-
-    html = 'https://vagrades.com/api/uva/course/'
-    new_html = html + subject_name + str(single_course['catalog_number'])
-    response = requests.get(new_html)
-    gpa = 0
-    letter = "GPA NOT FOUND"
-    if response:
-        class_info = response.json()
-        gpa = class_info["course"]["avg"]
-        if gpa:
-            gpa  = round(gpa,2)
-             
-            if gpa > 3.7:
-                letter = "A"
-            elif gpa > 3.3:
-                letter = "A-"
-            elif gpa > 3.0:
-                letter = "B+"
-            elif gpa > 2.7:
-                letter = "B"
-            elif gpa > 2.3:
-                letter = "B-"
-            elif gpa > 2.0:
-                letter = "C+"
-            elif gpa > 1.7:
-                letter = "C"
-            elif gpa > 1.3:
-                letter = "C-"
-            elif gpa > 1.0:
-                letter = "D+"
-            elif gpa > 0.7:
-                letter = "D"
-            elif gpa > 0.3:
-                letter = "D-"
-            else:
-                letter = "F"
-    gpa = str(gpa) + " (" + letter + ")" 
-    class_reviews = []
-    for r in Review.objects.all():
-        print(r.review_text)
-        if r.subject == subject_name and r.course_number == single_course['catalog_number']:
-            class_reviews.append(r)
-    return render(request, 'NewLousList/single_course.html', {'course_id' : course_id, 'subject_id' : subject_name, 'single_course' : single_course, 'gpa': gpa, 'all_reviews' : class_reviews})
+    subject = await Subject.objects.filter(subject=subject_name).afirst()
+    if subject is None:
+        raise Http404('No such subject')
+
+    # The synced copy of the section is rendered as is, so the page doesn't need luthers-list at
+    # all once the department has been synced. Course numbers are only unique within a semester,
+    # so the latest semester's section of this subject wins.
+    course = await Course.objects.filter(subject=subject.subject, course_number=course_id).order_by('-semester_code').afirst()
+    if course is not None:
+        single_course = course_to_api(course)
+        # the seat counts are as old as the department's last sync
+        if department_is_stale(subject):
+            await sync_to_async(queue_department_sync)(subject.subject)
+    else:
+        # not synced yet: the gpa and reviews have to wait for the api to find the catalog number
+        courses = await sync_to_async(fetch_department, thread_sensitive=False)(subject.subject)
+        single_course = next((course for course in courses if course['course_number'] == course_id), None)
+        if single_course is None:
+            raise Http404('No such course')
+        # Standardize course meeting times
+        single_course['meetings'] = normalize_meetings(single_course['meetings'])
+    catalog_number = str(single_course['catalog_number'])
+
+    # one page of this course's reviews, newest first, plus its count from ReviewSummary
+    reviews = Review.objects.filter(subject=subject_name, course_number=catalog_number)
+    grade, (class_reviews, next_cursor), summary = await asyncio.gather(
+        # average gpa from the CourseGrade table; run_worker refreshes it if it is missing or stale
+        acached_grade(subject_name, catalog_number),
+        akeyset_page(reviews, ['-id'], request.GET.get('reviews_after'), REVIEWS_PER_PAGE),
+        ReviewSummary.objects.filter(subject=subject_name, course_number=catalog_number).afirst(),
+    )
+
+    gpa = gpa_label(grade)
+    review_count = summary.review_count if summary else 0
+    return await sync_to_async(render)(request, 'NewLousList/single_course.html', {'course_id' : course_id, 'subject_id' : subject_name, 'single_course' : single_course, 'gpa': gpa,
+                                                                                 'all_reviews' : class_reviews, 'review_count': review_count, 'reviews_after': next_cursor})
 
 @login_required
 def index(request):
-    
-    # pull data on subjects from api
-    response = requests.get('http://luthers-list.herokuapp.com/api/deptlist?format=json')
-
-    # convert reponse data into json
-    subjects = response.json()
-
-    #dictionary for actual subject names, so we dont have to use mnemonics
-
-    engr_list = []
-    college_list = []
-    edu_list = []
-    other_list = []
-
-    #for each subject, create a python object using model
-    for sub in subjects:
-        Subject.objects.get_or_create(subject=sub['subject'],name=get_names[sub['subject']])
-
-
-    #list of all the subjects
-    allSubjects = Subject.objects.all()
-
-    # Sort Subjects into schools
-    for sub in college_arts_sci.keys():
-        # print(sub)
-        # temp_subs = Subject.objects.filter(Q(subject__icontains=sub))
-        try:
-            college_list.append(get_object_or_404(Subject, subject=sub))
-        except:
-            college_list.append(Subject.objects.filter(Q(subject__icontains=sub))[1])  
-        # college_list.append(Subject.objects.filter(Q(subject__icontains=sub))[0])
-
-    for sub in engr_school.keys():
-        try:
-            engr_list.append(get_object_or_404(Subject, subject=sub))
-        except:
-            engr_list.append(Subject.objects.filter(Q(subject__icontains=sub))[1]) 
-
-    for sub in edu_hum_dev_school.keys():
-        try:
-            edu_list.append(get_object_or_404(Subject, subject=sub))
-        except:
-            edu_list.append(Subject.objects.filter(Q(subject__icontains=sub))[1]) 
-
-    for sub in other_schools.keys():
-        try:
-            other_list.append(get_object_or_404(Subject, subject=sub))
-        except:
-            other_list.append(Subject.objects.filter(Q(subject__icontains=sub))[1]) 
-
-    filteredSubjects = []
-
-    context = {
-        'subjects': allSubjects,
-        'filtered': filteredSubjects,
-        'engr_list': engr_list,
-        'college_list': college_list,
-        'edu_list': edu_list,
-        'other_list': other_list
-    }
+    # subjects grouped into schools, cached until sync_catalog adds subjects
+    context = subject_index()
+    if not context['subjects']:
+        # first visit to an empty database: have run_worker pull the department list
+        queue_subject_sync()
 
     # Search feature for departments
     if 'search' in request.GET:
@@ -250,11 +128,31 @@ def index(request):
             'filtered': filteredSubjects
         }
 
-        return render(request, "NewLousList/index.html", context)
-
     return render(request, "NewLousList/index.html", context)
 
 
+# Meetings on all of the given days (e.g. "TuTh") that start at or after start_time and end by end_time
+# returns None when no day or time filter was given
+def meeting_filter(day, start_time, end_time):
+    meetings = Meeting.objects.all()
+    filtered = False
+    mask = day_mask(day)
+    if mask:
+        meetings = meetings.annotate(on_days=F('days').bitand(mask)).filter(on_days=mask)
+        filtered = True
+    try:
+        start_min = parse_time(start_time)
+        end_min = parse_time(end_time)
+    except (ValueError, IndexError):
+        start_min = end_min = None
+    if start_min is not None:
+        meetings = meetings.filter(start_min__gte=start_min)
+        filtered = True
+    if end_min is not None:
+        meetings = meetings.filter(end_min__lte=end_min)
+        filtered = True
+    return meetings if filtered else None
+
 @login_required
 def search_courses(request, subject_name):
 
@@ -267,21 +165,20 @@ def search_courses(request, subject_name):
         catalog_num = request.GET.get('catalog_number')
         units = request.GET.get('units')
         component = request.GET.get('component')
-        # start_time = request.GET.get('start_time')
-        # end_time = request.GET.get('end_time')
-        # day = request.GET.get('day')
-        # location = request.GET.get('location ')
+        day = request.GET.get('day')
+        start_time = request.GET.get('start_time')
+        end_time = request.GET.get('end_time')
 
 
         submitbutton = request.GET.get('submit')
 
 
         results = Course.objects.filter(subject = subject.subject)
-        if prof:
-            results = results.filter(Q(instructor_name__icontains=prof))
 
-        if title:
-            results = results.filter(Q(description__icontains=title))
+        # title, instructor and free text keywords all go through the full-text index, best match first
+        keywords = ' '.join(text for text in (title, prof, request.GET.get('q')) if text)
+        if keywords:
+            results = search(results, keywords)
 
         if catalog_num:
             results = results.filter(Q(catalog_number__icontains=catalog_num))
@@ -292,12 +189,10 @@ def search_courses(request, subject_name):
         if component:
             results = results.filter(Q(component__icontains=component))
 
-        # if day:
-        #     for item in meetings:
-        #         results = results.filter(Q(meetings__days__icontains=day))
-
-        # if start_time:
-        #     results = results.filter(Q(meetings__start_time__icontains=start_time))
+        # day and time filters run against the indexed Meeting table
+        meetings = meeting_filter(day, start_time, end_time)
+        if meetings is not None:
+            results = results.filter(id__in=meetings.values('course_id'))
 
 
         context = {'results': results,
@@ -311,12 +206,87 @@ def search_courses(request, subject_name):
     else:
         return render(request, 'NewLousList/search_courses.html', {'subject': subject})
 
+# longest window ?days= can ask seat_history for
+MAX_HISTORY_DAYS = 365
+
+# open seats and wait list of one section over time, e.g. ?days=7 for the last week
+@login_required
+def seat_history(request, course_id):
+    course = get_object_or_404(Course, id=course_id)
+    since = None
+    days = request.GET.get('days')
+    if days:
+        try:
+            # a year covers any semester's history and keeps huge values (1e10, inf) in timedelta's range
+            since = timezone.now() - timedelta(days=min(max(float(days), 0), MAX_HISTORY_DAYS))
+        except ValueError:
+            return JsonResponse({'error': 'days must be a number'}, status=400)
+    points = [{'taken_at': taken_at.isoformat(), 'available': available, 'wait_list': wait_list}
+              for taken_at, available, wait_list in seat_curve(course, since)]
+    return JsonResponse({
+        'course_id': course.id,
+        'subject': course.subject,
+        'catalog_number': course.catalog_number,
+        'course_section': course.course_section,
+        'class_capacity': course.class_capacity,
+        'wait_cap': course.wait_cap,
+        'points': points,
+    })
+
+# call counts, errors and latency of luthers-list and vagrades as seen by this worker
+@staff_member_required
+def upstream_status(request):
+    return JsonResponse(upstream_stats())
+
+# largest page the global course search will render
+MAX_PAGE_SIZE = 100
+
+@login_required
+def global_search(request):
+    results = Course.objects.all()
+    subject = request.GET.get('subject')
+    if subject:
+        results = results.filter(subject=subject.upper())
+    units = request.GET.get('units')
+    if units:
+        results = results.filter(units=units)
+    component = request.GET.get('component')
+    if component:
+        results = results.filter(component=component.upper())
+    if request.GET.get('open'):
+        results = results.filter(enrollment_available__gt=0)
+    meetings = meeting_filter(request.GET.get('day'), request.GET.get('start_time'), request.GET.get('end_time'))
+    if meetings is not None:
+        results = results.filter(id__in=meetings.values('course_id'))
+
+    q = request.GET.get('q')
+    if q:
+        results = search(results, q)
+        ordering = ['-rank', 'id']
+    else:
+        ordering = ['subject', 'catalog_number', 'id']
+
+    try:
+        size = min(max(int(request.GET.get('size', 25)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        size = 25
+    page, next_cursor = keyset_page(results, ordering, request.GET.get('after'), size)
+
+    # the next page link keeps every filter and only swaps the cursor
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['after'] = next_cursor
+        next_query = params.urlencode()
+    context = {'results': page, 'next_query': next_query, 'searched': bool(request.GET)}
+    return render(request, 'NewLousList/global_search.html', context)
+
 @login_required
 def friend_search(request):
     if request.method=='POST':
         recipient = request.POST.get("recipient", "")
         curr_user = User.objects.get(username=request.user)
-        if recipient and not FriendRequest.objects.filter(receiver = User.objects.get(username=recipient)).filter(sender=curr_user) and (not FriendList.objects.filter(user = curr_user) or not FriendList.objects.get(user = curr_user).is_mutual_friend(User.objects.get(username=recipient))):
+        if recipient and not FriendRequest.objects.filter(receiver = User.objects.get(username=recipient)).filter(sender=curr_user) and not Friendship.are_friends(curr_user, User.objects.get(username=recipient)):
             new_request = FriendRequest.objects.create(receiver = User.objects.get(username=recipient), sender = User.objects.get(username=request.user), is_active = True)
         request_username = request.POST.get("username", "")
         no_search = False
@@ -340,10 +310,6 @@ def view_requests(request):
         if is_accept:
             curr_sender = User.objects.get(username = request.POST.get("friend_accept", ""))
             completed_request, created = FriendRequest.objects.filter(sender = curr_sender).filter(receiver = curr_user).get_or_create(is_active = True)
-            if not FriendList.objects.filter(user = curr_user):
-                FriendList.objects.create(user = curr_user)
-            if not FriendList.objects.filter(user = curr_sender):
-                FriendList.objects.create(user = curr_sender)
             completed_request.accept()
         elif is_decline:
             curr_sender = User.objects.get(username = request.POST.get("friend_decline", ""))
@@ -362,9 +328,8 @@ def view_friends(request):
     curr_user = User.objects.get(username=request.user)
     if(request.method == 'POST'):
         curr_remove = User.objects.get(username = request.POST.get("friend_remove", ""))
-        FriendList.objects.get(user = curr_user).unfriend(curr_remove)
-    friend_list, created = FriendList.objects.get_or_create(user = curr_user)
-    friend_list = friend_list.friends.all()
+        Friendship.unfriend(curr_user, curr_remove)
+    friend_list = Friendship.friends_of(curr_user).order_by('username')
     return render(request, 'NewLousList/friends.html',
         {"request_type":request.method, "friend_list":friend_list})
 
@@ -376,11 +341,12 @@ def view_profile(request, owner = None):
     else:
         owner_user = curr_user
     owner_profile, created = UserInfo.objects.get_or_create(user = owner_user)
-    user_list, created = FriendList.objects.get_or_create(user = curr_user)
-    owner_list, created = FriendList.objects.get_or_create(user = owner_user)
-    mutuals = user_list.friends.all() & owner_list.friends.all()
+    mutuals = Friendship.mutual_friends(curr_user, owner_user).order_by('username')
+    # precomputed by suggest_friends, only shown on your own profile
+    suggestions = suggestions_for(curr_user) if owner_user == curr_user else []
     return render(request, 'NewLousList/profile.html',
-        {"request_type":request.method, "user":curr_user, "profile":owner_profile, "owner":owner_user, "friend_list":mutuals})
+        {"request_type":request.method, "user":curr_user, "profile":owner_profile, "owner":owner_user, "friend_list":mutuals,
+         "suggestions":suggestions})
 
 @login_required
 def edit_profile(request):
@@ -438,22 +404,13 @@ def cart_delete(request, course_id):
 
 @login_required
 def create_schedule(request, owner = None):
-    def by_hour(ele):
-        # start_hour = ele['start_time'][0:2]
-        # start_hour = int(start_hour)
-        # start_minute = ele['start_time'][3:5]
-        # start_minute = int(start_minute)
-
-        return ele.meetings[0]['start_time']
-
     curr_user = User.objects.get(username=request.user)
     if owner:
         owner_user = User.objects.get(username=owner)
     else:
         owner_user = curr_user
     not_friended = False
-    user_flist, created = FriendList.objects.get_or_create(user = curr_user)
-    if owner_user != curr_user and not owner_user in user_flist.friends.all():
+    if owner_user != curr_user and not Friendship.are_friends(curr_user, owner_user):
         owner = request.user
         owner_user = curr_user
         not_friended = True
@@ -464,80 +421,11 @@ def create_schedule(request, owner = None):
     if deleted_id:
         Comments.objects.get(id = deleted_id).delete()
     cart,created = ShoppingCart.objects.get_or_create(user = owner_user)
-    class_list = cart.class_list.all()
-    # lists to order times
-    ordered_list = []
-    ordered_list_AM = []
-    ordered_list_PM = []
-    # sets to order days
-    Mo_set = set()
-    Tu_set = set()
-    We_set = set()
-    Th_set = set()
-    Fr_set = set()
-    other_set = set()
-
-    #print(SHOPPING_CART)
-    for course in class_list:
-        if not course.valid():
-            other_set.add(course)
-            continue
-        meetings_list = course.meetings
-        # print(meetings_list)
-        for meeting in meetings_list:
-            # separate course into different lists based on AM or PM
-            if 'AM' in meeting['start_time']:
-                #print(meeting['start_time'])
-                ordered_list_AM.append(course)
-            else:
-                ordered_list_PM.append(course)
-
-            # key=meeting['start_time'])
-            # sort lists
-            ordered_list_AM = sorted(ordered_list_AM, key=by_hour)
-            ordered_list_PM = sorted(ordered_list_PM, key=by_hour)
-            #print(ordered_list_AM)
-            #print(ordered_list_PM)
-        # join lists together
-        #print(ordered_list)
-        for course in ordered_list_AM:
-            ordered_list.append(course)
-            #print(ordered_list)
-        for course in ordered_list_PM:
-            ordered_list.append(course)
-            #print(ordered_list)
-        #print(ordered_list)
-    # add courses in ordered list to respective day
-    for course in ordered_list:
-        for meeting in course.meetings:
-            if 'Mo' in meeting['days']:
-                Mo_set.add(course)
-            if 'Tu' in meeting['days']:
-                Tu_set.add(course)
-            if 'We' in meeting['days']:
-                We_set.add(course)
-            if 'Th' in meeting['days']:
-                Th_set.add(course)
-            if 'Fr' in meeting['days']:
-                Fr_set.add(course)
-        # remove course from cart
-        # SHOPPING_CART.remove(course)
-
-    # for course in Mo_set:
-    # print(Mo_set, Tu_set, We_set, Th_set, Fr_set)
-
-    # comments =  if owner else None
-
 
     comments = Comments.objects.filter(receiver = owner_user).order_by("-id")
     context = {
-        # 'cart': SHOPPING_CART,
-        'Mo_set': Mo_set,
-        'Tu_set': Tu_set,
-        'We_set': We_set,
-        'Th_set': Th_set,
-        'Fr_set': Fr_set,
-        'other_set': other_set,
+        # built once per change to the cart, see timetable.py
+        'grid': cart_grid(cart),
         'owner': owner_user,
         'comments' : comments,
         'user' : curr_user,
@@ -546,6 +434,121 @@ def create_schedule(request, owner = None):
     return render(request, 'NewLousList/schedule.html', context)
 
 
+# most schedules a single schedule builder request can ask for
+MAX_SCHEDULES = 100
+
+# "CS 2100" or "CS2100" -> ('CS', '2100')
+COURSE_PATTERN = re.compile(r'([A-Za-z]+)\s*(\d+[A-Za-z]?)')
+
+# json for one section in a generated schedule
+def section_json(course):
+    return {
+        'id': course.id,
+        'subject': course.subject,
+        'catalog_number': course.catalog_number,
+        'course_section': course.course_section,
+        'component': course.component,
+        'instructor_name': course.instructor_name,
+        'meetings': [str(meeting) for meeting in course.meeting_set.all()],
+    }
+
+@login_required
+def build_schedules(request):
+    wanted = COURSE_PATTERN.findall(request.GET.get('courses', ''))
+    if not wanted:
+        return JsonResponse({'error': 'give courses as ?courses=CS 2100,APMA 3080'}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), MAX_SCHEDULES)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return JsonResponse({'error': f'limit must be a number from 1 to {MAX_SCHEDULES}'}, status=400)
+
+    query = Q()
+    for subject, catalog_number in wanted:
+        query |= Q(subject=subject.upper(), catalog_number=catalog_number)
+    sections = Course.objects.filter(query)
+    if request.GET.get('open'):
+        sections = sections.filter(enrollment_available__gt=0)
+    # only combine sections from one semester, the latest one unless asked for
+    if request.GET.get('semester'):
+        try:
+            semester = int(request.GET['semester'])
+        except ValueError:
+            return JsonResponse({'error': 'semester must be a semester code, e.g. 1238'}, status=400)
+    else:
+        semester = sections.aggregate(Max('semester_code'))['semester_code__max']
+    sections = sections.filter(semester_code=semester).prefetch_related('meeting_set').order_by('course_section')
+
+    # one group per course and component, e.g. CS 2100 LEC and CS 2100 LAB are picked separately
+    groups = {}
+    for course in sections:
+        # the stored bitmap; courses without regular weekday meetings have an empty one and never conflict
+        groups.setdefault((course.subject, course.catalog_number, course.component), []).append((course.bits(), course))
+    found = set((subject, catalog_number) for subject, catalog_number, component in groups)
+    missing = [f"{subject.upper()} {catalog_number}" for subject, catalog_number in wanted if (subject.upper(), catalog_number) not in found]
+    if missing:
+        return JsonResponse({'error': 'no sections found', 'missing': missing}, status=404)
+
+    # preference weights, e.g. ?late_start=1&days_off=2
+    # the ranking prunes on a lower bound that only holds for non-negative weights
+    weights = {}
+    for objective in OBJECTIVES:
+        try:
+            weights[objective] = float(request.GET.get(objective, 0))
+        except ValueError:
+            weights[objective] = -1
+        if not 0 <= weights[objective] < float('inf'):
+            return JsonResponse({'error': f'{objective} must be a number, 0 or more'}, status=400)
+    if any(weights.values()):
+        schedules = top_schedules(list(groups.values()), limit, weights)
+    else:
+        schedules = generate_schedules(list(groups.values()), limit)
+
+    # One json line per schedule. The search runs to the end here, in the thread the view runs in
+    # under ASGI too, and the at most MAX_SCHEDULES results are sent in one response: a streamed
+    # sync generator would run the search on the event loop (or be buffered anyway on newer Django).
+    lines = [json.dumps([section_json(course) for course in schedule]) + '\n' for schedule in schedules]
+    return HttpResponse(''.join(lines), content_type='application/x-ndjson')
+
+
+# most people one free time request can compare
+MAX_FREE_TIME_GROUP = 50
+
+# Times this week when the student and every friend listed in ?friends=alice,bob are all out of
+# class, from the occupancy bitmaps stored on their carts (one query for the whole group).
+# ?min=60 sets the shortest stretch worth listing, ?start=9:00 AM&end=5:00 PM the hours looked at.
+@login_required
+def common_free_time(request):
+    usernames = [name for name in request.GET.get('friends', '').split(',') if name]
+    if len(usernames) > MAX_FREE_TIME_GROUP:
+        return JsonResponse({'error': f'at most {MAX_FREE_TIME_GROUP} friends at a time'}, status=400)
+    try:
+        min_minutes = int(request.GET.get('min', 30))
+        day_start = parse_time(request.GET['start']) if request.GET.get('start') else 8 * 60
+        day_end = parse_time(request.GET['end']) if request.GET.get('end') else 22 * 60
+    except ValueError:
+        return JsonResponse({'error': 'min must be minutes, start and end times like 9:00 AM'}, status=400)
+    if not 0 <= day_start < day_end <= 24 * 60:
+        return JsonResponse({'error': 'start must be before end'}, status=400)
+
+    # only people on the student's friend list
+    friends = dict(Friendship.friends_of(request.user).filter(username__in=usernames).values_list('id', 'username'))
+    not_friends = sorted(set(usernames) - set(friends.values()))
+    if not_friends:
+        return JsonResponse({'error': 'not on your friend list', 'usernames': not_friends}, status=403)
+
+    # people without a cart have no classes
+    busy = 0
+    for occupancy in ShoppingCart.objects.filter(user_id__in=[request.user.id, *friends]).values_list('occupancy', flat=True):
+        busy |= bits_from_bytes(occupancy)
+    free = free_slots(busy, day_start, day_end, min_minutes)
+    return JsonResponse({
+        'users': [request.user.username] + sorted(friends.values()),
+        'free': {DAY_CODES[day]: [{'start': format_time(start), 'end': format_time(end)} for start, end in stretches]
+                 for day, stretches in enumerate(free)},
+    })
+
 def review(request):
     form = NewReview()
     if request.method == 'POST':
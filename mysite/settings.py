@@ -168,4 +168,21 @@ if 'DATABASE_URL' in os.environ:
 else:
     SITE_ID = 4
 
+# Subject index, upstream fetch locks and payload caches live in the cache. Each worker has its
+# own in-memory cache unless REDIS_URL points them all at one redis.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
 
+# seat opening emails (NewLousList/notifications.py); printed to the console unless configured
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = 'EMAIL_USE_TLS' in os.environ
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'New Lou\'s List <noreply@newlouslist.example>')